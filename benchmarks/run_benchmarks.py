@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Ableton AG, Berlin. All rights reserved.
+#
+# Use of this source code is governed by a MIT-style
+# license that can be found in the LICENSE file.
+
+"""Benchmarks for the hot paths of the run_codenarc script.
+
+The benchmarks run against synthetic CodeNarc reports and outputs, and measure the time
+and peak memory usage of each function. The results are saved to a JSON file, which can
+be compared against the results of another commit with the --compare option.
+"""
+
+import argparse
+import contextlib
+import gc
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from collections.abc import Callable, Iterator
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import run_codenarc
+
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+FILES_PER_PACKAGE = 10
+PACKAGE_DEPTH = 8
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+VIOLATIONS_PER_FILE = 10
+
+log = logging.getLogger(__name__)
+
+
+def _benchmarks(
+    report_file: str, output_file: str, output_lines: list[str]
+) -> dict[str, Callable[[], object]]:
+    """Get the functions to benchmark for one size of generated inputs."""
+    return {
+        "parse_xml_report": lambda: _parse_report(report_file),
+        "_print_violations": lambda: _print_violations(report_file),
+        "_log_codenarc_output": lambda: run_codenarc._log_codenarc_output(  # noqa: SLF001
+            _read_lines(output_file)
+        ),
+        "_is_slf4j_line": lambda: [
+            run_codenarc._is_slf4j_line(line)  # noqa: SLF001
+            for line in output_lines
+        ],
+    }
+
+
+def _generate_output(path: str, num_lines: int) -> None:
+    """Write a synthetic CodeNarc output with SLF4J and continuation lines."""
+    with open(path, "w", encoding="utf-8") as output_fp:
+        for index in range(num_lines):
+            if index % 10 == 0:
+                output_fp.write(
+                    "INFO org.codenarc.source.AbstractSourceCode - Compilation failed"
+                    f" for file_{index}.groovy\n"
+                )
+            elif index % 10 < 4:  # noqa: PLR2004
+                output_fp.write(f"\tat org.codehaus.groovy.Stack.frame{index}(Stack:1)\n")
+            else:
+                output_fp.write(
+                    f"DEBUG org.codenarc.analyzer.AbstractSourceAnalyzer - line {index}\n"
+                )
+        output_fp.write("CodeNarc completed: (p1=0; p2=0; p3=0) 6664ms\n")
+
+
+def _generate_report(path: str, num_violations: int) -> None:
+    """Write a synthetic CodeNarc XML report with a deep package tree."""
+    num_files = max(1, num_violations // VIOLATIONS_PER_FILE)
+    num_packages = max(1, num_files // FILES_PER_PACKAGE)
+    with open(path, "w", encoding="utf-8") as report_fp:
+        report_fp.write(
+            "<?xml version='1.0' encoding='UTF-8'?>\n"
+            "<CodeNarc url='https://codenarc.org' version='3.4.0'>\n"
+            f"  <PackageSummary totalFiles='{num_files}'"
+            f" filesWithViolations='{num_files}' priority1='0'"
+            f" priority2='{num_violations}' priority3='0'/>\n"
+        )
+        violation_index = 0
+        for package_index in range(num_packages):
+            package_path = "/".join(
+                f"pkg{(package_index >> level) % 4}" for level in range(PACKAGE_DEPTH)
+            )
+            report_fp.write(
+                f"  <Package path='{package_path}/p{package_index}'"
+                f" totalFiles='{FILES_PER_PACKAGE}' filesWithViolations='1'"
+                " priority1='0' priority2='1' priority3='0'>\n"
+            )
+            for file_index in range(FILES_PER_PACKAGE):
+                report_fp.write(f"    <File name='File{file_index}.groovy'>\n")
+                for line in range(VIOLATIONS_PER_FILE):
+                    if violation_index == num_violations:
+                        break
+                    violation_index += 1
+                    report_fp.write(
+                        "      <Violation ruleName='MethodReturnTypeRequired'"
+                        f" priority='2' lineNumber='{line + 1}'>\n"
+                        f"        <SourceLine><![CDATA[def foo{line}() {{]]>"
+                        "</SourceLine>\n"
+                        f'        <Message><![CDATA[Method "foo{line}" has a dynamic'
+                        " return type]]></Message>\n"
+                        "      </Violation>\n"
+                    )
+                report_fp.write("    </File>\n")
+            report_fp.write("  </Package>\n")
+        report_fp.write(
+            "  <Rules>\n"
+            "    <Rule name='MethodReturnTypeRequired'>\n"
+            "      <Description><![CDATA[Description]]></Description>\n"
+            "    </Rule>\n"
+            "  </Rules>\n"
+            "</CodeNarc>\n"
+        )
+
+
+def _git_commit() -> str | None:
+    """Get the current git commit, if any."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],  # noqa: S607
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _measure(function: Callable[[], object], repeat: int) -> dict:
+    """Measure the fastest run time and the peak memory usage of a function.
+
+    The run time is measured without tracemalloc, which slows down allocations.
+
+    :param function: Function to benchmark.
+    :param repeat: Number of times to run the function when measuring the run time.
+    :return: Run time in seconds and peak memory usage in bytes.
+    """
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"seconds": min(timings), "peak_bytes": peak_bytes}
+
+
+def _parse_report(report_file: str) -> None:
+    with contextlib.suppress(run_codenarc.CodeNarcViolationsError):
+        run_codenarc.parse_xml_report(report_file)
+
+
+def _print_violations(report_file: str) -> None:
+    with open(report_file, "rb") as xml_file:
+        events = run_codenarc._iter_report_events(xml_file)  # noqa: SLF001
+        packages = run_codenarc._iter_packages(events)  # noqa: SLF001
+        for _ in run_codenarc._print_violations(  # noqa: SLF001
+            run_codenarc._iter_report_violations(packages)  # noqa: SLF001
+        ):
+            pass
+
+
+def _read_lines(path: str) -> Iterator[str]:
+    with open(path, encoding="utf-8") as output_fp:
+        for line in output_fp:
+            yield line.rstrip("\n")
+
+
+def _run_benchmarks(sizes: list[int], repeat: int) -> list[dict]:
+    """Run all benchmarks for all sizes.
+
+    :param sizes: Numbers of violations (or output lines) to benchmark with.
+    :param repeat: Number of times to run each benchmark.
+    :return: List of benchmark results.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tempdir:
+        for size in sizes:
+            report_file = os.path.join(tempdir, f"report-{size}.xml")
+            output_file = os.path.join(tempdir, f"output-{size}.txt")
+            _generate_report(report_file, size)
+            _generate_output(output_file, size)
+            with open(output_file, encoding="utf-8") as output_fp:
+                output_lines = output_fp.read().splitlines()
+
+            benchmarks = _benchmarks(report_file, output_file, output_lines)
+            for name, function in benchmarks.items():
+                result = {"name": name, "size": size, **_measure(function, repeat)}
+                log.info(
+                    "%-22s %9d %10.4fs %12d bytes",
+                    name,
+                    size,
+                    result["seconds"],
+                    result["peak_bytes"],
+                )
+                results.append(result)
+
+    return results
+
+
+def compare_results(results: list[dict], baseline_file: str) -> None:
+    """Log how the results compare to the results of an earlier run.
+
+    :param results: Results of this run.
+    :param baseline_file: Path to the results file of the earlier run.
+    """
+    with open(baseline_file, encoding="utf-8") as baseline_fp:
+        baseline = {
+            (result["name"], result["size"]): result
+            for result in json.load(baseline_fp)["results"]
+        }
+
+    for result in results:
+        old_result = baseline.get((result["name"], result["size"]))
+        if old_result is None:
+            continue
+        log.info(
+            "%-22s %9d time x%.2f, peak memory x%.2f",
+            result["name"],
+            result["size"],
+            result["seconds"] / old_result["seconds"],
+            result["peak_bytes"] / max(1, old_result["peak_bytes"]),
+        )
+
+
+def parse_args(args: list[str]) -> argparse.Namespace:
+    """Parse the command line arguments."""
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument(
+        "--compare",
+        metavar="PATH",
+        help="Compare the results against the results file of an earlier run.",
+    )
+    arg_parser.add_argument(
+        "--output",
+        metavar="PATH",
+        help=(
+            "Path of the results file. (default: the current git commit under"
+            f" {RESULTS_DIR})"
+        ),
+    )
+    arg_parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of times to run each benchmark. (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help=(
+            "Numbers of violations and output lines to benchmark with, for example"
+            " 1000000 for large reports. (default: %(default)s)"
+        ),
+    )
+    return arg_parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    parsed_args = parse_args(sys.argv[1:])
+    logging.basicConfig(format="%(message)s", level=logging.INFO, stream=sys.stdout)
+
+    # Re-logged output and violations are formatted, but not printed.
+    run_codenarc.log.propagate = False
+    run_codenarc.log.setLevel(logging.INFO)
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        run_codenarc.log.addHandler(logging.StreamHandler(devnull))
+        benchmark_results = _run_benchmarks(parsed_args.sizes, parsed_args.repeat)
+
+    output = parsed_args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{_git_commit() or 'results'}.json")
+    with open(output, "w", encoding="utf-8") as output_fp:
+        json.dump(
+            {
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "results": benchmark_results,
+            },
+            output_fp,
+            indent=2,
+        )
+    log.info("Saved results to %s", output)
+
+    if parsed_args.compare:
+        compare_results(benchmark_results, parsed_args.compare)
@@ -8,16 +8,30 @@
 """A small wrapper script to call CodeNarc and interpret its output."""
 
 import argparse
+import contextlib
+import fcntl
+import hashlib
+import heapq
+import itertools
+import json
 import logging
 import os
 import platform
+import re
+import resource
 import shutil
+import socket
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import zipfile
 
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
+from typing import BinaryIO, IO, TextIO
 from urllib.error import HTTPError
 from urllib.request import urlopen
 from xml.etree import ElementTree as ET
@@ -26,9 +40,48 @@ from xml.etree import ElementTree as ET
 log = logging.getLogger(__name__)
 
 
+BUNDLE_JAR_PREFIX = "codenarc-bundle-"
+CDS_ARCHIVE_PREFIX = "codenarc-cds-"
+CGROUP_DIR = "/sys/fs/cgroup"
+CODENARC_SUMMARY_PATTERN = re.compile(
+    r"CodeNarc completed: \(p1=(\d+); p2=(\d+); p3=(\d+)\) (\d+)ms"
+)
+DEFAULT_CACHE_SIZE_MB = 256
+DEFAULT_INCLUDES = "**/*.groovy"
 DEFAULT_REPORT_FILE = "codenarc-report.xml"
+DEFAULT_SERVER_SOCKET = "codenarc-server.sock"
+DEFAULT_VIOLATIONS_FILE = "codenarc-violations.txt"
+ENVIRONMENT_FILE = "environment.json"
 GROOVYLINT_HOME = os.path.dirname(os.path.realpath(__file__))
+JAR_DIGESTS_FILE = "jar-digests.json"
+# Heap sizes for the automatic JVM profile: the minimum, the estimate for a run without
+# files, and the additional estimate per file. CodeNarc keeps all violations in memory
+# until it writes its report, so larger runs need more heap.
+JVM_BASE_HEAP_MB = 256
+JVM_HEAP_PER_FILE_KB = 256
+JVM_MAX_HEAP_FRACTION = 0.75
+JVM_MIN_HEAP_MB = 128
+# Runs with fewer files than this finish before the optimizing JIT compiler pays off.
+JVM_SHORT_RUN_FILES = 200
+# Bisecting uniformly slow files would otherwise take about twice as many timeouts as
+# there are files.
+MAX_BISECT_TIMEOUTS = 8
 MAX_DOWNLOAD_ATTEMPTS = 5
+# Linux limits the length of a single command line argument to 128 KiB, so the list of
+# files given to -sourcefiles must be split into chunks which stay below that limit.
+MAX_SOURCEFILES_LENGTH = 100_000
+NDJSON_REPORT_WRITER_CLASS = "com.ableton.groovylint.NdjsonReportWriter"
+RULESET_CACHE_DIR = "rulesets"
+RULESET_EXPORTER_CLASS = "com.ableton.groovylint.RuleSetExporter"
+RULESET_FILE = "ruleset.groovy"
+RULE_PROFILER_CLASS = "com.ableton.groovylint.RuleProfiler"
+SERVER_CLASS = "com.ableton.groovylint.CodeNarcServer"
+SERVER_EXIT_PREFIX = b"groovylint-server-exit: "
+SOURCE_FILE_OPTIONS = frozenset({"-excludes", "-includes", "-sourcefiles"})
+STUB_JAR = "WorkflowScriptStub.jar"
+SYNTAX_CHECKER_CLASS = "com.ableton.groovylint.SyntaxChecker"
+SUMMARY_TABLE_ROWS = 20
+WATCHDOG_INTERVAL_SECONDS = 0.1
 
 
 class CodeNarcError(Exception):
@@ -48,6 +101,15 @@ class CodeNarcViolationsError(Exception):
         self.num_violations = num_violations
 
 
+class CodeNarcTimeoutError(Exception):
+    """Raised if CodeNarc was stopped because it ran for too long."""
+
+    def __init__(self, seconds: float, reason: str) -> None:
+        """Create a new instance of the CodeNarcTimeoutError class."""
+        super().__init__(f"CodeNarc was stopped after {seconds:.1f}s ({reason})")
+        self.seconds = seconds
+
+
 class CompilationError(Exception):
     """Raised if there was a compilation error."""
 
@@ -68,6 +130,90 @@ class DownloadFailedError(DownloadError):
         super().__init__(f"Failed to download {url}")
 
 
+class GroovylintSession:
+    """Lint files many times from a long-lived Python process.
+
+    The environment (the JAR dependencies, the classpath, the Groovy version and the
+    rulesets) is resolved once when the session is created, after which lint() can be
+    called any number of times, also from several threads at once. Unlike the command
+    line interface, a session neither configures logging nor exits the process, and
+    reports violations as Violation objects instead of logging them. If a CodeNarc
+    server is listening on the server socket, it is used to avoid starting a new JVM
+    for every call.
+    """
+
+    def __init__(
+        self,
+        basedir: str = ".",
+        rulesets: str | None = None,
+        *,
+        codenarc_options: list[str] | None = None,
+        default_jar_versions: dict[str, str] | None = None,
+        groovy_home: str | None = None,
+        **options: object,
+    ) -> None:
+        """Create a new instance of the GroovylintSession class.
+
+        :param basedir: CodeNarc base directory, which the linted paths are relative to.
+        :param rulesets: Rulesets in the format of CodeNarc's -rulesetfiles option.
+            Defaults to the default ruleset.
+        :param codenarc_options: Extra options to pass to CodeNarc.
+        :param default_jar_versions: Versions of the JAR dependencies. Defaults to the
+            versions from the pom.xml file.
+        :param groovy_home: Groovy home directory. Defaults to the same directory as the
+            command line interface.
+        :param options: Other options of the command line interface, with underscores
+            instead of dashes, for example resources="/opt/resources" or jobs=4.
+        """
+        groovy_home = groovy_home or _guess_groovy_home()
+        if groovy_home is None:
+            msg = "Could not determine the Groovy home directory"
+            raise ValueError(msg)
+
+        arg_parser = _arg_parser(default_jar_versions or parse_pom())
+        args = arg_parser.parse_args(["--groovy-home", groovy_home])
+        unknown_options = sorted(set(options) - set(vars(args)))
+        if unknown_options:
+            msg = f"Unknown options: {', '.join(unknown_options)}"
+            raise TypeError(msg)
+        vars(args).update(options)
+        args.codenarc_options = [[f"-basedir={basedir}", *(codenarc_options or [])]]
+        _resolve_args(args)
+        _prepare_environment(args)
+
+        # Resolve the rulesets once, so that they are not pre-compiled for every call.
+        args.codenarc_options = [
+            *(
+                option
+                for option in args.codenarc_options
+                if not option.startswith("-rulesetfiles=")
+            ),
+            f"-rulesetfiles={_resolve_rulesets(args, rulesets)}",
+        ]
+        self._args = args
+        self._baseline = _read_baseline(args.baseline) if args.baseline else Counter()
+
+    def lint(self, paths: Iterable[str]) -> "LintResult":
+        """Lint files.
+
+        :param paths: Paths of the files to lint, relative to the base directory.
+        :return: Result with the violations in the given files.
+        """
+        # Each call gets its own metrics, so that concurrent calls don't share state.
+        args = argparse.Namespace(**vars(self._args))
+        args.metrics = {"phases": {}}
+        source_files = list(dict.fromkeys(os.path.normpath(path) for path in paths))
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            report_file = run_codenarc_parallel(
+                args, os.path.join(tempdir, DEFAULT_REPORT_FILE), source_files
+            )
+            with open(report_file, "rb") as report_fp:
+                summary, violations = _read_report(report_fp)
+                violations = _filter_baseline(violations, Counter(self._baseline))
+                return LintResult(summary.get("files", 0), list(violations), args.metrics)
+
+
 class InvalidJARError(DownloadError):
     """Raised if a downloaded JAR file is invalid."""
 
@@ -76,6 +222,26 @@ class InvalidJARError(DownloadError):
         super().__init__("Invalid JAR file")
 
 
+class LintResult:
+    """Result of linting files with a GroovylintSession."""
+
+    __slots__ = ("files", "metrics", "violations")
+
+    def __init__(self, files: int, violations: list["Violation"], metrics: dict) -> None:
+        """Create a new instance of the LintResult class."""
+        self.files = files
+        self.violations = violations
+        self.metrics = metrics
+
+    def to_dict(self) -> dict:
+        """Convert the result to a dictionary which can be serialized to JSON."""
+        return {
+            "files": self.files,
+            "violations": [violation.to_dict() for violation in self.violations],
+            "metrics": self.metrics,
+        }
+
+
 class MissingClasspathElementError(Exception):
     """Raised if a classpath element is missing."""
 
@@ -92,362 +258,3168 @@ class MissingReportFileError(Exception):
         super().__init__(f"{report_file} was not generated, aborting!")
 
 
-def _build_classpath(args: argparse.Namespace) -> str:
-    """Construct the classpath to use for running CodeNarc."""
-    codenarc_version = _codenarc_version(args.codenarc_version, is_groovy4=args.groovy4)
-    classpath = [
-        args.resources,
-        f"{args.groovy_home}/lib/*",
-        f"{args.resources}/CodeNarc-{codenarc_version}.jar",
-        f"{args.resources}/GMetrics-{args.gmetrics_version}.jar",
-        f"{args.resources}/activation-{args.activation_version}.jar",
-        f"{args.resources}/jaxb-api-{args.jaxb_api_version}.jar",
-        f"{args.resources}/slf4j-api-{args.slf4j_version}.jar",
-        f"{args.resources}/slf4j-simple-{args.slf4j_version}.jar",
-    ]
-    classpath.extend(args.jars)
+class SlowFilesError(Exception):
+    """Raised if CodeNarc timed out on some files."""
 
-    # For Jenkinsfiles that reference the WorkflowScript class, they will need to use this
-    # stub class with Groovy 4.x and later. The JAR can be built with `mvn package`.
-    stub_jar = f"{args.resources}/WorkflowScriptStub.jar"
-    if os.path.exists(stub_jar):
-        classpath.append(stub_jar)
+    def __init__(self, paths: list[str]) -> None:
+        """Create a new instance of the SlowFilesError class."""
+        super().__init__(
+            f"CodeNarc timed out on {len(paths)} file(s): {', '.join(sorted(paths))}"
+        )
+        self.paths = paths
 
-    for path in classpath:
-        if not (os.path.exists(path) or path.endswith("*")):
-            raise MissingClasspathElementError(path)
 
-    return ":".join(classpath)
+class UnpinnedJARsError(Exception):
+    """Raised if no digest is pinned for some of the downloaded JAR files."""
 
+    def __init__(self, jar_digests: dict[str, str]) -> None:
+        """Create a new instance of the UnpinnedJARsError class."""
+        properties = "\n".join(
+            f"    <sha256.{name}>{digest}</sha256.{name}>"
+            for name, digest in sorted(jar_digests.items())
+        )
+        super().__init__(
+            "No SHA-256 digest is pinned in pom.xml for some JAR files. After checking"
+            " that they are genuine, add these properties to pin them, or allow unpinned"
+            f" JAR files with --allow-unpinned-jars:\n{properties}"
+        )
+        self.jar_digests = jar_digests
+
+
+class Violation:
+    """A single violation found by CodeNarc."""
+
+    __slots__ = ("line", "message", "path", "priority", "rule", "source_line")
+
+    def __init__(  # noqa: PLR0913
+        self,
+        path: str,
+        line: int | None,
+        rule: str,
+        priority: int,
+        message: str | None,
+        *,
+        source_line: str | None = None,
+    ) -> None:
+        """Create a new instance of the Violation class."""
+        self.path = path
+        self.line = line
+        self.rule = rule
+        self.priority = priority
+        self.message = message
+        self.source_line = source_line
+
+    def fingerprint(self) -> str:
+        """Identify the violation independently of its line number.
+
+        The fingerprint is made from the rule, the file and the source line with
+        normalized whitespace, so that it does not change when lines are added or
+        removed elsewhere in the file. Violations without a source line use their
+        message instead.
+        """
+        if self.source_line is not None:
+            text = " ".join(self.source_line.split())
+        else:
+            text = self.message or ""
+        key = "\0".join([self.rule, self.path.removeprefix("./"), text])
+        return hashlib.sha256(key.encode()).hexdigest()[:20]
+
+    def to_dict(self) -> dict:
+        """Convert the violation to a dictionary which can be serialized to JSON."""
+        return {
+            "path": self.path,
+            "line": self.line,
+            "rule": self.rule,
+            "priority": self.priority,
+            "message": self.message,
+            "source_line": self.source_line,
+        }
+
+
+def _absolute_codenarc_options(options: list[str]) -> list[str]:
+    """Make paths in CodeNarc options independent of the current working directory.
+
+    The CodeNarc server runs in a different working directory than its clients, so any
+    relative paths must be resolved by the client before sending a job to the server.
+
+    :param options: CodeNarc options.
+    :return: CodeNarc options with absolute -basedir and -rulesetfiles paths.
+    """
+    absolute_options = []
+    has_basedir = False
+
+    for option in options:
+        name, separator, value = option.partition("=")
+        if name == "-basedir" and separator:
+            has_basedir = True
+            absolute_options.append(f"-basedir={os.path.abspath(value)}")
+        elif name == "-rulesetfiles" and separator:
+            ruleset_files = [
+                f"file:{os.path.abspath(ruleset.removeprefix('file:'))}"
+                if ruleset.startswith("file:")
+                else ruleset
+                for ruleset in value.split(",")
+            ]
+            absolute_options.append(f"-rulesetfiles={','.join(ruleset_files)}")
+        else:
+            absolute_options.append(option)
 
-def _codenarc_version(version: str, *, is_groovy4: bool) -> str:
-    """Get the CodeNarc version depending on the version of Groovy being used."""
-    return f"{version}-groovy-4.0" if is_groovy4 else version
+    if not has_basedir:
+        absolute_options.append(f"-basedir={os.getcwd()}")
 
+    return absolute_options
 
-def _download_file(url: str, output_dir: str) -> str:
-    """Download a file from a URL to the download directory."""
-    output_file_name = url.rsplit("/", maxsplit=1)[-1]
-    output_file_path = os.path.join(output_dir, output_file_name)
 
-    if os.path.exists(output_file_path):
-        log.debug("%s already exists, skipping download", output_file_path)
-        return output_file_path
+def _add_log_level_arguments(arg_parser: argparse.ArgumentParser) -> None:
+    """Add the arguments which control how much output is shown."""
+    arg_parser.add_argument(
+        "-q",
+        "--quiet",
+        action="store_const",
+        const=logging.WARNING,
+        dest="log_level",
+        help="Show less output",
+    )
 
-    log.debug("Downloading %s to %s", url, output_file_path)
-    try:
-        with urlopen(url) as response, open(output_file_path, "wb") as out_fp:  # noqa: S310
-            shutil.copyfileobj(response, out_fp)
-    except HTTPError as http_error:
-        log.error("Download of %s failed with code %d", url, http_error.code)
-        raise DownloadFailedError(url) from http_error
+    arg_parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_const",
+        const=logging.DEBUG,
+        dest="log_level",
+        help="Show extra output",
+    )
 
-    log.info("Downloaded %s", output_file_name)
-    return output_file_path
 
+def _add_output_arguments(arg_parser: argparse.ArgumentParser) -> None:
+    """Add the arguments which control how violations and metrics are reported."""
+    arg_parser.add_argument(
+        "--baseline",
+        metavar="PATH",
+        help=(
+            "File with the fingerprints of known violations, which are not reported. Use"
+            " --update-baseline to create it."
+        ),
+    )
 
-def _download_jar_with_retry(url: str, output_dir: str) -> str:
-    """Download a JAR file but retry in case of failure."""
-    download_attempt = MAX_DOWNLOAD_ATTEMPTS
-    sleep_duration = 1
+    arg_parser.add_argument(
+        "--max-violations",
+        type=int,
+        metavar="N",
+        help=(
+            "Print at most N violations, followed by the number of violations per"
+            " priority, rule and file, and write all violations to the file given by"
+            " --violations-file. This keeps the console output of huge reports short."
+        ),
+    )
 
-    while download_attempt > 0:
-        try:
-            output_file_path = _download_file(url, output_dir)
-            if not _is_valid_jar(output_file_path):
-                log.warning("%s is not a valid JAR file", output_file_path)
-                os.unlink(output_file_path)
-                raise InvalidJARError
-        except DownloadError:
-            download_attempt -= 1
-            sleep_duration *= 2
-            log.debug("Sleeping %d seconds until next retry...", sleep_duration)
-            time.sleep(sleep_duration)
-        else:
-            return output_file_path
+    arg_parser.add_argument(
+        "--metrics-file",
+        metavar="PATH",
+        help=(
+            "Write the duration of each phase of the run, the number of files and"
+            " violations, and the peak memory usage of CodeNarc to this file. Files"
+            " ending in .prom are written in the Prometheus text format, all others"
+            " as JSON."
+        ),
+    )
 
-    log.error("Failed to download %s after %d attempts", url, MAX_DOWNLOAD_ATTEMPTS)
-    raise DownloadFailedError(url)
+    arg_parser.add_argument(
+        "--ndjson-report",
+        action="store_true",
+        help=(
+            "Have CodeNarc write a compact NDJSON report with groovylint's own report"
+            " writer instead of its XML report, which is much faster to read for runs"
+            " with many violations. This option requires the WorkflowScriptStub JAR,"
+            " which can be built with `mvn package`."
+        ),
+    )
 
+    arg_parser.add_argument(
+        "--output-file",
+        metavar="PATH",
+        help=(
+            "Path of the file to write violations to when using --output-format."
+            ' (default: "codenarc-report" with an extension for the format)'
+        ),
+    )
 
-def _fetch_jars(args: argparse.Namespace) -> None:
-    """Fetch JAR file dependencies."""
-    if not os.path.exists(args.resources):
-        os.mkdir(args.resources)
+    arg_parser.add_argument(
+        "--output-format",
+        choices=["json", "junit", "ndjson", "sarif"],
+        help=(
+            "Also write violations to a file in this format, which is easier for other"
+            " tools to read than CodeNarc's XML report."
+        ),
+    )
 
-    codenarc_version = _codenarc_version(args.codenarc_version, is_groovy4=args.groovy4)
-    jar_urls = [
-        (
-            "https://github.com/CodeNarc/CodeNarc/releases/download"
-            f"/v{args.codenarc_version}/CodeNarc-{codenarc_version}.jar"
+    arg_parser.add_argument(
+        "--report-file",
+        metavar="PATH",
+        help=(
+            "Keep the CodeNarc XML report at this path, for example to merge the"
+            " reports of several shards afterwards."
         ),
-        (
-            "https://github.com/dx42/gmetrics/releases/download"
-            f"/v{args.gmetrics_version}/GMetrics-{args.gmetrics_version}.jar"
+    )
+
+    arg_parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help=(
+            "Write all violations to the --baseline file instead of reporting them, so"
+            " that only new violations will be reported afterwards."
         ),
-        (
-            "https://repo1.maven.org/maven2/javax/activation/activation"
-            f"/{args.activation_version}/activation-{args.activation_version}.jar"
+    )
+
+    arg_parser.add_argument(
+        "--violations-file",
+        default=DEFAULT_VIOLATIONS_FILE,
+        metavar="PATH",
+        help=(
+            "Path of the file to write all violations to when using --max-violations."
+            " (default: %(default)s)"
         ),
-        (
-            "https://repo1.maven.org/maven2/javax/xml/bind/jaxb-api"
-            f"/{args.jaxb_api_version}/jaxb-api-{args.jaxb_api_version}.jar"
+    )
+
+
+def _ant_pattern_regex(pattern: str) -> re.Pattern[str]:
+    """Convert an Ant-style file pattern, as used by CodeNarc, to a regular expression."""
+    pattern = pattern.strip().removeprefix("./")
+    if pattern.endswith("/"):
+        pattern += "**"
+
+    regex = []
+    for token in re.split(r"(\*\*/|/\*\*$|\*\*|\*|\?)", pattern):
+        match token:
+            case "**/":
+                regex.append("(?:.*/)?")
+            case "/**":
+                regex.append("(?:/.*)?")
+            case "**":
+                regex.append(".*")
+            case "*":
+                regex.append("[^/]*")
+            case "?":
+                regex.append("[^/]")
+            case _:
+                regex.append(re.escape(token))
+
+    return re.compile("".join(regex))
+
+
+def _arg_parser(default_jar_versions: dict[str, str]) -> argparse.ArgumentParser:
+    """Create the parser for the command line arguments of a CodeNarc run.
+
+    :param default_jar_versions: Default versions of the JAR dependencies.
+    :return: Argument parser.
+    """
+    arg_parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    source_files_group = arg_parser.add_mutually_exclusive_group()
+    _add_output_arguments(arg_parser)
+
+    arg_parser.add_argument(
+        "--activation-version",
+        default=default_jar_versions["activation"],
+        help="Activation Framework version to use (required for JDK11 + Groovy 3.x).",
+    )
+
+    arg_parser.add_argument(
+        "--allow-unpinned-jars",
+        action="store_true",
+        help=(
+            "Use JAR dependencies which have no SHA-256 digest pinned in pom.xml, such as"
+            " other versions than the default ones, instead of failing. Their digests are"
+            " logged instead."
         ),
-        (
-            f"https://repo1.maven.org/maven2/org/slf4j/slf4j-api/{args.slf4j_version}"
-            f"/slf4j-api-{args.slf4j_version}.jar"
+    )
+
+    arg_parser.add_argument(
+        "--cache-dir",
+        help=(
+            "Directory in which to cache CodeNarc results for each file. When given,"
+            " CodeNarc will only analyze files which have changed since they were last"
+            " analyzed with the same configuration. The cache may be shared by several"
+            " concurrent builds."
         ),
-        (
-            f"https://repo1.maven.org/maven2/org/slf4j/slf4j-simple/{args.slf4j_version}"
-            f"/slf4j-simple-{args.slf4j_version}.jar"
+    )
+
+    arg_parser.add_argument(
+        "--cache-size",
+        default=DEFAULT_CACHE_SIZE_MB,
+        type=int,
+        help="Maximum size of the result cache in MiB.",
+    )
+
+    arg_parser.add_argument(
+        "--cds",
+        action="store_true",
+        help=(
+            "Use a class data sharing (CDS) archive to start CodeNarc faster. The archive"
+            " is created in the resources directory by the first run, and recreated when"
+            " the classpath or JDK changes. Requires Java 13 or later."
         ),
-    ]
+    )
 
-    for url in jar_urls:
-        _download_jar_with_retry(url, args.resources)
+    source_files_group.add_argument(
+        "--changed-since",
+        metavar="REF",
+        help=(
+            "Only analyze files which were changed since the merge base of this git ref"
+            " and HEAD (including untracked files), and which match the -includes and"
+            " -excludes patterns. If no such files were changed, CodeNarc is not run."
+        ),
+    )
 
+    arg_parser.add_argument(
+        "--codenarc-version",
+        default=default_jar_versions["CodeNarc"],
+        help="CodeNarc version to use.",
+    )
 
-def _guess_groovy_home() -> str | None:
-    """Try to determine the location where Groovy is installed.
+    arg_parser.add_argument(
+        "--compile-rulesets",
+        action="store_true",
+        help=(
+            "Compile Groovy rulesets to XML rulesets, which CodeNarc loads faster. The"
+            " compiled rulesets are cached in the resources directory. This requires the"
+            " WorkflowScriptStub JAR, which can be built with `mvn package`."
+        ),
+    )
 
-    :return: Path of the Groovy installation, or None if it can't be determined.
-    """
-    if "GROOVY_HOME" in os.environ:
-        return os.environ["GROOVY_HOME"]
+    arg_parser.add_argument(
+        "--exclude-slow-files",
+        action="store_true",
+        help=(
+            "Leave files on which CodeNarc times out out of the report, instead of"
+            " failing. See --timeout and --progress-timeout."
+        ),
+    )
 
-    if platform.system() == "Darwin":
-        brew_groovy_home = "/usr/local/opt/groovysdk/libexec"
-        if os.path.exists(brew_groovy_home):
-            return brew_groovy_home
-    if platform.system() == "Linux":
-        # Many Linux distros have Groovy packages which use this location.
-        linux_groovy_home = "/usr/share/groovy"
-        if os.path.exists(linux_groovy_home):
-            return linux_groovy_home
+    arg_parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help=(
+            "Stop CodeNarc as soon as it fails to compile a file, instead of waiting for"
+            " it to analyze all other files. With --jobs, the CodeNarc processes of all"
+            " shards are stopped."
+        ),
+    )
 
-    return None
+    source_files_group.add_argument(
+        "--files",
+        action="extend",
+        nargs="+",
+        help=(
+            "Lint these files (relative to the current directory) in a single batch."
+            " Violations are reported in the same order as the files are given."
+        ),
+    )
 
+    source_files_group.add_argument(
+        "--files-from",
+        metavar="PATH",
+        help=(
+            'Like --files, but read the list of files from PATH (or stdin for "-"). Files'
+            " may be separated by newlines or NUL characters."
+        ),
+    )
 
-def _is_groovy4(groovy_home: str) -> bool:
-    groovy_bin = os.path.join(groovy_home, "bin", "groovy")
-    log.debug("Checking version for groovy binary %s", groovy_bin)
-    groovy_version = subprocess.check_output([f"{groovy_bin}", "--version"]).decode()
-    log.debug("Groovy version string: %s", groovy_version)
-    return groovy_version.startswith("Groovy Version: 4.")
+    arg_parser.add_argument(
+        "--gmetrics-version",
+        default=default_jar_versions["GMetrics"],
+        help="GMetrics version to use.",
+    )
+
+    default_groovy_home = _guess_groovy_home()
+    arg_parser.add_argument(
+        "--groovy-home",
+        default=default_groovy_home,
+        required=(default_groovy_home is None),
+        help="Groovy home directory.",
+    )
+
+    arg_parser.add_argument("--groovy4", action="store_true", help=argparse.SUPPRESS)
+
+    arg_parser.add_argument(
+        "-j",
+        "--jar",
+        action="append",
+        default=[],
+        dest="jars",
+        help="Path to a JAR file to add to the classpath. May be given multiple times.",
+    )
+
+    arg_parser.add_argument(
+        "--jar-cache",
+        const=_default_jar_cache(),
+        metavar="DIR",
+        nargs="?",
+        help=(
+            "Download JAR dependencies to this directory instead of the resources"
+            " directory. The directory may be shared by all builds on a host. If no"
+            f" directory is given, {_default_jar_cache()} is used."
+        ),
+    )
+
+    arg_parser.add_argument(
+        "--jaxb-api-version",
+        default=default_jar_versions["jaxb-api"],
+        help="JAXB API version to use (required for JDK11 + Groovy 3.x).",
+    )
+
+    arg_parser.add_argument(
+        "--jobs",
+        default=1,
+        type=int,
+        help=(
+            "Number of CodeNarc processes to run in parallel. The files to analyze are"
+            " split into shards of about the same size, and the results are merged into"
+            " a single report. Use 0 to run one process per CPU."
+        ),
+    )
+
+    arg_parser.add_argument(
+        "--jvm-opt",
+        action="append",
+        default=[],
+        dest="jvm_opts",
+        metavar="OPTION",
+        help=(
+            "Pass this option to the JVM which runs CodeNarc, for example"
+            " --jvm-opt=-Xmx4g. Can be given several times."
+        ),
+    )
+
+    arg_parser.add_argument(
+        "--jvm-profile",
+        choices=["auto", "none"],
+        default="none",
+        help=(
+            "With auto, size the heap, and choose the garbage collector and JIT"
+            " compiler of the JVM from the number of files to analyze and the memory"
+            " and CPU limits of the container. If the number of files is not known"
+            " beforehand, the JVM's defaults are used. With none, only options from"
+            " --jvm-opt are used. (default: %(default)s)"
+        ),
+    )
+
+    arg_parser.add_argument(
+        "--precheck",
+        action="store_true",
+        help=(
+            "Check the files for syntax errors before running CodeNarc, so that a build"
+            " with syntax errors fails without a full analysis. Requires the"
+            f" {STUB_JAR} built by `mvn package`."
+        ),
+    )
+
+    arg_parser.add_argument(
+        "--progress-timeout",
+        type=float,
+        metavar="SECONDS",
+        help=(
+            "Stop CodeNarc if it does not analyze another file within this many seconds,"
+            " and find the slow files as with --timeout."
+        ),
+    )
+
+    arg_parser.add_argument(
+        "--resources",
+        default=os.path.join(GROOVYLINT_HOME, "resources"),
+        help="Path to Groovylint resources directory.",
+    )
+
+    arg_parser.add_argument(
+        "--ruleset-map",
+        metavar="PATH",
+        help=(
+            "JSON file which maps directories (relative to the base directory) to"
+            " rulesets, in the format of CodeNarc's -rulesetfiles option. Each file is"
+            " analyzed with the rulesets of the closest directory which contains it, or"
+            ' the default rulesets if there is none. Relative "file:" rulesets are'
+            " relative to the directory of the JSON file."
+        ),
+    )
+
+    arg_parser.add_argument(
+        "--server",
+        action="store_true",
+        help=(
+            "Run a persistent CodeNarc server, which other invocations of this script"
+            " will use instead of starting a new JVM. The server uses the classpath and"
+            " log level given to it at startup."
+        ),
+    )
+
+    arg_parser.add_argument(
+        "--server-socket",
+        help=(
+            "Path to the Unix socket of the CodeNarc server. If no server is listening"
+            " on this socket, CodeNarc is run directly. (default: %(default)s under the"
+            " resources directory)"
+        ),
+    )
+
+    arg_parser.add_argument(
+        "--shard",
+        type=_parse_shard,
+        metavar="i/N",
+        help=(
+            "Split the files into N shards of roughly the same total size, and only"
+            " analyze the files of shard i (starting at 1). Every node of a multi-node"
+            " build gets the same shards, and their reports can be combined with the"
+            " merge-reports subcommand."
+        ),
+    )
+
+    source_files_group.add_argument(
+        "--single-file",
+        help=(
+            "When given, copy this file to a temporary directory and lint it. This may"
+            " improve performance in large repositories. This option cannot be used with"
+            ' "--" to pass options to CodeNarc.'
+        ),
+    )
+
+    arg_parser.add_argument(
+        "--slf4j-version",
+        default=default_jar_versions["slf4j-api"],
+        help="SLF4J version to use.",
+    )
+
+    arg_parser.add_argument(
+        "--slim-classpath",
+        action="store_true",
+        help=(
+            "Start CodeNarc with a bundle JAR of the classes that it loads in front of"
+            " the classpath. The bundle is built in the resources directory from the"
+            " classes loaded by the first run, and rebuilt when the classpath changes."
+            " If a class can't be loaded or a file fails to compile with the bundle,"
+            " CodeNarc is run again with the full classpath. Requires Java 9 or later."
+        ),
+    )
+
+    arg_parser.add_argument(
+        "--syntax-only",
+        action="store_true",
+        help=(
+            "Only check the files for syntax errors, without running CodeNarc. Requires"
+            f" the {STUB_JAR} built by `mvn package`."
+        ),
+    )
+
+    arg_parser.add_argument(
+        "--timeout",
+        type=float,
+        metavar="SECONDS",
+        help=(
+            "Stop a CodeNarc process which runs for longer than this many seconds. Its"
+            " files are then analyzed again in halves, until the files which make"
+            f" CodeNarc time out on their own are found. After {MAX_BISECT_TIMEOUTS}"
+            " timeouts, the files are not split any further, and all files of a process"
+            " which times out count as slow."
+        ),
+    )
+
+    _add_log_level_arguments(arg_parser)
+
+    arg_parser.add_argument(
+        "codenarc_options",
+        nargs="*",
+        action="append",
+        help='All options after "--" will be passed to CodeNarc',
+    )
+
+    return arg_parser
+
+
+@contextlib.contextmanager
+def _atomic_write(path: str, *, binary: bool = False) -> Iterator[IO]:
+    """Write a file atomically, so that other processes never see a partial file.
+
+    The file is written to a temporary file in the same directory first, which then
+    replaces the file. If writing fails, the temporary file is removed. Like files
+    created with open(), the file gets the default permissions of the umask, so that
+    other users can read it.
+
+    :param path: Path to the file to write.
+    :param binary: Whether to open the file in binary mode, instead of UTF-8 text mode.
+    :return: Context manager, which yields the opened temporary file.
+    """
+    temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with (
+            open(temp_path, "wb") if binary else open(temp_path, "w", encoding="utf-8")
+        ) as temp_fp:
+            yield temp_fp
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, path)
+
+
+def _build_classpath(args: argparse.Namespace) -> str:
+    """Construct the classpath to use for running CodeNarc."""
+    pinned_digests = _pinned_jar_digests() if args.jar_cache else {}
+    classpath = [
+        f"{args.groovy_home}/lib/*",
+        *(_jar_path(args, url, pinned_digests) for url in _jar_urls(args)),
+    ]
+    classpath.extend(args.jars)
+
+    # For Jenkinsfiles that reference the WorkflowScript class, they will need to use this
+    # stub class with Groovy 4.x and later. The JAR can be built with `mvn package`.
+    stub_jar = f"{args.resources}/{STUB_JAR}"
+    if os.path.exists(stub_jar):
+        classpath.append(stub_jar)
+
+    # The resources directory only contains the ruleset and other non-class files. It
+    # must come last, since the JVM can't create a CDS archive if classes are loaded from
+    # any classpath element after a non-empty directory.
+    classpath.append(args.resources)
+
+    for path in classpath:
+        if not (os.path.exists(path) or path.endswith("*")):
+            raise MissingClasspathElementError(path)
+
+    return ":".join(classpath)
+
+
+def _build_classpath_bundle(classpath: str, class_load_log: str, bundle: str) -> None:
+    """Build a bundle JAR with the classes which a JVM has loaded from a classpath.
+
+    Each class is taken from the first JAR on the classpath which contains it, as the JVM
+    does. Resources are not logged, so all other files of these JARs are bundled too,
+    except for their metadata. The JVM finds everything else in the full classpath, which
+    follows the bundle. Entries are stored without compression, so that the JVM does not
+    have to inflate them, and classes are stored in the order in which they were loaded.
+
+    :param classpath: Classpath of the JVM.
+    :param class_load_log: Path of the JVM's class+load log, without decorations.
+    :param bundle: Path of the bundle JAR to write.
+    """
+    jars = []
+    for path in classpath.split(":"):
+        if path.endswith("*"):
+            directory = path.removesuffix("*") or "."
+            jars.extend(
+                os.path.join(directory, name)
+                for name in sorted(os.listdir(directory))
+                if name.lower().endswith(".jar")
+            )
+        elif os.path.isfile(path):
+            jars.append(path)
+
+    # Lines look like "org.codenarc.CodeNarc source: file:/path/to/CodeNarc.jar". Classes
+    # from a CDS archive have no JAR file as their source, but are bundled all the same.
+    with open(class_load_log, encoding="utf-8", errors="replace") as log_fp:
+        class_entries = dict.fromkeys(
+            f"{line.split(' ', maxsplit=1)[0].replace('.', '/')}.class"
+            for line in log_fp
+            if " source: " in line
+        )
+
+    temp_bundle = f"{bundle}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with contextlib.ExitStack() as stack:
+            sources = {}
+            for jar in jars:
+                jar_file = stack.enter_context(zipfile.ZipFile(jar))
+                for name in jar_file.namelist():
+                    sources.setdefault(name, jar_file)
+            # Classes of the JDK are not on the classpath.
+            _write_classpath_bundle(
+                sources, [name for name in class_entries if name in sources], temp_bundle
+            )
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_bundle)
+        raise
+    os.replace(temp_bundle, bundle)
+    log.debug("Created classpath bundle %s", bundle)
+
+    # Bundles for other classpaths won't be used again.
+    bundle_dir = os.path.dirname(bundle)
+    for name in os.listdir(bundle_dir):
+        path = os.path.join(bundle_dir, name)
+        if (
+            name.startswith(BUNDLE_JAR_PREFIX)
+            and name.endswith(".jar")
+            and path != bundle
+        ):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+
+def _cache_config_digest(args: argparse.Namespace) -> str:
+    """Hash everything besides the source files which affects CodeNarc's results.
+
+    :param args: Parsed command line arguments.
+    :return: Hex digest of the CodeNarc configuration.
+    """
+    config = {
+        "codenarc_version": _codenarc_version(
+            args.codenarc_version, is_groovy4=args.groovy4
+        ),
+        "gmetrics_version": args.gmetrics_version,
+        "groovy4": args.groovy4,
+        "jars": [
+            [jar, os.stat(jar).st_size, os.stat(jar).st_mtime_ns]
+            for jar in args.jars
+            if os.path.exists(jar)
+        ],
+        "options": _without_source_file_options(args.codenarc_options),
+    }
+    digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode())
+
+    ruleset_files = [os.path.join(args.resources, RULESET_FILE)]
+    custom_rulesets = _codenarc_option(args.codenarc_options, "-rulesetfiles")
+    if custom_rulesets:
+        ruleset_files.extend(
+            ruleset.removeprefix("file:")
+            for ruleset in custom_rulesets.split(",")
+            if ruleset.startswith("file:")
+        )
+    if args.ruleset_map:
+        ruleset_map = _read_ruleset_map(args.ruleset_map)
+        digest.update(json.dumps(ruleset_map, sort_keys=True).encode())
+        ruleset_files.extend(
+            ruleset.removeprefix("file:")
+            for rulesets in ruleset_map.values()
+            for ruleset in rulesets.split(",")
+            if ruleset.startswith("file:")
+        )
+    for ruleset_file in ruleset_files:
+        if os.path.exists(ruleset_file):
+            digest.update(_file_digest(ruleset_file).encode())
+
+    return digest.hexdigest()
+
+
+def _cache_entry_path(cache_dir: str, key: str) -> str:
+    """Get the path of the cache entry for a cache key."""
+    return os.path.join(cache_dir, key[:2], f"{key}.json")
+
+
+def _cache_key(config_digest: str, basedir: str, path: str) -> str | None:
+    """Construct the cache key for the results of a single source file.
+
+    :param config_digest: Digest of the CodeNarc configuration.
+    :param basedir: CodeNarc base directory.
+    :param path: Path to the source file, relative to the base directory.
+    :return: Cache key, or None if the source file does not exist.
+    """
+    file_path = os.path.join(basedir, path)
+    if not os.path.isfile(file_path):
+        return None
+
+    # Some rules depend on the file name, so the path is also part of the key.
+    return hashlib.sha256(
+        f"{config_digest}:{path}:{_file_digest(file_path)}".encode()
+    ).hexdigest()
+
+
+def _cds_archive_path(args: argparse.Namespace, classpath: str) -> str:
+    """Get the path of the CDS archive for a classpath and JDK.
+
+    The JVM only uses a CDS archive if the classpath and JDK are the same as when the
+    archive was created, so the archive's name is a digest of both.
+
+    :param args: Parsed command line arguments.
+    :param classpath: Classpath of the JVM.
+    :return: Path of the CDS archive in the resources directory.
+    """
+    key = json.dumps([_java_version(), _classpath_elements(classpath)])
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return os.path.join(args.resources, f"{CDS_ARCHIVE_PREFIX}{digest}.jsa")
+
+
+def _cds_options(
+    args: argparse.Namespace, classpath: str, *, create_archive: bool = True
+) -> list[str]:
+    """Get the JVM options for using a CDS archive.
+
+    If there is no archive for the classpath yet, the JVM is told to create one when it
+    exits. Several JVMs may do so at the same time, so each of them writes to its own
+    temporary file, which _install_cds_archive() moves into place.
+
+    :param args: Parsed command line arguments.
+    :param classpath: Classpath of the JVM.
+    :param create_archive: Whether the JVM should create a missing archive.
+    :return: Options to add to the java command.
+    """
+    archive = _cds_archive_path(args, classpath)
+    if os.path.exists(archive):
+        log.debug("Using CDS archive %s", archive)
+        return [f"-XX:SharedArchiveFile={archive}"]
+    if not create_archive:
+        return []
+    if not os.access(args.resources, os.W_OK):
+        log.debug("Not creating CDS archive, %s is not writable", args.resources)
+        return []
+
+    log.debug("Creating CDS archive %s", archive)
+    return [f"-XX:ArchiveClassesAtExit={_cds_temp_path(archive)}"]
+
+
+def _cds_temp_path(archive: str) -> str:
+    """Get the path which a new CDS archive is written to by the current thread."""
+    return f"{archive}.{os.getpid()}-{threading.get_ident()}.tmp"
+
+
+def _cgroup_cpu_limit(cgroup_dir: str = CGROUP_DIR) -> float | None:
+    """Get the CPU limit of the current cgroup, for example in a Docker container.
+
+    :param cgroup_dir: Mount point of the cgroup file system.
+    :return: Number of CPUs which the cgroup may use, or None if it has no limit.
+    """
+    # cgroup v2 has "$MAX $PERIOD" in cpu.max, cgroup v1 has separate files.
+    for quota_file, period_file in (
+        ("cpu.max", None),
+        ("cpu/cpu.cfs_quota_us", "cpu/cpu.cfs_period_us"),
+    ):
+        try:
+            with open(os.path.join(cgroup_dir, quota_file)) as quota_fp:
+                values = quota_fp.read().split()
+            if period_file is not None:
+                with open(os.path.join(cgroup_dir, period_file)) as period_fp:
+                    values.append(period_fp.read().strip())
+        except OSError:
+            continue
+        if values[0] in {"max", "-1"}:
+            return None
+        return int(values[0]) / int(values[1])
+    return None
+
+
+def _cgroup_memory_limit(cgroup_dir: str = CGROUP_DIR) -> int | None:
+    """Get the memory limit of the current cgroup, for example in a Docker container.
+
+    :param cgroup_dir: Mount point of the cgroup file system.
+    :return: Memory limit in bytes, or None if the cgroup has no limit.
+    """
+    for limit_file in ("memory.max", "memory/memory.limit_in_bytes"):
+        try:
+            with open(os.path.join(cgroup_dir, limit_file)) as limit_fp:
+                limit = limit_fp.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 uses a huge number instead of "max" for no limit.
+        if limit == "max" or int(limit) >= 2**62:
+            return None
+        return int(limit)
+    return None
+
+
+def _changed_files(ref: str, basedir: str) -> list[str]:
+    """Find the files which were changed since a git ref.
+
+    Files are compared against the merge base of the ref and HEAD, so that only changes
+    made on the current branch are included. Modified, added and renamed files are
+    included, as well as untracked files which are not ignored. Deleted files are not.
+
+    :param ref: Git ref to compare against, e.g. "origin/main".
+    :param basedir: CodeNarc base directory, which must be inside of a git repository.
+    :return: Sorted list of file paths, relative to the base directory.
+    """
+
+    def git(*git_args: str) -> str:
+        return subprocess.run(
+            ["git", *git_args],  # noqa: S607
+            check=True,
+            cwd=basedir,
+            stdout=subprocess.PIPE,
+        ).stdout.decode()
+
+    merge_base = git("merge-base", ref, "HEAD").strip()
+    log.debug("Finding files changed since %s (merge base %s)", ref, merge_base)
+    changed_files = git(
+        "diff", "--name-only", "--relative", "--find-renames", "--diff-filter=d", "-z",
+        merge_base, "--",
+    )  # fmt: skip
+    untracked_files = git("ls-files", "--others", "--exclude-standard", "-z")
+
+    return sorted(
+        {
+            os.path.normpath(path)
+            for path in (changed_files + untracked_files).split("\0")
+            if path
+        }
+    )
+
+
+def _chunk_source_files(source_files: list[str]) -> list[list[str]]:
+    """Split a list of files so that each -sourcefiles argument stays below the limit.
+
+    :param source_files: List of file paths.
+    :return: List of non-empty chunks, in the same order as source_files.
+    """
+    chunks: list[list[str]] = []
+    chunk_length = MAX_SOURCEFILES_LENGTH
+    for path in source_files:
+        if chunk_length + len(path) + 1 > MAX_SOURCEFILES_LENGTH:
+            chunks.append([])
+            chunk_length = 0
+        chunks[-1].append(path)
+        chunk_length += len(path) + 1
+
+    return chunks
+
+
+def _classpath_bundle_path(args: argparse.Namespace, classpath: str) -> str:
+    """Get the path of the bundle JAR for a classpath.
+
+    :param args: Parsed command line arguments.
+    :param classpath: Full classpath of the JVM.
+    :return: Path of the bundle JAR in the resources directory.
+    """
+    key = json.dumps(_classpath_elements(classpath))
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return os.path.join(args.resources, f"{BUNDLE_JAR_PREFIX}{digest}.jar")
+
+
+def _classpath_elements(classpath: str) -> list[list]:
+    """Identify the JAR files on a classpath by their size and modification time.
+
+    :param classpath: Classpath of the JVM.
+    :return: List of the classpath elements, with the size and modification time of each
+        element which is not a directory.
+    """
+    classpath_elements = []
+    for path in classpath.split(":"):
+        # Classes are only taken from JAR files, so the contents of directories don't
+        # matter. Wildcards are expanded to the JAR files in a directory by the java
+        # launcher, so use the directory's modification time, which changes when JAR
+        # files are added or removed.
+        if os.path.isdir(path):
+            classpath_elements.append([path])
+            continue
+        with contextlib.suppress(FileNotFoundError):
+            path_stat = os.stat(path.removesuffix("*"))
+            classpath_elements.append([path, path_stat.st_size, path_stat.st_mtime_ns])
+    return classpath_elements
+
+
+def _codenarc_option(options: list[str], name: str) -> str | None:
+    """Get the value of a CodeNarc option.
+
+    :param options: CodeNarc options.
+    :param name: Name of the option, including the leading dash.
+    :return: Value of the last occurrence of the option, or None if it was not given.
+    """
+    value = None
+    for option in options:
+        option_name, separator, option_value = option.partition("=")
+        if option_name == name and separator:
+            value = option_value
+
+    return value
+
+
+def _codenarc_version(version: str, *, is_groovy4: bool) -> str:
+    """Get the CodeNarc version depending on the version of Groovy being used."""
+    return f"{version}-groovy-4.0" if is_groovy4 else version
+
+
+def _compiled_ruleset(args: argparse.Namespace, ruleset: str) -> str:
+    """Get a pre-compiled XML version of a Groovy ruleset.
+
+    Loading a Groovy ruleset requires CodeNarc to compile and run it, which is slow. The
+    ruleset is therefore exported once to an XML ruleset with all rules expanded, which
+    is cached in the resources directory by the ruleset's contents and the CodeNarc
+    version. Rulesets which can't be exported are used as they are.
+
+    :param args: Parsed command line arguments.
+    :param ruleset: Ruleset, as given to CodeNarc's -rulesetfiles option.
+    :return: Ruleset to give to CodeNarc instead.
+    """
+    if not ruleset.endswith(".groovy"):
+        return ruleset
+    # Rulesets without a "file:" prefix are loaded from the classpath, of which only the
+    # resources directory contains rulesets.
+    ruleset_path = (
+        ruleset.removeprefix("file:")
+        if ruleset.startswith("file:")
+        else os.path.join(args.resources, ruleset)
+    )
+    stub_jar = os.path.join(args.resources, STUB_JAR)
+    if not (os.path.exists(ruleset_path) and os.path.exists(stub_jar)):
+        log.debug("Not compiling ruleset %s", ruleset)
+        return ruleset
+
+    codenarc_version = _codenarc_version(args.codenarc_version, is_groovy4=args.groovy4)
+    digest = hashlib.sha256(codenarc_version.encode())
+    digest.update(_file_digest(ruleset_path).encode())
+    cache_dir = os.path.join(args.resources, RULESET_CACHE_DIR)
+    compiled_ruleset = os.path.join(cache_dir, f"{digest.hexdigest()[:16]}.xml")
+    if os.path.exists(compiled_ruleset):
+        log.debug("Using compiled ruleset %s for %s", compiled_ruleset, ruleset)
+        return f"file:{compiled_ruleset}"
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Several processes may compile the same ruleset at the same time.
+    temp_ruleset = f"{compiled_ruleset}.{os.getpid()}-{threading.get_ident()}.tmp"
+    exporter_call = [
+        "java",
+        "-classpath",
+        args.classpath or _build_classpath(args),
+        RULESET_EXPORTER_CLASS,
+        ruleset,
+        temp_ruleset,
+    ]
+    log.debug("Compiling ruleset %s to %s", ruleset, compiled_ruleset)
+    with _timed(args.metrics, "compile_ruleset"):
+        exporter = subprocess.run(
+            exporter_call, check=False, stderr=subprocess.STDOUT, stdout=subprocess.PIPE
+        )
+    if exporter.returncode != 0:
+        log.warning("Failed to compile ruleset %s, using it as it is", ruleset)
+        _log_codenarc_output(exporter.stdout.decode(errors="replace").split("\n"))
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_ruleset)
+        return ruleset
+
+    os.replace(temp_ruleset, compiled_ruleset)
+    return f"file:{compiled_ruleset}"
+
+
+def _default_jar_cache() -> str:
+    """Get the default location of the JAR cache which is shared across the host."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "groovylint", "jars")
+
+
+def _download_file(url: str, output_dir: str) -> str:
+    """Download a file from a URL to the download directory.
+
+    The file is downloaded to a temporary file first and then renamed, so that other
+    processes never see a partially downloaded file.
+    """
+    output_file_name = url.rsplit("/", maxsplit=1)[-1]
+    output_file_path = os.path.join(output_dir, output_file_name)
+
+    if os.path.exists(output_file_path):
+        log.debug("%s already exists, skipping download", output_file_path)
+        return output_file_path
+
+    log.debug("Downloading %s to %s", url, output_file_path)
+    try:
+        with (
+            _atomic_write(output_file_path, binary=True) as out_fp,
+            urlopen(url) as response,  # noqa: S310
+        ):
+            shutil.copyfileobj(response, out_fp)
+    except HTTPError as http_error:
+        log.error("Download of %s failed with code %d", url, http_error.code)
+        raise DownloadFailedError(url) from http_error
+
+    log.info("Downloaded %s", output_file_name)
+    return output_file_path
+
+
+def _download_jar_with_retry(url: str, output_dir: str, sha256: str | None = None) -> str:
+    """Download a JAR file but retry in case of failure.
+
+    :param url: URL of the JAR file.
+    :param output_dir: Directory to download the JAR file to.
+    :param sha256: Pinned SHA-256 digest of the JAR file, if any.
+    :return: Path to the downloaded JAR file.
+    """
+    download_attempt = MAX_DOWNLOAD_ATTEMPTS
+    sleep_duration = 1
+
+    while download_attempt > 0:
+        try:
+            output_file_path = _download_file(url, output_dir)
+            if sha256 is not None and _file_digest(output_file_path) != sha256:
+                log.warning("%s does not match its pinned digest", output_file_path)
+                os.unlink(output_file_path)
+                raise InvalidJARError
+            if not _is_valid_jar(output_file_path):
+                log.warning("%s is not a valid JAR file", output_file_path)
+                os.unlink(output_file_path)
+                raise InvalidJARError
+        except DownloadError:
+            download_attempt -= 1
+            sleep_duration *= 2
+            log.debug("Sleeping %d seconds until next retry...", sleep_duration)
+            time.sleep(sleep_duration)
+        else:
+            return output_file_path
+
+    log.error("Failed to download %s after %d attempts", url, MAX_DOWNLOAD_ATTEMPTS)
+    raise DownloadFailedError(url)
+
+
+def _environment_key(args: argparse.Namespace) -> dict:
+    """Collect everything which the resolved environment depends on.
+
+    :param args: Parsed command line arguments.
+    :return: Key which is compared against the one stored in the environment manifest.
+    """
+
+    def mtime_ns(path: str) -> int | None:
+        with contextlib.suppress(FileNotFoundError):
+            return os.stat(path).st_mtime_ns
+        return None
+
+    return {
+        "activation_version": args.activation_version,
+        "codenarc_version": args.codenarc_version,
+        "gmetrics_version": args.gmetrics_version,
+        "groovy4": args.groovy4,
+        "groovy_home": args.groovy_home,
+        # Upgrading Groovy or editing pom.xml changes these modification times.
+        "groovy_home_mtime_ns": mtime_ns(args.groovy_home),
+        "groovy_lib_mtime_ns": mtime_ns(os.path.join(args.groovy_home, "lib")),
+        "jar_cache": args.jar_cache,
+        "jars": args.jars,
+        "jaxb_api_version": args.jaxb_api_version,
+        "pom_mtime_ns": mtime_ns(os.path.join(GROOVYLINT_HOME, "pom.xml")),
+        "resources": args.resources,
+        "slf4j_version": args.slf4j_version,
+        "stub_jar": os.path.exists(os.path.join(args.resources, STUB_JAR)),
+    }
+
+
+def _evict_cache_entries(cache_dir: str, max_size: int) -> None:
+    """Remove the least recently used cache entries until the cache fits its size limit.
+
+    Other processes may be using the same cache at the same time, so entries may vanish
+    while this function is running.
+
+    :param cache_dir: Cache directory.
+    :param max_size: Maximum size of all cache entries, in bytes.
+    """
+    entries = []
+    total_size = 0
+    for dirpath, _, filenames in os.walk(cache_dir):
+        for filename in filenames:
+            if not filename.endswith(".json"):
+                continue
+            entry_path = os.path.join(dirpath, filename)
+            try:
+                entry_stat = os.stat(entry_path)
+            except FileNotFoundError:
+                continue
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_path))
+            total_size += entry_stat.st_size
+
+    if total_size <= max_size:
+        return
+
+    log.debug("Result cache size is %d bytes, evicting old entries", total_size)
+    for _, entry_size, entry_path in sorted(entries):
+        if total_size <= max_size:
+            break
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(entry_path)
+        total_size -= entry_size
+
+
+def _expand_source_files(basedir: str, includes: str, excludes: str | None) -> list[str]:
+    """Find the files under a directory which CodeNarc would analyze.
+
+    :param basedir: CodeNarc base directory.
+    :param includes: Comma-separated list of Ant-style patterns of files to include.
+    :param excludes: Comma-separated list of Ant-style patterns of files to exclude.
+    :return: List of file paths, relative to the base directory.
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(basedir):
+        dirnames.sort()
+        relative_dir = os.path.relpath(dirpath, basedir)
+        paths.extend(
+            os.path.normpath(os.path.join(relative_dir, filename))
+            for filename in sorted(filenames)
+        )
+
+    return _filter_source_files(paths, includes, excludes)
+
+
+def _fetch_jar(
+    url: str, jar_path: str, sha256: str | None, verified_jar: dict | None
+) -> dict:
+    """Fetch a JAR file, unless an unchanged and verified copy of it already exists.
+
+    Several processes may fetch the same JAR file at the same time, so only one of them
+    downloads it while the others wait.
+
+    :param url: URL of the JAR file.
+    :param jar_path: Path to download the JAR file to.
+    :param sha256: Pinned SHA-256 digest of the JAR file, if any.
+    :param verified_jar: Digest, size and modification time of the JAR file when it was
+        last verified, if ever.
+    :return: Digest, size and modification time of the verified JAR file.
+    """
+    jar_dir = os.path.dirname(jar_path)
+    os.makedirs(jar_dir, exist_ok=True)
+    # A read-only directory, such as the resources of the Docker image when running as
+    # another user, can't be locked, but its JARs can still be verified.
+    with (
+        _file_lock(f"{jar_path}.lock")
+        if os.access(jar_dir, os.W_OK)
+        else contextlib.nullcontext()
+    ):
+        if verified_jar is not None and sha256 in {None, verified_jar["sha256"]}:
+            # Trust a JAR which has not changed since it was last verified, which avoids
+            # calculating its digest or scanning its contents again.
+            with contextlib.suppress(FileNotFoundError):
+                jar_stat = os.stat(jar_path)
+                if (jar_stat.st_size, jar_stat.st_mtime_ns) == (
+                    verified_jar["size"],
+                    verified_jar["mtime_ns"],
+                ):
+                    log.debug("%s was already verified", jar_path)
+                    return verified_jar
+
+        jar_path = _download_jar_with_retry(url, os.path.dirname(jar_path), sha256)
+        jar_digest = _file_digest(jar_path)
+        jar_stat = os.stat(jar_path)
+
+    return {
+        "sha256": jar_digest,
+        "size": jar_stat.st_size,
+        "mtime_ns": jar_stat.st_mtime_ns,
+    }
+
+
+def _fetch_jars(args: argparse.Namespace) -> None:
+    """Fetch JAR file dependencies, and verify them against their pinned digests.
+
+    :param args: Parsed command line arguments.
+    :raises UnpinnedJARsError: If no digest is pinned for some of the JAR files, unless
+        --allow-unpinned-jars was given.
+    """
+    if not os.path.exists(args.resources):
+        os.mkdir(args.resources)
+
+    jar_dir = args.jar_cache or args.resources
+    os.makedirs(jar_dir, exist_ok=True)
+    pinned_digests = _pinned_jar_digests()
+    digests_file = os.path.join(jar_dir, JAR_DIGESTS_FILE)
+    verified_jars = _read_verified_jars(digests_file)
+
+    # Download all JARs at the same time, since downloads mostly wait for the network.
+    jar_urls = _jar_urls(args)
+    with ThreadPoolExecutor(max_workers=len(jar_urls)) as executor:
+        futures = {}
+        for url in jar_urls:
+            jar_path = _jar_path(args, url, pinned_digests)
+            jar_key = os.path.relpath(jar_path, jar_dir)
+            futures[jar_key] = executor.submit(
+                _fetch_jar,
+                url,
+                jar_path,
+                pinned_digests.get(os.path.basename(jar_path)),
+                verified_jars.get(jar_key),
+            )
+        fetched_jars = {jar_key: future.result() for jar_key, future in futures.items()}
+
+    unpinned_jars = {
+        os.path.basename(jar_key): jar["sha256"]
+        for jar_key, jar in fetched_jars.items()
+        if os.path.basename(jar_key) not in pinned_digests
+    }
+    if unpinned_jars and not args.allow_unpinned_jars:
+        raise UnpinnedJARsError(unpinned_jars)
+    for jar_name, jar_digest in sorted(unpinned_jars.items()):
+        log.warning(
+            "No digest is pinned for %s in pom.xml, its SHA-256 digest is %s",
+            jar_name,
+            jar_digest,
+        )
+
+    if not os.access(jar_dir, os.W_OK):
+        log.debug("Not saving verified JARs, %s is not writable", jar_dir)
+    elif any(verified_jars.get(key) != jar for key, jar in fetched_jars.items()):
+        with _file_lock(f"{digests_file}.lock"):
+            # Other processes may have updated the file in the meantime.
+            verified_jars = _read_verified_jars(digests_file)
+            verified_jars.update(fetched_jars)
+            with _atomic_write(digests_file) as digests_fp:
+                json.dump(verified_jars, digests_fp, indent=2, sort_keys=True)
+
+
+def _file_digest(path: str) -> str:
+    """Calculate the SHA-256 digest of a file."""
+    with open(path, "rb") as digest_file:
+        return hashlib.file_digest(digest_file, "sha256").hexdigest()
+
+
+@contextlib.contextmanager
+def _file_lock(lock_path: str) -> Iterator[None]:
+    """Hold an exclusive lock on a lock file, waiting until the lock is available.
+
+    :param lock_path: Path to the lock file, which is created if needed.
+    """
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _filter_baseline(
+    violations: Iterator[Violation], baseline: Counter[str]
+) -> Iterator[Violation]:
+    """Skip violations which are in the baseline.
+
+    Each fingerprint in the baseline accounts for one violation, so that adding another
+    copy of a line which has a known violation still reports a new violation.
+
+    :param violations: Iterator of violations.
+    :param baseline: Number of known violations for each fingerprint. This is modified.
+    :return: Iterator of violations which are not in the baseline.
+    """
+    for violation in violations:
+        fingerprint = violation.fingerprint()
+        if baseline[fingerprint] > 0:
+            baseline[fingerprint] -= 1
+            log.debug("Ignoring violation in baseline: %s", fingerprint)
+        else:
+            yield violation
+
+
+def _filter_source_files(
+    paths: list[str], includes: str, excludes: str | None
+) -> list[str]:
+    """Filter a list of files by CodeNarc's include and exclude patterns.
+
+    :param paths: List of file paths, relative to the base directory.
+    :param includes: Comma-separated list of Ant-style patterns of files to include.
+    :param excludes: Comma-separated list of Ant-style patterns of files to exclude.
+    :return: List of the file paths which are included and not excluded.
+    """
+    include_patterns = [_ant_pattern_regex(p) for p in includes.split(",") if p.strip()]
+    exclude_patterns = [
+        _ant_pattern_regex(p) for p in (excludes or "").split(",") if p.strip()
+    ]
+
+    return [
+        path
+        for path in paths
+        if any(p.fullmatch(path) for p in include_patterns)
+        and not any(p.fullmatch(path) for p in exclude_patterns)
+    ]
+
+
+def _groovy_version(groovy_home: str) -> str:
+    """Determine the version of a Groovy installation.
+
+    The version is taken from the name of the Groovy JAR file in the installation's lib
+    directory, which avoids starting a JVM just to run `groovy --version`.
+
+    :param groovy_home: Path of the Groovy installation.
+    :return: Version of Groovy, for example "4.0.15".
+    """
+    with contextlib.suppress(FileNotFoundError):
+        for name in sorted(os.listdir(os.path.join(groovy_home, "lib"))):
+            match = re.fullmatch(r"groovy-(\d+\.\d+\.\d+[\w.-]*)\.jar", name)
+            if match:
+                log.debug("Groovy version from %s: %s", name, match.group(1))
+                return match.group(1)
+
+    groovy_bin = os.path.join(groovy_home, "bin", "groovy")
+    log.debug("Checking version for groovy binary %s", groovy_bin)
+    groovy_version = subprocess.check_output([f"{groovy_bin}", "--version"]).decode()
+    log.debug("Groovy version string: %s", groovy_version)
+    return groovy_version.removeprefix("Groovy Version: ").split()[0]
+
+
+def _guess_groovy_home() -> str | None:
+    """Try to determine the location where Groovy is installed.
+
+    :return: Path of the Groovy installation, or None if it can't be determined.
+    """
+    if "GROOVY_HOME" in os.environ:
+        return os.environ["GROOVY_HOME"]
+
+    if platform.system() == "Darwin":
+        brew_groovy_home = "/usr/local/opt/groovysdk/libexec"
+        if os.path.exists(brew_groovy_home):
+            return brew_groovy_home
+    if platform.system() == "Linux":
+        # Many Linux distros have Groovy packages which use this location.
+        linux_groovy_home = "/usr/share/groovy"
+        if os.path.exists(linux_groovy_home):
+            return linux_groovy_home
+
+    return None
+
+
+def _install_cds_archive(args: argparse.Namespace, classpath: str | None = None) -> None:
+    """Move a CDS archive created by a JVM which has exited into place.
+
+    Archives for other classpaths or JDKs are removed, since they won't be used again.
+
+    :param args: Parsed command line arguments.
+    :param classpath: Classpath of the JVM, if it was not the full classpath.
+    """
+    archive = _cds_archive_path(
+        args, classpath or args.classpath or _build_classpath(args)
+    )
+    temp_archive = _cds_temp_path(archive)
+    if not os.path.exists(temp_archive):
+        return
+
+    os.replace(temp_archive, archive)
+    log.debug("Created CDS archive %s", archive)
+    for name in os.listdir(args.resources):
+        path = os.path.join(args.resources, name)
+        if (
+            name.startswith(CDS_ARCHIVE_PREFIX)
+            and name.endswith(".jsa")
+            and path != archive
+        ):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+
+def _is_groovy4(groovy_home: str) -> bool:
+    return _groovy_version(groovy_home).startswith("4.")
+
+
+def _is_jar_metadata(name: str) -> bool:
+    """Determine if a JAR entry is not a resource, or describes the JAR which contains it.
+
+    Such entries are not copied to the bundle JAR, which only uses the base versions of
+    multi-release JARs, and which is not signed. Service and Groovy extension module
+    descriptors are found in the JARs behind the bundle, and a copy in the bundle would
+    register Groovy's extension modules twice.
+    """
+    return (
+        name.endswith((".class", "/", ".SF", ".RSA", ".DSA", ".EC"))
+        or name in {"META-INF/MANIFEST.MF", "META-INF/INDEX.LIST"}
+        or name.startswith(
+            ("META-INF/groovy/", "META-INF/services/", "META-INF/versions/")
+        )
+    )
+
+
+def _is_slf4j_line(line: str) -> bool:
+    """Determine if a log line was produced by SLF4J.
+
+    CodeNarc in some cases prints things to stdout, or uses multi-line logging calls which
+    cannot be parsed correctly when we attempt to re-log them in _log_codenarc_output.
+    """
+    return isinstance(logging.getLevelName(line.split(" ", maxsplit=1)[0]), int)
+
+
+def _is_valid_jar(file_path: str) -> bool:
+    """Determine if a file is a valid JAR file."""
+    log.debug("Verifying %s", file_path)
+    try:
+        with zipfile.ZipFile(file_path, "r") as jar_file:
+            if "META-INF/MANIFEST.MF" not in jar_file.namelist():
+                log.warning("%s does not appear to be a valid JAR", file_path)
+                return False
+    except zipfile.BadZipfile:
+        log.warning("%s is not a valid zipfile", file_path)
+        return False
+
+    return True
+
+
+def _iter_files(
+    events: Iterator[tuple[str, ET.Element]],
+) -> Iterator[tuple[str, Iterator[ET.Element]]]:
+    """Iterate over the File elements of the current Package element.
+
+    :param events: Iterator of report parsing events, positioned inside a Package.
+    :return: Iterator of (file name, Violation elements iterator) tuples.
+    """
+    for event, element in events:
+        if event == "end" and element.tag == "Package":
+            return
+        if event == "start" and element.tag == "File":
+            violations = _iter_violations(events)
+            yield element.attrib["name"], violations
+            # Make sure that the parser is positioned after this File element, even if the
+            # caller did not consume all of its violations.
+            for _ in violations:
+                pass
+
+
+def _iter_packages(
+    events: Iterator[tuple[str, ET.Element]],
+) -> Iterator[tuple[str, Iterator[tuple[str, Iterator[ET.Element]]]]]:
+    """Iterate over the Package elements of a report.
+
+    :param events: Iterator of report parsing events.
+    :return: Iterator of (package path, File iterator) tuples.
+    """
+    for event, element in events:
+        if event == "start" and element.tag == "Package":
+            files = _iter_files(events)
+            yield element.attrib["path"], files
+            for _ in files:
+                pass
+
+
+def _iter_report_events(xml_file: BinaryIO) -> Iterator[tuple[str, ET.Element]]:
+    """Incrementally parse a CodeNarc XML report.
+
+    Elements are freed once they have been completely parsed and handed to the caller, so
+    memory usage stays constant regardless of the size of the report.
+
+    :param xml_file: Report file opened in binary mode.
+    :return: Iterator of (event, element) tuples, as produced by ET.iterparse.
+    """
+    root = None
+    for event, element in ET.iterparse(xml_file, events=("start", "end")):
+        if root is None:
+            root = element
+        # The Rules element comes after all Package elements, and contains only the rule
+        # descriptions, which we don't use. Therefore we can stop parsing here.
+        if element.tag == "Rules":
+            return
+
+        yield event, element
+
+        if event == "end":
+            if element.tag in {"File", "Violation"}:
+                element.clear()
+            elif element.tag == "Package":
+                root.clear()
+
+
+def _iter_report_violations(
+    packages: Iterator[tuple[str, Iterator[tuple[str, Iterator[ET.Element]]]]],
+) -> Iterator[Violation]:
+    """Iterate over all violations in a report.
+
+    :param packages: Iterator of (package path, File iterator) tuples.
+    :return: Iterator of violations, in the same order as in the report.
+    """
+    for path, files in packages:
+        # CodeNarc uses the empty string for the top-level package, which we translate to
+        # '.', which prevents the violation files from appearing as belonging to '/'.
+        package_path = path or "."
+        log.debug("Parsing violations in package: %s", package_path)
+
+        for file_name, violations in files:
+            package_file_name = f"{package_path}/{file_name}"
+            log.debug("Parsing violations in file: %s", package_file_name)
+
+            for violation in violations:
+                line_number = violation.attrib.get("lineNumber")
+                message_element = violation.find("Message")
+                yield Violation(
+                    path=package_file_name,
+                    line=int(line_number) if line_number else None,
+                    rule=violation.attrib["ruleName"],
+                    priority=int(violation.attrib["priority"]),
+                    message=(
+                        message_element.text if message_element is not None else None
+                    ),
+                    source_line=violation.findtext("SourceLine"),
+                )
+
+
+def _iter_violations(events: Iterator[tuple[str, ET.Element]]) -> Iterator[ET.Element]:
+    """Iterate over the Violation elements of the current File element.
+
+    :param events: Iterator of report parsing events, positioned inside a File.
+    :return: Iterator of completely parsed Violation elements.
+    """
+    for event, element in events:
+        if event == "end":
+            if element.tag == "File":
+                return
+            if element.tag == "Violation":
+                yield element
+
+
+def _jar_path(args: argparse.Namespace, url: str, pinned_digests: dict[str, str]) -> str:
+    """Get the path of a JAR dependency.
+
+    JARs in the shared JAR cache are stored by their pinned digest, or by the digest of
+    their URL if they have none. Otherwise, JARs are stored in the resources directory.
+
+    :param args: Parsed command line arguments.
+    :param url: URL of the JAR file.
+    :param pinned_digests: Dict of JAR file names to their pinned SHA-256 digests.
+    :return: Path to the JAR file.
+    """
+    jar_name = url.rsplit("/", maxsplit=1)[-1]
+    if not args.jar_cache:
+        return os.path.join(args.resources, jar_name)
+
+    key = pinned_digests.get(jar_name) or hashlib.sha256(url.encode()).hexdigest()
+    return os.path.join(args.jar_cache, key, jar_name)
+
+
+def _jar_urls(args: argparse.Namespace) -> list[str]:
+    """Get the URLs of the JAR dependencies, in classpath order."""
+    codenarc_version = _codenarc_version(args.codenarc_version, is_groovy4=args.groovy4)
+    return [
+        (
+            "https://github.com/CodeNarc/CodeNarc/releases/download"
+            f"/v{args.codenarc_version}/CodeNarc-{codenarc_version}.jar"
+        ),
+        (
+            "https://github.com/dx42/gmetrics/releases/download"
+            f"/v{args.gmetrics_version}/GMetrics-{args.gmetrics_version}.jar"
+        ),
+        (
+            "https://repo1.maven.org/maven2/javax/activation/activation"
+            f"/{args.activation_version}/activation-{args.activation_version}.jar"
+        ),
+        (
+            "https://repo1.maven.org/maven2/javax/xml/bind/jaxb-api"
+            f"/{args.jaxb_api_version}/jaxb-api-{args.jaxb_api_version}.jar"
+        ),
+        (
+            f"https://repo1.maven.org/maven2/org/slf4j/slf4j-api/{args.slf4j_version}"
+            f"/slf4j-api-{args.slf4j_version}.jar"
+        ),
+        (
+            f"https://repo1.maven.org/maven2/org/slf4j/slf4j-simple/{args.slf4j_version}"
+            f"/slf4j-simple-{args.slf4j_version}.jar"
+        ),
+    ]
+
+
+def _java_call(
+    args: argparse.Namespace,
+    num_files: int | None = None,
+    classpath: str | None = None,
+    *,
+    create_cds_archive: bool = True,
+) -> list[str]:
+    """Construct the command to start a JVM with the CodeNarc classpath.
+
+    :param args: Parsed command line arguments.
+    :param num_files: Number of files which the JVM analyzes, if known.
+    :param classpath: Classpath to use instead of the full CodeNarc classpath.
+    :param create_cds_archive: Whether the JVM should create a missing CDS archive with
+        --cds. Helper JVMs, which load other classes than CodeNarc, only use an existing
+        archive.
+    :return: Command to start the JVM, without the main class.
+    """
+    slf4j_log_level = {logging.DEBUG: "debug", logging.WARNING: "warn", None: "info"}[
+        args.log_level
+    ]
+    classpath = classpath or args.classpath or _build_classpath(args)
+
+    return [
+        "java",
+        *_jvm_options(args, num_files),
+        *(
+            _cds_options(args, classpath, create_archive=create_cds_archive)
+            if args.cds
+            else []
+        ),
+        *(
+            # CodeNarc's analyzers log each file at debug level, which shows progress.
+            ["-Dorg.slf4j.simpleLogger.log.org.codenarc.analyzer=debug"]
+            if args.progress_timeout
+            else []
+        ),
+        "-Dorg.slf4j.simpleLogger.showThreadName=false",
+        f"-Dorg.slf4j.simpleLogger.defaultLogLevel={slf4j_log_level}",
+        "-classpath",
+        classpath,
+    ]
+
+
+def _java_version() -> str:
+    """Identify the JDK which runs CodeNarc, without starting a JVM.
+
+    :return: Contents of the JDK's release file, or the path and modification time of
+        the java binary if the JDK has no release file.
+    """
+    java_bin = os.path.realpath(shutil.which("java") or "java")
+    release_file = os.path.join(os.path.dirname(os.path.dirname(java_bin)), "release")
+    try:
+        with open(release_file, encoding="utf-8") as release_fp:
+            return release_fp.read()
+    except OSError:
+        with contextlib.suppress(OSError):
+            return f"{java_bin}:{os.stat(java_bin).st_mtime_ns}"
+        return java_bin
+
+
+def _jvm_options(args: argparse.Namespace, num_files: int | None = None) -> list[str]:
+    """Get the options for the JVM which runs CodeNarc.
+
+    With the automatic JVM profile, the heap is sized for the number of files, but not
+    above a share of the memory limit of the cgroup (or the physical memory) for each
+    of the --jobs JVMs. The serial garbage collector is used for small heaps or a
+    single CPU, and the parallel one otherwise, since CodeNarc is a batch job which
+    does not need short pauses. Short runs only use the quick JIT compiler. If the
+    number of files is unknown, the JVM's own container-aware defaults are used. Options
+    from --jvm-opt are added last, and replace the profile's choice of the same kind.
+
+    :param args: Parsed command line arguments.
+    :param num_files: Number of files which CodeNarc analyzes, if known.
+    :return: Options to add to the java command.
+    """
+    if args.jvm_profile == "none":
+        return args.jvm_opts
+    if num_files is None:
+        log.debug("Number of files is unknown, using the JVM's default options")
+        return args.jvm_opts
+
+    memory_limit = _cgroup_memory_limit()
+    if memory_limit is None:
+        memory_limit = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    cpu_limit = _cgroup_cpu_limit() or os.cpu_count() or 1
+
+    heap_share_mb = int(memory_limit * JVM_MAX_HEAP_FRACTION / max(1, args.jobs) / 2**20)
+    heap_mb = min(
+        heap_share_mb, JVM_BASE_HEAP_MB + num_files * JVM_HEAP_PER_FILE_KB // 1024
+    )
+    heap_mb = max(JVM_MIN_HEAP_MB, heap_mb)
+    # The JVM's own ergonomics also use the serial collector below these limits.
+    gc = "Serial" if cpu_limit < 2 or heap_mb < 1792 else "Parallel"  # noqa: PLR2004
+    short_run = num_files < JVM_SHORT_RUN_FILES
+
+    log.info(
+        "JVM profile: %d MB heap, %s GC%s (memory limit %d MB, %g CPUs, %d files)",
+        heap_mb,
+        gc,
+        ", quick JIT only" if short_run else "",
+        memory_limit // 2**20,
+        cpu_limit,
+        num_files,
+    )
+    options = []
+    if not any(option.startswith("-Xmx") for option in args.jvm_opts):
+        options.append(f"-Xmx{heap_mb}m")
+    if not any(re.fullmatch(r"-XX:\+Use\w+GC", option) for option in args.jvm_opts):
+        options.append(f"-XX:+Use{gc}GC")
+    if short_run and not any(
+        option.startswith("-XX:TieredStopAtLevel=") for option in args.jvm_opts
+    ):
+        options.append("-XX:TieredStopAtLevel=1")
+    return [*options, *args.jvm_opts]
+
+
+def _log_codenarc_output(
+    lines: Iterable[str], *, fail_fast: bool = False, metrics: dict | None = None
+) -> bool:
+    """Re-log lines from CodeNarc's output.
+
+    This function takes a log line generated by CodeNarc and re-logs it with the logging
+    framework. We take the log level, which is the first word of the line output, which
+    can be used to determine the corresponding log level in Python's logging framework.
+    Lines are logged as soon as they are read, so CodeNarc's output can be followed while
+    it is running.
+
+    :param lines: Lines of CodeNarc's output.
+    :param fail_fast: Stop reading lines after the first compilation error.
+    :param metrics: If given, the results from CodeNarc's summary line are added to these
+        metrics.
+    :return: True if CodeNarc failed to compile any of the files.
+    """
+    compilation_failed = False
+    log_level = logging.INFO
+    for line in lines:
+        # Trim out empty lines which CodeNarc prints in its output.
+        if not line:
+            continue
+
+        # The last line of CodeNarc's output is (usually) a summary line, which is
+        # printed to stdout and not through SLF4J. If CodeNarc fails due to some other
+        # problem, it will not print this line, however.
+        if line.startswith("CodeNarc completed:"):
+            log.debug(line)
+            summary = CODENARC_SUMMARY_PATTERN.match(line)
+            if summary and metrics is not None:
+                p1, p2, p3, milliseconds = map(int, summary.groups())
+                metrics.setdefault("codenarc_runs", []).append(
+                    {"p1": p1, "p2": p2, "p3": p3, "seconds": milliseconds / 1000}
+                )
+            continue
+
+        line_words = line.split(" ")
+        if _is_slf4j_line(line):
+            log_level = logging.getLevelName(line_words[0])
+            log_message = " ".join(line_words[1:])
+        else:
+            # If we can't determine the log level, that likely means that this line is a
+            # continuation of the previous line. This occurs when CodeNarc is logging
+            # compilation messages, stacktraces, etc. In these cases, we should use the
+            # same logging level as the last known line. Also, here we need to log the
+            # entire line and not chop off the first word.
+            log_message = line
+
+        log.log(log_level, log_message)
+
+        # CodeNarc doesn't fail on compilation errors, it just logs a message for each
+        # file that could not be compiled and generates a report for everything else.
+        if "Compilation failed" in line:
+            compilation_failed = True
+            if fail_fast:
+                break
+
+    return compilation_failed
+
+
+def _log_rule_profile(profile_file: str) -> list[dict]:
+    """Log the rules of a profile, ordered by the analysis time they cost.
+
+    :param profile_file: Path to the tab-separated profile written by the RuleProfiler.
+    :return: List of rules, with the most expensive one first.
+    """
+    rules = []
+    with open(profile_file, encoding="utf-8") as profile_fp:
+        for line in profile_fp:
+            name, rule_class, calls, nanos, allocated_bytes, violations = line.rstrip(
+                "\n"
+            ).split("\t")
+            rules.append(
+                {
+                    "name": name,
+                    "class": rule_class,
+                    "files": int(calls),
+                    "seconds": int(nanos) / 1e9,
+                    "allocated_bytes": int(allocated_bytes),
+                    "violations": int(violations),
+                }
+            )
+    rules.sort(key=lambda rule: (-rule["seconds"], rule["name"]))
+
+    total_seconds = sum(rule["seconds"] for rule in rules) or 1
+    profile_lines = [
+        f"Analysis time of {len(rules)} rules:",
+        f"  {'time':>10}  {'share':>6}  {'allocated':>12}  {'violations':>10}  rule",
+        *(
+            f"  {rule['seconds'] * 1000:8.1f}ms  "
+            f"{rule['seconds'] / total_seconds:6.1%}  "
+            f"{rule['allocated_bytes'] / 2**20:10.1f}MB  "
+            f"{rule['violations']:10d}  {rule['name']}"
+            for rule in rules
+        ),
+    ]
+    log.info("%s", "\n".join(profile_lines))
+    return rules
+
+
+def _merge_xml_reports(
+    report_files: list[str], report_file: str, source_files: list[str] | None = None
+) -> None:
+    """Merge several CodeNarc XML reports into a single report.
+
+    :param report_files: Paths to the report files to merge.
+    :param report_file: Path to the merged report file to write.
+    :param source_files: If given, write violations in the order of these files instead
+        of the order of the reports.
+    """
+    total_files = 0
+    file_violations = {}
+    for path in report_files:
+        log.debug("Merging report file %s", path)
+        num_files, violations = _read_xml_report(path)
+        total_files += num_files
+        # Reports of overlapping runs may both have violations for the same file.
+        for file_path, violation_list in violations.items():
+            file_violations.setdefault(file_path, []).extend(violation_list)
+
+    if source_files is not None:
+        file_violations = {
+            **{
+                path: file_violations[path]
+                for path in source_files
+                if path in file_violations
+            },
+            **file_violations,
+        }
+
+    _write_xml_report(report_file, total_files, file_violations)
+
+
+def _node_shard(
+    basedir: str, source_files: list[str], shard: int, num_shards: int
+) -> list[str]:
+    """Select the files of one shard when splitting a run across several nodes.
+
+    Every node expands the same list of files, but possibly in a different order, so the
+    files are first ordered by a stable hash of their path. They are then split by size
+    with _shard_files(), which gives every node the same shards.
+
+    :param basedir: CodeNarc base directory.
+    :param source_files: List of file paths, relative to the base directory.
+    :param shard: Number of the shard to select, starting at 1.
+    :param num_shards: Total number of shards.
+    :return: Files of the selected shard, in the same order as in source_files.
+    """
+    hashed_files = sorted(
+        source_files,
+        key=lambda path: hashlib.sha256(path.encode("utf-8")).digest(),
+    )
+    # _shard_files() fills the shards in order, so only trailing shards can be empty.
+    shards = _shard_files(basedir, hashed_files, num_shards)
+    selected_files = set(shards[shard - 1]) if shard <= len(shards) else set()
+    return [path for path in source_files if path in selected_files]
+
+
+def _parse_output_args(args: list[str]) -> argparse.Namespace:
+    """Parse only the arguments which control how violations and metrics are reported.
+
+    :param args: Command line arguments.
+    :return: Parsed arguments, with empty metrics.
+    """
+    arg_parser = argparse.ArgumentParser()
+    _add_output_arguments(arg_parser)
+    parsed_args = arg_parser.parse_args(args)
+    parsed_args.metrics = {"phases": {}}
+    return parsed_args
+
+
+def _parse_shard(value: str) -> tuple[int, int]:
+    """Parse a shard given as "i/N" on the command line.
+
+    :param value: Command line value.
+    :return: Tuple of the shard number (starting at 1) and the number of shards.
+    """
+    match = re.fullmatch(r"(\d+)/(\d+)", value)
+    if not match or not 1 <= int(match[1]) <= int(match[2]):
+        msg = f'invalid shard "{value}", expected "i/N" with 1 <= i <= N'
+        raise argparse.ArgumentTypeError(msg)
+    return int(match[1]), int(match[2])
+
+
+def _pinned_jar_digests() -> dict[str, str]:
+    """Get the pinned SHA-256 digests of the JAR dependencies from the pom.xml file.
+
+    :return: Dict of JAR file names to their SHA-256 digests.
+    """
+    namespace = {"project": "http://maven.apache.org/POM/4.0.0"}
+    pom_root = ET.parse(os.path.join(GROOVYLINT_HOME, "pom.xml")).getroot()
+    properties = pom_root.find("project:properties", namespace)
+    prefix = f"{{{namespace['project']}}}sha256."
+
+    return {
+        prop.tag.removeprefix(prefix): prop.text.strip()
+        for prop in ([] if properties is None else properties)
+        if prop.tag.startswith(prefix) and prop.text and prop.text.strip()
+    }
+
+
+def _prepare_environment(args: argparse.Namespace) -> None:
+    """Fetch the JAR dependencies and resolve the classpath for running CodeNarc.
+
+    The resolved environment is saved to a manifest in the resources directory, if it is
+    writable. As long as neither the Groovy installation, pom.xml nor any of the JAR files
+    have changed since, later runs use the manifest instead of checking every JAR file
+    again.
+
+    :param args: Parsed command line arguments. The classpath is stored in
+        `args.classpath`.
+    """
+    environment_key = _environment_key(args)
+    manifest_file = os.path.join(args.resources, ENVIRONMENT_FILE)
+    manifest = None
+    # A manifest which can't be read, for example because another user wrote it, is
+    # treated like an outdated one.
+    with (
+        contextlib.suppress(OSError, json.JSONDecodeError),
+        open(manifest_file, encoding="utf-8") as manifest_fp,
+    ):
+        manifest = json.load(manifest_fp)
+
+    if manifest is not None and manifest.get("key") == environment_key:
+        with contextlib.suppress(OSError):
+            if all(
+                [os.stat(jar).st_size, os.stat(jar).st_mtime_ns] == jar_stat
+                for jar, jar_stat in manifest["jars"].items()
+            ):
+                log.debug("Using environment from %s", manifest_file)
+                args.classpath = manifest["classpath"]
+                return
+
+    with _timed(args.metrics, "fetch_jars"):
+        _fetch_jars(args)
+    args.classpath = _build_classpath(args)
+    jars = [path for path in args.classpath.split(":") if path.endswith(".jar")]
+    manifest = {
+        "key": environment_key,
+        "classpath": args.classpath,
+        "codenarc_version": _codenarc_version(
+            args.codenarc_version, is_groovy4=args.groovy4
+        ),
+        "groovy_version": _groovy_version(args.groovy_home),
+        "jars": {jar: [os.stat(jar).st_size, os.stat(jar).st_mtime_ns] for jar in jars},
+    }
+    if not os.access(args.resources, os.W_OK):
+        log.debug("Not saving environment, %s is not writable", args.resources)
+        return
+    with _atomic_write(manifest_file) as manifest_fp:
+        json.dump(manifest, manifest_fp, indent=2, sort_keys=True)
+
+
+def _print_violations(violations: Iterator[Violation]) -> Iterator[Violation]:
+    """Print violations as they are passed through.
+
+    :param violations: Iterator of violations.
+    :return: Iterator of the same violations.
+    """
+    for violation in violations:
+        log.error(
+            "%s:%s: %s: %s",
+            violation.path,
+            violation.line,
+            violation.rule,
+            violation.message or "[empty message]",
+        )
+        yield violation
+
+
+def _read_baseline(baseline_file: str) -> Counter[str]:
+    """Read the fingerprints of known violations from a baseline file.
+
+    :param baseline_file: Path to the baseline file, which has one fingerprint per line.
+    :return: Number of known violations for each fingerprint.
+    """
+    try:
+        with open(baseline_file, encoding="utf-8") as baseline_fp:
+            return Counter(line.strip() for line in baseline_fp if line.strip())
+    except FileNotFoundError:
+        log.warning("Baseline file %s does not exist, using an empty one", baseline_file)
+        return Counter()
+
+
+def _read_cache_entry(cache_dir: str, key: str | None) -> list[dict] | None:
+    """Read the cached violations for a source file.
+
+    :param cache_dir: Cache directory.
+    :param key: Cache key of the source file.
+    :return: List of violations, or None if there is no (valid) cache entry.
+    """
+    if key is None:
+        return None
+
+    entry_path = _cache_entry_path(cache_dir, key)
+    try:
+        with open(entry_path, encoding="utf-8") as entry_file:
+            violations = json.load(entry_file)["violations"]
+        # Update the modification time, which is used to evict the least recently used
+        # entries from the cache.
+        os.utime(entry_path)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return violations
+
+
+def _read_file_list(path: str) -> list[str]:
+    """Read a list of files which are separated by NUL characters or newlines.
+
+    :param path: Path to the file containing the list, or "-" to read from stdin.
+    :return: List of file paths.
+    """
+    if path == "-":
+        file_list = sys.stdin.read()
+    else:
+        with open(path, encoding="utf-8") as file_list_file:
+            file_list = file_list_file.read()
+
+    separator = "\0" if "\0" in file_list else "\n"
+    return [file_path for file_path in file_list.split(separator) if file_path.strip()]
+
+
+def _read_package_summary(events: Iterator[tuple[str, ET.Element]]) -> dict[str, int]:
+    """Read the totals from the PackageSummary element of a report.
+
+    :param events: Iterator of report parsing events, which is advanced past the
+        PackageSummary element.
+    :return: Dict with the number of files, files with violations and violations of each
+        priority, or an empty dict if the report has no PackageSummary element.
+    """
+    for event, element in events:
+        if event == "end" and element.tag == "PackageSummary":
+            return {
+                "files": int(element.attrib["totalFiles"]),
+                "files_with_violations": int(
+                    element.attrib.get("filesWithViolations", 0)
+                ),
+                **{
+                    f"priority{priority}": int(
+                        element.attrib.get(f"priority{priority}", 0)
+                    )
+                    for priority in (1, 2, 3)
+                },
+            }
+    return {}
+
+
+def _read_report(report_fp: BinaryIO) -> tuple[dict[str, int], Iterator[Violation]]:
+    """Read a report written by the CodeNarc XML or the groovylint NDJSON report writer.
+
+    :param report_fp: Report file opened in binary mode.
+    :return: Tuple of the totals from the report (see _read_package_summary()), and an
+        iterator of its violations.
+    """
+    if report_fp.peek(1)[:1] != b"{":
+        events = _iter_report_events(report_fp)
+        summary = _read_package_summary(events)
+        return summary, _iter_report_violations(_iter_packages(events))
+
+    def iter_violations() -> Iterator[Violation]:
+        for line in report_fp:
+            record = json.loads(line)
+            # Use the same paths as for the XML report, where the files of the top-level
+            # package are in ".".
+            directory, file_name = os.path.split(record["path"])
+            yield Violation(
+                path=f"{directory or '.'}/{file_name}",
+                line=record["line"],
+                rule=record["rule"],
+                priority=record["priority"],
+                message=record["message"],
+                source_line=record["source_line"],
+            )
+
+    summary = json.loads(report_fp.readline() or "{}")
+    return summary, iter_violations()
+
+
+def _read_ruleset_map(ruleset_map_file: str) -> dict[str, str]:
+    """Read a ruleset map file.
+
+    :param ruleset_map_file: Path to a JSON file which maps directories, relative to the
+        base directory, to rulesets in the format of CodeNarc's -rulesetfiles option.
+        Relative "file:" rulesets are relative to the directory of the map file.
+    :return: Rulesets for directories.
+    """
+    with open(ruleset_map_file, encoding="utf-8") as ruleset_map_fp:
+        ruleset_map = json.load(ruleset_map_fp)
+
+    map_dir = os.path.dirname(os.path.abspath(ruleset_map_file))
+    return {
+        os.path.normpath(directory): ",".join(
+            f"file:{os.path.join(map_dir, ruleset.removeprefix('file:'))}"
+            if ruleset.startswith("file:")
+            else ruleset
+            for ruleset in rulesets.split(",")
+        )
+        for directory, rulesets in ruleset_map.items()
+    }
+
+
+def _read_verified_jars(digests_file: str) -> dict:
+    """Read the records of previously verified JAR files.
+
+    :param digests_file: Path to the file with the records.
+    :return: Dict of JAR paths (relative to the JAR directory) to their records.
+    """
+    try:
+        with open(digests_file, encoding="utf-8") as digests_fp:
+            return json.load(digests_fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _read_xml_report(report_file: str) -> tuple[int, dict[str, list[dict]]]:
+    """Read the results from a report file generated by CodeNarc.
+
+    :param report_file: Path to the CodeNarc XML or NDJSON report file.
+    :return: Tuple of the number of scanned files, and a dict of file paths (relative to
+        the base directory) to a list of their violations.
+    """
+    file_violations = {}
+
+    with open(report_file, "rb") as report_fp:
+        summary, violations = _read_report(report_fp)
+        for violation in violations:
+            file_violations.setdefault(os.path.normpath(violation.path), []).append(
+                {
+                    "ruleName": violation.rule,
+                    "priority": str(violation.priority),
+                    "lineNumber": "" if violation.line is None else str(violation.line),
+                    "sourceLine": violation.source_line,
+                    "message": violation.message,
+                }
+            )
+
+    return summary.get("files", 0), file_violations
+
+
+def _resolve_args(args: argparse.Namespace) -> None:
+    """Fill in the arguments which are derived from other arguments.
+
+    :param args: Parsed command line arguments, which are updated in place.
+    """
+    args.command = "run"
+    # Durations of the phases of the run, and other metrics for --metrics-file.
+    args.metrics = {"phases": {}}
+    with _timed(args.metrics, "groovy_version"):
+        args.groovy4 = _is_groovy4(args.groovy_home)
+    # Resolved by _prepare_environment(), otherwise _java_call() builds it on demand.
+    args.classpath = None
+    # Set by run_codenarc_parallel() with --fail-fast, see _shard_process().
+    args.shard_processes = None
+    args.shards_failed = None
+
+    if args.server_socket is None:
+        args.server_socket = os.path.join(args.resources, DEFAULT_SERVER_SOCKET)
+
+    if args.jobs == 0:
+        args.jobs = max(1, int(_cgroup_cpu_limit() or os.cpu_count() or 1))
+    if args.files_from:
+        args.files = _read_file_list(args.files_from)
+
+    args.codenarc_options = [
+        option for sublist in args.codenarc_options for option in sublist
+    ]
+
+
+def _resolve_rulesets(args: argparse.Namespace, rulesets: str | None = None) -> str:
+    """Get the rulesets to give to CodeNarc.
+
+    :param args: Parsed command line arguments.
+    :param rulesets: Rulesets in the format of CodeNarc's -rulesetfiles option. Defaults
+        to the rulesets from the CodeNarc options, or the default ruleset.
+    :return: Rulesets, which are pre-compiled if --compile-rulesets was given.
+    """
+    # The default ruleset is loaded from the classpath, so it must not be an absolute
+    # path, only one relative to the classpath.
+    rulesets = (
+        rulesets
+        or _codenarc_option(args.codenarc_options, "-rulesetfiles")
+        or RULESET_FILE
+    )
+    if args.compile_rulesets:
+        rulesets = ",".join(
+            _compiled_ruleset(args, ruleset) for ruleset in rulesets.split(",")
+        )
+    return rulesets
+
+
+def _ruleset_for_file(ruleset_map: dict[str, str], path: str) -> str | None:
+    """Find the ruleset for a file in a ruleset map.
+
+    :param ruleset_map: Rulesets for directories relative to the base directory.
+    :param path: Path of the file relative to the base directory.
+    :return: Rulesets of the most specific directory which contains the file, or None if
+        no directory in the map contains it.
+    """
+    ruleset_dir = os.path.dirname(os.path.normpath(path))
+    while True:
+        rulesets = ruleset_map.get(ruleset_dir or ".")
+        if rulesets is not None or not ruleset_dir:
+            return rulesets
+        ruleset_dir = os.path.dirname(ruleset_dir)
+
+
+def _run_codenarc_bisect(
+    args: argparse.Namespace,
+    report_file: str,
+    source_files: list[str],
+    rulesets: str | None,
+    slow_files: dict[str, float],
+) -> str:
+    """Run CodeNarc, and find the files which make it time out.
+
+    If CodeNarc times out, it is run again on each half of the files, until the files
+    which make it time out on their own are found. These files are left out of the
+    report and added to slow_files, and all other files are analyzed as usual. Once
+    MAX_BISECT_TIMEOUTS runs have timed out, the files are not split any further, and
+    all files of a run which times out count as slow. Since each file is only analyzed
+    once by a run which does not time out, bisection then takes a bounded time.
+
+    :param args: Parsed command line arguments.
+    :param report_file: Path to the report file to generate.
+    :param source_files: Files to analyze, relative to the base directory.
+    :param rulesets: Rulesets to use, or None for the rulesets from the arguments.
+    :param slow_files: Dict of file paths to the time after which CodeNarc was stopped,
+        which is updated with the slow files that were found.
+    :return: Path to the XML report file.
+    """
+    timeouts_left = MAX_BISECT_TIMEOUTS
+
+    def bisect(report_file: str, source_files: list[str]) -> str:
+        nonlocal timeouts_left
+        try:
+            return run_codenarc(args, report_file, source_files, rulesets)
+        except CodeNarcTimeoutError as error:
+            timeouts_left -= 1
+            if len(source_files) > 1 and timeouts_left > 0:
+                log.warning("%s, bisecting %d files", error, len(source_files))
+            else:
+                log.warning("%s, giving up on %d file(s)", error, len(source_files))
+                slow_files.update(dict.fromkeys(source_files, error.seconds))
+                # The slow files were scanned, even if CodeNarc did not finish them.
+                _write_xml_report(report_file, len(source_files), {})
+                return report_file
+
+        middle = len(source_files) // 2
+        report_files = [
+            bisect(f"{report_file}.{index}", half)
+            for index, half in enumerate((source_files[:middle], source_files[middle:]))
+        ]
+        _merge_xml_reports(report_files, report_file, source_files)
+        return report_file
+
+    return bisect(report_file, source_files)
+
+
+def _run_codenarc_java(
+    args: argparse.Namespace,
+    codenarc_args: list[str],
+    classpath: str,
+    java_options: list[str],
+) -> tuple[bool, int, bool]:
+    """Run CodeNarc in a new process, and log its output.
+
+    :param args: Parsed command line arguments.
+    :param codenarc_args: Arguments to pass to CodeNarc.
+    :param classpath: Classpath of the JVM.
+    :param java_options: Additional options for the JVM.
+    :return: Whether CodeNarc failed to compile any file, its exit code, and whether
+        any class could not be loaded.
+    """
+    source_files = _codenarc_option(codenarc_args, "-sourcefiles")
+    codenarc_call = [
+        *_java_call(
+            args, source_files.count(",") + 1 if source_files else None, classpath
+        ),
+        *java_options,
+        "org.codenarc.CodeNarc",
+        *codenarc_args,
+    ]
+    classes_missing = False
+
+    log.debug("Executing CodeNarc command: %s", " ".join(codenarc_call))
+    with (
+        subprocess.Popen(
+            codenarc_call,
+            encoding="utf-8",
+            errors="replace",
+            stderr=subprocess.STDOUT,
+            stdout=subprocess.PIPE,
+        ) as process,
+        _shard_process(args, process),
+        _watchdog(process, args.timeout, args.progress_timeout) as progress,
+    ):
+
+        def output_lines() -> Iterator[str]:
+            nonlocal classes_missing
+            for line in process.stdout:
+                progress()
+                if "NoClassDefFoundError" in line or "ClassNotFoundException" in line:
+                    classes_missing = True
+                yield line.rstrip("\n")
+
+        compilation_failed = _log_codenarc_output(
+            output_lines(), fail_fast=args.fail_fast, metrics=args.metrics
+        )
+        if compilation_failed and args.fail_fast:
+            log.error("Stopping CodeNarc after the first compilation error")
+            process.kill()
+            raise CompilationError
+        returncode = process.wait()
+    if args.cds:
+        _install_cds_archive(args, classpath)
+
+    if returncode != 0:
+        log.error("Failed executing command: %s", " ".join(codenarc_call))
+        log.error("CodeNarc exited with code %d", returncode)
+
+    return compilation_failed, returncode, classes_missing
+
+
+def _run_codenarc_process(
+    args: argparse.Namespace, codenarc_args: list[str]
+) -> tuple[bool, int]:
+    """Run CodeNarc on the CodeNarc server, or in a new process, and log its output.
+
+    With --slim-classpath, a new process loads its classes from a bundle JAR with only
+    the classes which CodeNarc needs, followed by the full classpath. The first run
+    without a bundle logs which classes it loads, and the bundle is then built from this
+    log. If CodeNarc can't load a class with the bundle, it is run again with the full
+    classpath, and the bundle is rebuilt. If CodeNarc fails to compile any file with the
+    bundle, it is run again with the full classpath.
+
+    :param args: Parsed command line arguments.
+    :param codenarc_args: Arguments to pass to CodeNarc.
+    :return: Whether CodeNarc failed to compile any file, and its exit code.
+    """
+    # A job on the server cannot be stopped without stopping the server, so jobs with a
+    # timeout always run in a new process.
+    output = (
+        None
+        if args.timeout or args.progress_timeout
+        else _run_codenarc_server(args.server_socket, codenarc_args)
+    )
+    if output is not None:
+        compilation_failed = _log_codenarc_output(
+            output.stdout.decode(errors="replace").split("\n"),
+            fail_fast=args.fail_fast,
+            metrics=args.metrics,
+        )
+        return compilation_failed, output.returncode
+
+    classpath = args.classpath or _build_classpath(args)
+    if not args.slim_classpath:
+        compilation_failed, returncode, _ = _run_codenarc_java(
+            args, codenarc_args, classpath, []
+        )
+        return compilation_failed, returncode
+
+    bundle = _classpath_bundle_path(args, classpath)
+    if os.path.exists(bundle):
+        log.debug("Using classpath bundle %s", bundle)
+        # The full classpath stays behind the bundle, so that classes which the analyzed
+        # files use, but which the first run never loaded, can still be resolved.
+        try:
+            compilation_failed, returncode, classes_missing = _run_codenarc_java(
+                args, codenarc_args, f"{bundle}:{classpath}", []
+            )
+        except CompilationError:
+            compilation_failed, classes_missing = True, False
+        if not (classes_missing or compilation_failed):
+            return compilation_failed, returncode
+        if not classes_missing:
+            log.warning(
+                "Compilation failed with %s, running CodeNarc with the full classpath",
+                bundle,
+            )
+            compilation_failed, returncode, _ = _run_codenarc_java(
+                args, codenarc_args, classpath, []
+            )
+            return compilation_failed, returncode
+        log.warning(
+            "Classes are missing from %s, running CodeNarc with the full classpath",
+            bundle,
+        )
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(bundle)
+
+    if not os.access(args.resources, os.W_OK):
+        log.debug("Not creating classpath bundle, %s is not writable", args.resources)
+        compilation_failed, returncode, _ = _run_codenarc_java(
+            args, codenarc_args, classpath, []
+        )
+        return compilation_failed, returncode
+
+    class_load_log = f"{bundle}.{os.getpid()}-{threading.get_ident()}.log"
+    try:
+        compilation_failed, returncode, _ = _run_codenarc_java(
+            args,
+            codenarc_args,
+            classpath,
+            [f"-Xlog:class+load=info:file={class_load_log}:none"],
+        )
+        if returncode == 0:
+            log.debug("Creating classpath bundle %s", bundle)
+            try:
+                with _timed(args.metrics, "build_bundle"):
+                    _build_classpath_bundle(classpath, class_load_log, bundle)
+            except (OSError, zipfile.BadZipFile) as error:
+                log.warning("Failed to create classpath bundle %s: %s", bundle, error)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(class_load_log)
+
+    return compilation_failed, returncode
+
+
+def _run_codenarc_server(
+    socket_path: str, codenarc_args: list[str]
+) -> subprocess.CompletedProcess | None:
+    """Run a CodeNarc job on a persistent CodeNarc server.
+
+    :param socket_path: Path to the Unix socket of the CodeNarc server.
+    :param codenarc_args: Arguments to pass to CodeNarc.
+    :return: The completed job, or None if no server could run the job.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+        except OSError:
+            log.debug("No CodeNarc server is listening on %s", socket_path)
+            return None
+
+        log.debug("Sending CodeNarc job to server at %s", socket_path)
+        request = "".join(f"{arg}\n" for arg in _absolute_codenarc_options(codenarc_args))
+        client.sendall(f"{request}\n".encode())
+        response = bytearray()
+        while chunk := client.recv(65536):
+            response.extend(chunk)
+
+    output, _, exit_code = bytes(response).rpartition(SERVER_EXIT_PREFIX)
+    if not exit_code.strip().isdigit():
+        # This can happen if the server was stopped while running the job.
+        log.warning("CodeNarc server did not finish the job, running CodeNarc directly")
+        return None
+
+    return subprocess.CompletedProcess(
+        args=codenarc_args, returncode=int(exit_code), stdout=output
+    )
+
+
+def _shard_files(
+    basedir: str, source_files: list[str], num_shards: int
+) -> list[list[str]]:
+    """Split a list of files into shards of roughly the same total size.
+
+    :param basedir: CodeNarc base directory.
+    :param source_files: List of file paths, relative to the base directory.
+    :param num_shards: Maximum number of shards.
+    :return: List of non-empty shards, each of which lists its files in the same order as
+        they appear in source_files.
+    """
+
+    def file_size(path: str) -> int:
+        try:
+            return os.path.getsize(os.path.join(basedir, path))
+        except OSError:
+            return 0
+
+    # Assign the largest remaining file to the smallest shard, which gives a good balance
+    # for the typical distribution of source file sizes.
+    shard_heap = [(0, index) for index in range(num_shards)]
+    shard_indexes: list[list[int]] = [[] for _ in range(num_shards)]
+    for file_index in sorted(
+        range(len(source_files)), key=lambda i: file_size(source_files[i]), reverse=True
+    ):
+        shard_size, shard = heapq.heappop(shard_heap)
+        shard_indexes[shard].append(file_index)
+        heapq.heappush(
+            shard_heap, (shard_size + file_size(source_files[file_index]), shard)
+        )
+
+    return [
+        [source_files[i] for i in sorted(indexes)] for indexes in shard_indexes if indexes
+    ]
+
+
+@contextlib.contextmanager
+def _shard_process(args: argparse.Namespace, process: subprocess.Popen) -> Iterator[None]:
+    """Register the CodeNarc process of a shard, so that it can be killed early.
+
+    With --fail-fast, run_codenarc_parallel() kills the processes of all shards once one
+    of them has failed. A process which is started after that is killed right away.
+
+    :param args: Parsed command line arguments.
+    :param process: CodeNarc process to register while the context is active.
+    """
+    if args.shard_processes is None:
+        yield
+        return
+
+    args.shard_processes.add(process)
+    try:
+        if args.shards_failed.is_set():
+            process.kill()
+        yield
+    finally:
+        args.shard_processes.discard(process)
+
+
+def _source_files(args: argparse.Namespace) -> list[str]:
+    """Get the list of files which CodeNarc would analyze.
+
+    :param args: Parsed command line arguments.
+    :return: List of file paths, relative to the CodeNarc base directory.
+    """
+    if args.single_file:
+        return [os.path.normpath(args.single_file)]
+
+    basedir = _codenarc_option(args.codenarc_options, "-basedir") or "."
+    if args.files:
+        # Files given on the command line are relative to the current directory.
+        return list(
+            dict.fromkeys(
+                os.path.normpath(os.path.relpath(path, basedir)) for path in args.files
+            )
+        )
+
+    source_files = _codenarc_option(args.codenarc_options, "-sourcefiles")
+    if source_files is not None:
+        return [os.path.normpath(path) for path in source_files.split(",") if path]
+
+    includes = _codenarc_option(args.codenarc_options, "-includes") or DEFAULT_INCLUDES
+    excludes = _codenarc_option(args.codenarc_options, "-excludes")
+    if args.changed_since:
+        return _filter_source_files(
+            _changed_files(args.changed_since, basedir), includes, excludes
+        )
+
+    return _expand_source_files(basedir, includes, excludes)
+
+
+def _source_files_for_shard(args: argparse.Namespace) -> list[str]:
+    """Get the files which CodeNarc should analyze on this node.
+
+    :param args: Parsed command line arguments.
+    :return: List of file paths, relative to the CodeNarc base directory. With --shard,
+        only the files of the given shard are returned.
+    """
+    source_files = _source_files(args)
+    if args.shard is None:
+        return source_files
+
+    shard, num_shards = args.shard
+    basedir = _codenarc_option(args.codenarc_options, "-basedir") or "."
+    shard_files = _node_shard(basedir, source_files, shard, num_shards)
+    log.info(
+        "Analyzing %d of %d files in shard %d/%d",
+        len(shard_files),
+        len(source_files),
+        shard,
+        num_shards,
+    )
+    return shard_files
+
+
+def _stop_shards_on_failure(
+    args: argparse.Namespace, executor: ThreadPoolExecutor, futures: list[Future]
+) -> None:
+    """Wait for the shards of a --fail-fast run, and stop all of them if one fails.
+
+    No further shards are started, and the CodeNarc processes of the running ones are
+    killed, see _shard_process().
+
+    :param args: Parsed command line arguments of the run.
+    :param executor: Executor which runs the shards.
+    :param futures: Futures of the shards.
+    :raises Exception: The error of the first shard which failed.
+    """
+    done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+    failed = [future for future in futures if future in done and future.exception()]
+    if failed:
+        args.shards_failed.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in list(args.shard_processes):
+            process.kill()
+        raise failed[0].exception()
+
+
+def _summarize_violations(
+    violations: Iterator[Violation], max_violations: int, violations_fp: TextIO
+) -> Iterator[Violation]:
+    """Print a bounded number of violations and summarize the rest.
+
+    Logging every violation of a large report makes the Jenkins console very slow.
+    Instead, only the first violations are printed, and all of them are written to a
+    file. Once all violations have been passed through, tables with the number of
+    violations per priority, rule and file are printed with a single log call.
+
+    :param violations: Iterator of violations.
+    :param max_violations: Maximum number of violations to print.
+    :param violations_fp: File to write all violations to.
+    :return: Iterator of the same violations.
+    """
+    per_file: Counter[str] = Counter()
+    per_priority: Counter[int] = Counter()
+    per_rule: Counter[str] = Counter()
+    total_violations = 0
+    for violation in violations:
+        line = (
+            f"{violation.path}:{violation.line}: {violation.rule}:"
+            f" {violation.message or '[empty message]'}"
+        )
+        if total_violations < max_violations:
+            log.error("%s", line)
+        violations_fp.write(line + "\n")
+        per_file[violation.path] += 1
+        per_priority[violation.priority] += 1
+        per_rule[violation.rule] += 1
+        total_violations += 1
+        yield violation
+
+    if total_violations <= max_violations:
+        return
+
+    summary_lines = [
+        (
+            f"Printed {max_violations} of {total_violations} violations, see"
+            f" {violations_fp.name} for all of them"
+        ),
+        "Violations per priority:",
+        *(f"  {per_priority[priority]:8d}  P{priority}" for priority in (1, 2, 3)),
+    ]
+    for title, counter in (("rule", per_rule), ("file", per_file)):
+        summary_lines.append(f"Violations per {title}:")
+        summary_lines.extend(
+            f"  {count:8d}  {name}"
+            for name, count in counter.most_common(SUMMARY_TABLE_ROWS)
+        )
+        if len(counter) > SUMMARY_TABLE_ROWS:
+            summary_lines.append(
+                f"  ... and {len(counter) - SUMMARY_TABLE_ROWS} more {title}s"
+            )
+    log.error("%s", "\n".join(summary_lines))
+
+
+@contextlib.contextmanager
+def _timed(metrics: dict, phase: str) -> Iterator[None]:
+    """Measure how long a phase of a run takes.
+
+    Phases which run several times, for example once for each CodeNarc process, are
+    recorded once for each run.
+
+    :param metrics: Metrics to add the duration of the phase to.
+    :param phase: Name of the phase.
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics["phases"].setdefault(phase, []).append(time.perf_counter() - start_time)
+
+
+def _validate_args(arg_parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    """Check for invalid combinations of command line arguments.
+
+    :param arg_parser: Parser which reports errors and exits.
+    :param args: Parsed command line arguments.
+    """
+    if not args.codenarc_version:
+        sys.exit("Could not determine CodeNarc version")
+    if not args.gmetrics_version:
+        sys.exit("Could not determine GMetrics version")
+    if not args.slf4j_version:
+        sys.exit("Could not determine SLF4J version")
+    if args.jobs < 0:
+        arg_parser.error("--jobs must not be negative")
+    if args.single_file and len(args.codenarc_options) > 1:
+        arg_parser.error('--single-file cannot be used with "--"')
+    if args.single_file and args.shard:
+        arg_parser.error("--single-file cannot be used with --shard")
+    _validate_output_args(arg_parser, args)
 
 
-def _is_slf4j_line(line: str) -> bool:
-    """Determine if a log line was produced by SLF4J.
+def _validate_output_args(
+    arg_parser: argparse.ArgumentParser, args: argparse.Namespace
+) -> None:
+    """Check for invalid combinations of the arguments from _add_output_arguments().
 
-    CodeNarc in some cases prints things to stdout, or uses multi-line logging calls which
-    cannot be parsed correctly when we attempt to re-log them in _log_codenarc_output.
+    :param arg_parser: Parser which reports errors and exits.
+    :param args: Parsed command line arguments.
     """
-    return isinstance(logging.getLevelName(line.split(" ", maxsplit=1)[0]), int)
+    if args.max_violations is not None and args.max_violations < 0:
+        arg_parser.error("--max-violations must not be negative")
+    if args.update_baseline and not args.baseline:
+        arg_parser.error("--update-baseline requires --baseline")
+
+
+@contextlib.contextmanager
+def _watchdog(
+    process: subprocess.Popen, timeout: float | None, progress_timeout: float | None
+) -> Iterator[Callable[[], None]]:
+    """Kill a process which runs for too long, or stops making progress.
+
+    :param process: Process to watch.
+    :param timeout: If given, kill the process after this many seconds.
+    :param progress_timeout: If given, kill the process if it makes no progress for this
+        many seconds.
+    :return: Context manager, which yields a function to call whenever the process makes
+        progress. It raises CodeNarcTimeoutError on exit if the process was killed.
+    """
+    start_time = time.monotonic()
+    last_progress = [start_time]
+    reasons = []
+    stopped = threading.Event()
+
+    def watch() -> None:
+        while not stopped.wait(WATCHDOG_INTERVAL_SECONDS):
+            now = time.monotonic()
+            if timeout is not None and now - start_time > timeout:
+                reasons.append(f"timeout of {timeout:g}s")
+            elif (
+                progress_timeout is not None and now - last_progress[0] > progress_timeout
+            ):
+                reasons.append(f"no output for {progress_timeout:g}s")
+            else:
+                continue
+            process.kill()
+            return
+
+    def progress() -> None:
+        last_progress[0] = time.monotonic()
+
+    if timeout is None and progress_timeout is None:
+        yield progress
+        return
+
+    watchdog_thread = threading.Thread(target=watch, daemon=True)
+    watchdog_thread.start()
+    try:
+        yield progress
+    finally:
+        stopped.set()
+        watchdog_thread.join()
+    if reasons:
+        raise CodeNarcTimeoutError(time.monotonic() - start_time, reasons[0])
+
+
+def _without_source_file_options(options: list[str]) -> list[str]:
+    """Remove the options which select source files from a list of CodeNarc options."""
+    return [
+        option
+        for option in options
+        if option.partition("=")[0] not in SOURCE_FILE_OPTIONS
+    ]
 
 
-def _is_valid_jar(file_path: str) -> bool:
-    """Determine if a file is a valid JAR file."""
-    log.debug("Verifying %s", file_path)
-    try:
-        with zipfile.ZipFile(file_path, "r") as jar_file:
-            if "META-INF/MANIFEST.MF" not in jar_file.namelist():
-                log.warning("%s does not appear to be a valid JAR", file_path)
-                return False
-    except zipfile.BadZipfile:
-        log.warning("%s is not a valid zipfile", file_path)
-        return False
+def _write_baseline(baseline_file: str, violations: Iterator[Violation]) -> int:
+    """Write the fingerprints of all violations to a baseline file.
 
-    return True
+    The fingerprints are sorted, so that changes to the baseline are easy to review.
 
+    :param baseline_file: Path to the baseline file.
+    :param violations: Iterator of violations.
+    :return: Number of violations in the baseline.
+    """
+    fingerprints = sorted(violation.fingerprint() for violation in violations)
+    with _atomic_write(baseline_file) as baseline_fp:
+        baseline_fp.writelines(f"{fingerprint}\n" for fingerprint in fingerprints)
+    return len(fingerprints)
 
-def _log_codenarc_output(lines: list[str]) -> None:
-    """Re-log lines from CodeNarc's output.
 
-    This function takes a log line generated by CodeNarc and re-logs it with the logging
-    framework. We take the log level, which is the first word of the line output, which
-    can be used to determine the corresponding log level in Python's logging framework.
+def _write_cache_entry(cache_dir: str, key: str | None, violations: list[dict]) -> None:
+    """Write the violations for a source file to the cache.
+
+    The entry is written to a temporary file first and then renamed, so that concurrent
+    readers never see a partially written entry.
+
+    :param cache_dir: Cache directory.
+    :param key: Cache key of the source file.
+    :param violations: List of violations.
     """
-    log_level = logging.INFO
-    for line in lines:
-        line_words = line.split(" ")
-        if _is_slf4j_line(line):
-            log_level = logging.getLevelName(line_words[0])
-            log_message = " ".join(line_words[1:])
-        else:
-            # If we can't determine the log level, that likely means that this line is a
-            # continuation of the previous line. This occurs when CodeNarc is logging
-            # compilation messages, stacktraces, etc. In these cases, we should use the
-            # same logging level as the last known line. Also, here we need to log the
-            # entire line and not chop off the first word.
-            log_message = line
+    if key is None:
+        return
 
-        log.log(log_level, log_message)
+    entry_path = _cache_entry_path(cache_dir, key)
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+    with _atomic_write(entry_path) as entry_file:
+        json.dump({"violations": violations}, entry_file)
 
 
-def _print_violations(package_file_path: str, violations: list) -> int:
-    """Print violations for a file.
+def _write_classpath_bundle(
+    sources: dict[str, zipfile.ZipFile], class_entries: list[str], bundle: str
+) -> None:
+    """Write a bundle JAR, see _build_classpath_bundle().
 
-    :param package_file_path: File path.
-    :param violations: List of Violation elements.
-    :return: Number of violations for the file.
+    :param sources: Dict of entry names to the first JAR on the classpath which has them.
+    :param class_entries: Entries of the loaded classes, in the order they were loaded.
+    :param bundle: Path of the bundle JAR to write.
     """
-    for violation in violations:
-        message_element = violation.find("Message")
-        if message_element is not None:
-            message = message_element.text
-        else:
-            message = "[empty message]"
-        log.error(
-            "%s:%s: %s: %s",
-            package_file_path,
-            violation.attrib["lineNumber"],
-            violation.attrib["ruleName"],
-            message,
+    used_jars = list(dict.fromkeys(sources[name] for name in class_entries))
+    with zipfile.ZipFile(bundle, "w", compression=zipfile.ZIP_STORED) as bundle_file:
+        bundle_file.writestr(
+            "META-INF/MANIFEST.MF",
+            "Manifest-Version: 1.0\r\nCreated-By: groovylint\r\n\r\n",
         )
+        for name in class_entries:
+            bundle_file.writestr(name, sources[name].read(name))
 
-    return len(violations)
+        for jar_file in used_jars:
+            for name in jar_file.namelist():
+                if sources[name] is jar_file and not _is_jar_metadata(name):
+                    bundle_file.writestr(name, jar_file.read(name))
 
 
-def _print_violations_in_files(package_path: str, files: list) -> int:
-    """Print violations for each file in a package.
+def _write_json_output(violations: Iterator[Violation], output_fp: TextIO) -> int:
+    """Write violations to a file as a JSON array.
 
-    :param package_path: Package path.
-    :param files: List of File elements.
-    :return: Number of violations for all files in the package.
+    :param violations: Iterator of violations.
+    :param output_fp: File to write to.
+    :return: Number of violations written.
     """
     num_violations = 0
+    output_fp.write("[")
+    for violation in violations:
+        output_fp.write(",\n" if num_violations else "\n")
+        json.dump(violation.to_dict(), output_fp)
+        num_violations += 1
+    output_fp.write("\n]\n")
+    return num_violations
 
-    for package_file in files:
-        package_file_name = f"{package_path}/{package_file.attrib['name']}"
-        log.debug("Parsing violations in file: %s", package_file_name)
-        num_violations += _print_violations(
-            package_file_name, package_file.findall("Violation")
-        )
 
+def _write_junit_output(violations: Iterator[Violation], output_fp: TextIO) -> int:
+    """Write violations to a file in JUnit XML format, with one failure per violation.
+
+    :param violations: Iterator of violations.
+    :param output_fp: File to write to.
+    :return: Number of violations written.
+    """
+    num_violations = 0
+    output_fp.write(
+        '<?xml version="1.0" encoding="UTF-8"?>\n<testsuite name="CodeNarc">\n'
+    )
+    for violation in violations:
+        testcase = ET.Element(
+            "testcase",
+            classname=violation.path,
+            name=f"{violation.rule}:{violation.line}",
+        )
+        ET.SubElement(
+            testcase, "failure", message=violation.message or "", type=violation.rule
+        ).text = f"{violation.path}:{violation.line}: {violation.message or ''}"
+        output_fp.write(f"  {ET.tostring(testcase, encoding='unicode')}\n")
+        num_violations += 1
+    output_fp.write("</testsuite>\n")
     return num_violations
 
 
-def _print_violations_in_packages(packages: list) -> int:
-    """Print violations for each package in a list of packages.
+def _write_metrics(metrics_file: str, metrics: dict) -> None:
+    """Write the metrics of a run to a file.
+
+    Files with the extension ".prom" are written in the Prometheus text format, which can
+    be read by the textfile collector of the Prometheus node exporter. All other files
+    are written as JSON.
+
+    :param metrics_file: Path to the metrics file.
+    :param metrics: Metrics collected during the run.
+    """
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS.
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    codenarc_runs = metrics.get("codenarc_runs", [])
+    summary = {
+        "phases": {phase: sum(times) for phase, times in metrics["phases"].items()},
+        "codenarc_runs": len(codenarc_runs),
+        "codenarc_analysis_seconds": sum(run["seconds"] for run in codenarc_runs),
+        "slow_files": len(metrics.get("slow_files", {})),
+        "child_peak_rss_bytes": max_rss
+        if platform.system() == "Darwin"
+        else max_rss * 1024,
+        **metrics.get("report", {}),
+    }
+
+    if not metrics_file.endswith(".prom"):
+        with open(metrics_file, "w", encoding="utf-8") as metrics_fp:
+            json.dump(summary, metrics_fp, indent=2, sort_keys=True)
+            metrics_fp.write("\n")
+        return
+
+    lines = ["# TYPE groovylint_phase_seconds gauge"]
+    lines.extend(
+        f'groovylint_phase_seconds{{phase="{phase}"}} {seconds}'
+        for phase, seconds in sorted(summary.pop("phases").items())
+    )
+    lines.append("# TYPE groovylint_violations gauge")
+    lines.extend(
+        f'groovylint_violations{{priority="{priority}"}}'
+        f" {summary.pop(f'priority{priority}', 0)}"
+        for priority in (1, 2, 3)
+    )
+    for name, value in sorted(summary.items()):
+        lines.extend([f"# TYPE groovylint_{name} gauge", f"groovylint_{name} {value}"])
+    with open(metrics_file, "w", encoding="utf-8") as metrics_fp:
+        metrics_fp.write("\n".join(lines) + "\n")
+
+
+def _write_ndjson_output(violations: Iterator[Violation], output_fp: TextIO) -> int:
+    """Write violations to a file as newline-delimited JSON, one violation per line.
 
-    :param packages: List of Package elements.
-    :return: Number of violations for all packages.
+    :param violations: Iterator of violations.
+    :param output_fp: File to write to.
+    :return: Number of violations written.
     """
     num_violations = 0
+    for violation in violations:
+        json.dump(violation.to_dict(), output_fp)
+        output_fp.write("\n")
+        num_violations += 1
+    return num_violations
 
-    for package in packages:
-        # CodeNarc uses the empty string for the top-level package, which we translate to
-        # '.', which prevents the violation files from appearing as belonging to '/'.
-        package_path = package.attrib["path"]
-        if not package_path:
-            package_path = "."
 
-        log.debug("Parsing violations in package: %s", package_path)
-        num_violations += _print_violations_in_files(
-            package_path, package.findall("File")
-        )
+def _write_sarif_output(violations: Iterator[Violation], output_fp: TextIO) -> int:
+    """Write violations to a file in SARIF format.
+
+    :param violations: Iterator of violations.
+    :param output_fp: File to write to.
+    :return: Number of violations written.
+    """
+    sarif_log = {
+        "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+        "version": "2.1.0",
+        "runs": [
+            {
+                "tool": {
+                    "driver": {
+                        "name": "CodeNarc",
+                        "informationUri": "https://codenarc.github.io/CodeNarc/",
+                    }
+                },
+                "results": None,
+            }
+        ],
+    }
+    # The results are the last value of the log, so they can be written one at a time
+    # between the parts of the log which come before and after them.
+    prefix, _, suffix = json.dumps(sarif_log).rpartition("null")
+    levels = {1: "error", 2: "warning"}
 
+    num_violations = 0
+    output_fp.write(f"{prefix}[")
+    for violation in violations:
+        location = {"artifactLocation": {"uri": violation.path.removeprefix("./")}}
+        if violation.line is not None:
+            location["region"] = {"startLine": violation.line}
+        result = {
+            "ruleId": violation.rule,
+            "level": levels.get(violation.priority, "note"),
+            "message": {"text": violation.message or violation.rule},
+            "locations": [{"physicalLocation": location}],
+        }
+        output_fp.write(",\n" if num_violations else "\n")
+        json.dump(result, output_fp)
+        num_violations += 1
+    output_fp.write(f"\n]{suffix}\n")
     return num_violations
 
 
-def parse_args(
-    args: list[str], default_jar_versions: dict[str, str]
-) -> argparse.Namespace:
-    """Parse arguments from the command line."""
-    arg_parser = argparse.ArgumentParser(
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter
-    )
+def _write_xml_report(
+    report_file: str, total_files: int, file_violations: dict[str, list[dict]]
+) -> None:
+    """Write results to an XML report file in the same format as CodeNarc.
 
-    arg_parser.add_argument(
-        "--activation-version",
-        default=default_jar_versions["activation"],
-        help="Activation Framework version to use (required for JDK11 + Groovy 3.x).",
-    )
+    Files are written in the same order as in file_violations. Consecutive files in the
+    same directory are grouped into one Package element.
 
-    arg_parser.add_argument(
-        "--codenarc-version",
-        default=default_jar_versions["CodeNarc"],
-        help="CodeNarc version to use.",
+    :param report_file: Path to the report file to write.
+    :param total_files: Number of scanned files.
+    :param file_violations: Dict of file paths to a list of their violations.
+    """
+    files_with_violations = [
+        (*os.path.split(path), violations)
+        for path, violations in file_violations.items()
+        if violations
+    ]
+    priorities = Counter(
+        violation["priority"]
+        for _, _, violations in files_with_violations
+        for violation in violations
     )
-
-    arg_parser.add_argument(
-        "-j",
-        "--jar",
-        action="append",
-        default=[],
-        dest="jars",
-        help="Path to a JAR file to add to the classpath. May be given multiple times.",
+    package_summary = ET.Element(
+        "PackageSummary",
+        totalFiles=str(total_files),
+        filesWithViolations=str(len(files_with_violations)),
+        priority1=str(priorities["1"]),
+        priority2=str(priorities["2"]),
+        priority3=str(priorities["3"]),
     )
 
-    arg_parser.add_argument(
-        "--jaxb-api-version",
-        default=default_jar_versions["jaxb-api"],
-        help="JAXB API version to use (required for JDK11 + Groovy 3.x).",
-    )
+    with open(report_file, "wb") as xml_file:
+        xml_file.write(b"<?xml version='1.0' encoding='UTF-8'?>\n<CodeNarc>\n")
+        xml_file.write(ET.tostring(package_summary))
+        for package_path, package_files in itertools.groupby(
+            files_with_violations, key=lambda file: file[0]
+        ):
+            package = ET.Element("Package", path=package_path)
+            for _, file_name, violations in package_files:
+                file_element = ET.SubElement(package, "File", name=file_name)
+                for violation in violations:
+                    violation_element = ET.SubElement(
+                        file_element,
+                        "Violation",
+                        ruleName=violation["ruleName"],
+                        priority=violation["priority"],
+                        lineNumber=violation["lineNumber"],
+                    )
+                    for tag, key in (
+                        ("SourceLine", "sourceLine"),
+                        ("Message", "message"),
+                    ):
+                        if violation[key] is not None:
+                            ET.SubElement(violation_element, tag).text = violation[key]
+            xml_file.write(ET.tostring(package))
+        xml_file.write(b"</CodeNarc>\n")
+
+
+def check_syntax(args: argparse.Namespace) -> None:
+    """Check the files which CodeNarc would analyze for syntax errors.
+
+    The files are compiled as far as CodeNarc compiles them, but no rules are applied,
+    which takes a fraction of the time of a full analysis. The checker requires the
+    classes from the WorkflowScriptStub JAR, which can be built with `mvn package`.
 
-    arg_parser.add_argument(
-        "--gmetrics-version",
-        default=default_jar_versions["GMetrics"],
-        help="GMetrics version to use.",
-    )
+    :param args: Parsed command line arguments.
+    :raises CompilationError: If any file has a syntax error, which is logged with its
+        path, line and column.
+    """
+    stub_jar = os.path.join(args.resources, STUB_JAR)
+    if not os.path.exists(stub_jar):
+        raise MissingClasspathElementError(stub_jar)
 
-    default_groovy_home = _guess_groovy_home()
-    arg_parser.add_argument(
-        "--groovy-home",
-        default=default_groovy_home,
-        required=(default_groovy_home is None),
-        help="Groovy home directory.",
-    )
+    source_files = _source_files_for_shard(args)
+    basedir = _codenarc_option(args.codenarc_options, "-basedir") or "."
+    with tempfile.TemporaryDirectory() as tempdir:
+        file_list = os.path.join(tempdir, "files.txt")
+        errors_file = os.path.join(tempdir, "syntax-errors.tsv")
+        with open(file_list, "w", encoding="utf-8") as file_list_fp:
+            file_list_fp.writelines(f"{path}\n" for path in source_files)
+        checker_call = [
+            *_java_call(args, len(source_files), create_cds_archive=False),
+            SYNTAX_CHECKER_CLASS,
+            basedir,
+            file_list,
+            errors_file,
+        ]
+        log.debug("Executing syntax checker command: %s", " ".join(checker_call))
+        with _timed(args.metrics, "check_syntax"):
+            output = subprocess.run(
+                checker_call,
+                check=False,
+                stderr=subprocess.STDOUT,
+                stdout=subprocess.PIPE,
+            )
+        _log_codenarc_output(output.stdout.decode(errors="replace").split("\n"))
+        if output.returncode != 0:
+            raise CodeNarcError(output.returncode)
+        with open(errors_file, encoding="utf-8") as errors_fp:
+            errors = [line.rstrip("\n").split("\t", maxsplit=3) for line in errors_fp]
 
-    arg_parser.add_argument("--groovy4", action="store_true", help=argparse.SUPPRESS)
+    for path, line, column, message in errors:
+        log.error("%s:%s:%s: %s", path, line, column, message)
+    if errors:
+        log.error(
+            "Found %d syntax error(s) in %d file(s)",
+            len(errors),
+            len({path for path, _, _, _ in errors}),
+        )
+        raise CompilationError
+    log.info("Checked the syntax of %d files", len(source_files))
 
-    arg_parser.add_argument(
-        "--resources",
-        default=os.path.join(GROOVYLINT_HOME, "resources"),
-        help="Path to Groovylint resources directory.",
-    )
 
-    arg_parser.add_argument(
-        "--single-file",
-        help=(
-            "When given, copy this file to a temporary directory and lint it. This may"
-            " improve performance in large repositories. This option cannot be used with"
-            ' "--" to pass options to CodeNarc.'
-        ),
-    )
+def parse_args(
+    args: list[str], default_jar_versions: dict[str, str]
+) -> argparse.Namespace:
+    """Parse arguments from the command line."""
+    arg_parser = _arg_parser(default_jar_versions)
+    args = arg_parser.parse_args(args)
+    _validate_args(arg_parser, args)
 
-    arg_parser.add_argument(
-        "--slf4j-version",
-        default=default_jar_versions["slf4j-api"],
-        help="SLF4J version to use.",
+    logging.basicConfig(
+        format="%(levelname)s %(message)s",
+        level=args.log_level or logging.INFO,
+        stream=sys.stdout,
     )
 
-    arg_parser.add_argument(
-        "-q",
-        "--quiet",
-        action="store_const",
-        const=logging.WARNING,
-        dest="log_level",
-        help="Show less output",
-    )
+    _resolve_args(args)
+    return args
 
-    arg_parser.add_argument(
-        "-v",
-        "--verbose",
-        action="store_const",
-        const=logging.DEBUG,
-        dest="log_level",
-        help="Show extra output",
-    )
 
+def parse_merge_args(args: list[str]) -> argparse.Namespace:
+    """Parse arguments of the merge-reports subcommand from the command line."""
+    arg_parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} merge-reports",
+        description=(
+            "Merge the CodeNarc XML reports of several shards, and report their"
+            " violations in the same way as a single run."
+        ),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    _add_output_arguments(arg_parser)
+    _add_log_level_arguments(arg_parser)
     arg_parser.add_argument(
-        "codenarc_options",
-        nargs="*",
-        action="append",
-        help='All options after "--" will be passed to CodeNarc',
+        "report_files", nargs="+", metavar="REPORT", help="CodeNarc XML reports to merge"
     )
 
     args = arg_parser.parse_args(args)
+    _validate_output_args(arg_parser, args)
 
     logging.basicConfig(
         format="%(levelname)s %(message)s",
@@ -455,22 +3427,8 @@ def parse_args(
         stream=sys.stdout,
     )
 
-    if not args.codenarc_version:
-        sys.exit("Could not determine CodeNarc version")
-    if not args.gmetrics_version:
-        sys.exit("Could not determine GMetrics version")
-    if not args.slf4j_version:
-        sys.exit("Could not determine SLF4J version")
-
-    args.groovy4 = _is_groovy4(args.groovy_home)
-
-    if args.single_file and len(args.codenarc_options) > 1:
-        arg_parser.error('--single-file cannot be used with "--"')
-
-    args.codenarc_options = [
-        option for sublist in args.codenarc_options for option in sublist
-    ]
-
+    args.command = "merge-reports"
+    args.metrics = {"phases": {}}
     return args
 
 
@@ -488,115 +3446,392 @@ def parse_pom() -> dict[str, str]:
     return jar_versions
 
 
-def parse_xml_report(xml_text: str) -> None:
-    """Parse XML report text generated by CodeNarc.
+def parse_xml_report(report_file: str, args: argparse.Namespace | None = None) -> None:
+    """Parse an XML or NDJSON report file generated by CodeNarc.
 
-    :param xml_text: Raw XML text of CodeNarc report.
-    :return: 0 on success, 1 if any violations were found
-    """
-    log.debug("Parsing report XML")
-    xml_doc = ET.fromstring(xml_text)
+    The report is parsed incrementally, so that violations are printed as soon as they
+    are read, and large reports do not need to be loaded into memory all at once. The
+    output arguments (see _add_output_arguments()) control how the violations are
+    reported:
 
-    package_summary = xml_doc.find("PackageSummary")
-    log.info("Scanned %s files", package_summary.attrib["totalFiles"])
-    total_violations = _print_violations_in_packages(xml_doc.findall("Package"))
+    - With --output-format, the violations are also written to the --output-file.
+    - With --baseline, violations in the baseline are neither printed nor counted, and
+      with --update-baseline, all violations are written to the baseline instead.
+    - With --max-violations, only this many violations are printed, followed by summary
+      tables, and all violations are written to the --violations-file.
 
+    :param report_file: Path to the CodeNarc report file.
+    :param args: Parsed command line arguments. The number of files and violations are
+        added to `args.metrics`. Defaults to only printing the violations.
+    :raises CodeNarcViolationsError: If any violations were reported.
+    """
+    if args is None:
+        args = _parse_output_args([])
+    output_writers = {
+        "json": (_write_json_output, "codenarc-report.json"),
+        "junit": (_write_junit_output, "codenarc-junit.xml"),
+        "ndjson": (_write_ndjson_output, "codenarc-report.ndjson"),
+        "sarif": (_write_sarif_output, "codenarc-report.sarif"),
+    }
+
+    log.debug("Parsing report file %s", report_file)
+    with open(report_file, "rb") as report_fp:
+        summary, violations = _read_report(report_fp)
+        if summary:
+            log.info("Scanned %s files", summary["files"])
+        if args.update_baseline:
+            num_violations = _write_baseline(args.baseline, violations)
+            log.info("Wrote %d violation(s) to %s", num_violations, args.baseline)
+            return
+        if args.baseline:
+            violations = _filter_baseline(violations, _read_baseline(args.baseline))
+
+        with contextlib.ExitStack() as stack:
+            if args.max_violations is None:
+                violations = _print_violations(violations)
+            else:
+                violations_fp = stack.enter_context(
+                    open(args.violations_file, "w", encoding="utf-8", buffering=1 << 20)
+                )
+                violations = _summarize_violations(
+                    violations, args.max_violations, violations_fp
+                )
+
+            if args.output_format is None:
+                total_violations = sum(1 for _ in violations)
+            else:
+                write_output, default_output_file = output_writers[args.output_format]
+                output_file = args.output_file or default_output_file
+                log.debug("Writing %s output to %s", args.output_format, output_file)
+                with open(output_file, "w", encoding="utf-8") as output_fp:
+                    total_violations = write_output(violations, output_fp)
+
+    args.metrics["report"] = {**summary, "reported_violations": total_violations}
     if total_violations != 0:
         raise CodeNarcViolationsError(total_violations)
 
 
-def run_codenarc(args: argparse.Namespace, report_file: str | None = None) -> str:
-    """Run CodeNarc on specified code.
+def profile_rules(args: argparse.Namespace) -> list[dict]:
+    """Measure how much analysis time and memory each rule of the ruleset costs.
+
+    The files selected by the -basedir, -includes and -excludes CodeNarc options are
+    analyzed with the RuleProfiler from the WorkflowScriptStub JAR, which can be built
+    with `mvn package`. The time and memory used by each rule is logged, with the most
+    expensive rule first.
 
     :param args: Parsed command line arguments.
-    :param report_file: Name of report file to generate.
-    :return: Raw XML text report generated by CodeNarc.
+    :return: List of rules, with the most expensive one first.
     """
-    slf4j_log_level = {logging.DEBUG: "debug", logging.WARNING: "warn", None: "info"}[
-        args.log_level
-    ]
+    stub_jar = os.path.join(args.resources, STUB_JAR)
+    if not os.path.exists(stub_jar):
+        raise MissingClasspathElementError(stub_jar)
 
+    basedir = _codenarc_option(args.codenarc_options, "-basedir") or "."
+    includes = _codenarc_option(args.codenarc_options, "-includes") or DEFAULT_INCLUDES
+    excludes = _codenarc_option(args.codenarc_options, "-excludes") or ""
     with tempfile.TemporaryDirectory() as tempdir:
-        if report_file is None:
-            report_file = os.path.join(tempdir, DEFAULT_REPORT_FILE)
-
-        if args.single_file:
-            extra_args = [f"-sourcefiles=./{args.single_file}"]
-        else:
-            extra_args = args.codenarc_options
-
-        # -rulesetfiles must not be an absolute path, only a relative one to the CLASSPATH
-        codenarc_call = [
-            "java",
-            "-Dorg.slf4j.simpleLogger.showThreadName=false",
-            f"-Dorg.slf4j.simpleLogger.defaultLogLevel={slf4j_log_level}",
-            "-classpath",
-            _build_classpath(args),
-            "org.codenarc.CodeNarc",
-            "-failOnError=true",
-            "-rulesetfiles=ruleset.groovy",
-            f"-report=xml:{os.path.abspath(report_file)}",
-            *extra_args,
+        profile_file = os.path.join(tempdir, "rule-profile.tsv")
+        profiler_call = [
+            *_java_call(args, create_cds_archive=False),
+            RULE_PROFILER_CLASS,
+            _resolve_rulesets(args),
+            basedir,
+            includes,
+            excludes,
+            profile_file,
         ]
-
-        log.debug("Executing CodeNarc command: %s", " ".join(codenarc_call))
-        try:
+        log.debug("Executing rule profiler command: %s", " ".join(profiler_call))
+        with _timed(args.metrics, "profile_rules"):
             output = subprocess.run(
-                codenarc_call,
-                check=True,
+                profiler_call,
+                check=False,
                 stderr=subprocess.STDOUT,
                 stdout=subprocess.PIPE,
             )
-        except subprocess.CalledProcessError as error:
-            log.error("Failed executing command: %s", " ".join(codenarc_call))
-            log.error(
-                "CodeNarc exited with code %d: %s",
-                error.returncode,
-                error.stdout.decode(),
+        _log_codenarc_output(output.stdout.decode(errors="replace").split("\n"))
+        if output.returncode != 0:
+            raise CodeNarcError(output.returncode)
+        return _log_rule_profile(profile_file)
+
+
+def run_codenarc(
+    args: argparse.Namespace,
+    report_file: str,
+    source_files: list[str] | None = None,
+    rulesets: str | None = None,
+) -> str:
+    """Run CodeNarc on specified code.
+
+    If a CodeNarc server is listening on the server socket, then CodeNarc is run by the
+    server, otherwise a new CodeNarc process is started.
+
+    :param args: Parsed command line arguments.
+    :param report_file: Path to the report file to generate.
+    :param source_files: If given, analyze these files (relative to the base directory)
+        instead of the files selected by the command line arguments.
+    :param rulesets: If given, use these rulesets (in the format of CodeNarc's
+        -rulesetfiles option) instead of the ones selected by the command line arguments.
+    :return: Path to the XML or NDJSON report file generated by CodeNarc.
+    """
+    if source_files is not None:
+        extra_args = [
+            *_without_source_file_options(args.codenarc_options),
+            f"-sourcefiles={','.join(source_files)}",
+        ]
+    elif args.single_file:
+        extra_args = [f"-sourcefiles=./{args.single_file}"]
+    else:
+        extra_args = args.codenarc_options
+
+    report_writer = "xml"
+    if args.ndjson_report:
+        stub_jar = os.path.join(args.resources, STUB_JAR)
+        if not os.path.exists(stub_jar):
+            raise MissingClasspathElementError(stub_jar)
+        report_writer = NDJSON_REPORT_WRITER_CLASS
+
+    codenarc_args = [
+        "-failOnError=true",
+        f"-rulesetfiles={_resolve_rulesets(args, rulesets)}",
+        f"-report={report_writer}:{os.path.abspath(report_file)}",
+        *(option for option in extra_args if not option.startswith("-rulesetfiles=")),
+    ]
+
+    with _timed(args.metrics, "codenarc"):
+        compilation_failed, returncode = _run_codenarc_process(args, codenarc_args)
+
+    log.debug("CodeNarc returned with code %d", returncode)
+
+    # CodeNarc does not return a non-zero code for compilation errors. For our purposes,
+    # we want to treat syntax errors (and similar problems) as a failure condition.
+    if compilation_failed:
+        raise CompilationError
+
+    if returncode != 0:
+        raise CodeNarcError(returncode)
+    if not os.path.exists(report_file):
+        raise MissingReportFileError(report_file)
+
+    return report_file
+
+
+def run_codenarc_cached(args: argparse.Namespace, report_file: str) -> str:
+    """Run CodeNarc, reusing cached results for files which have not changed.
+
+    CodeNarc is only run on the files which have no entry in the result cache. Its
+    results are then added to the cache, and merged with the cached results into a
+    single report.
+
+    :param args: Parsed command line arguments.
+    :param report_file: Path to the report file to generate.
+    :return: Path to the XML report file with the results for all files.
+    """
+    basedir = _codenarc_option(args.codenarc_options, "-basedir") or "."
+    source_files = _source_files_for_shard(args)
+    config_digest = _cache_config_digest(args)
+    cache_keys = {path: _cache_key(config_digest, basedir, path) for path in source_files}
+
+    file_violations = {}
+    for path, key in cache_keys.items():
+        violations = _read_cache_entry(args.cache_dir, key)
+        if violations is not None:
+            file_violations[path] = violations
+    uncached_files = [path for path in source_files if path not in file_violations]
+    log.debug(
+        "Found cached results for %d of %d files", len(file_violations), len(source_files)
+    )
+
+    if uncached_files:
+        with tempfile.TemporaryDirectory() as tempdir:
+            uncached_report = run_codenarc_parallel(
+                args, os.path.join(tempdir, DEFAULT_REPORT_FILE), uncached_files
+            )
+            with _timed(args.metrics, "read_report"):
+                _, new_violations = _read_xml_report(uncached_report)
+        for path in uncached_files:
+            file_violations[path] = new_violations.get(path, [])
+            _write_cache_entry(args.cache_dir, cache_keys[path], file_violations[path])
+        _evict_cache_entries(args.cache_dir, args.cache_size * 1024 * 1024)
+
+    _write_xml_report(
+        report_file,
+        len(source_files),
+        {path: file_violations[path] for path in source_files},
+    )
+    return report_file
+
+
+def run_codenarc_parallel(
+    args: argparse.Namespace,
+    report_file: str,
+    source_files: list[str] | None = None,
+) -> str:
+    """Run several CodeNarc processes in parallel and merge their reports.
+
+    The files to analyze are split into one shard per job, and each shard is analyzed by
+    its own CodeNarc process. Shards with too many files for a single command line are
+    split into several CodeNarc runs. If any of the processes fails, the error of the
+    first failed shard is raised once all processes have finished. With --fail-fast, the
+    first error is raised as soon as it happens: no further processes are started, and
+    the running ones are killed. Only jobs on a CodeNarc server can't be stopped, and are
+    waited for.
+
+    The merged report lists violations in the same order as the files were given. With
+    --ruleset-map, each file is analyzed with the rulesets for its directory. If a
+    process times out, its files are bisected to find the slow ones, which either fail
+    the run or, with --exclude-slow-files, are left out of the report.
+
+    :param args: Parsed command line arguments.
+    :param report_file: Path to the report file to generate.
+    :param source_files: If given, analyze these files (relative to the base directory)
+        instead of the files selected by the command line arguments.
+    :return: Path to the merged XML report file.
+    """
+    if source_files is None:
+        source_files = _source_files_for_shard(args)
+
+    if not source_files:
+        _write_xml_report(report_file, 0, {})
+        return report_file
+
+    # With a ruleset map, files which use different rulesets need separate processes.
+    ruleset_map = _read_ruleset_map(args.ruleset_map) if args.ruleset_map else {}
+    ruleset_groups = {}
+    for path in source_files:
+        rulesets = _ruleset_for_file(ruleset_map, path)
+        ruleset_groups.setdefault(rulesets, []).append(path)
+
+    basedir = _codenarc_option(args.codenarc_options, "-basedir") or "."
+    chunks = []
+    for rulesets, group_files in ruleset_groups.items():
+        resolved_rulesets = _resolve_rulesets(args, rulesets)
+        chunks.extend(
+            (resolved_rulesets, chunk)
+            for shard in _shard_files(basedir, group_files, args.jobs)
+            for chunk in _chunk_source_files(shard)
+        )
+
+    if args.fail_fast:
+        # Copy the arguments, so that concurrent runs don't stop each other's processes.
+        args = argparse.Namespace(**vars(args))
+        args.shard_processes = set()
+        args.shards_failed = threading.Event()
+
+    log.debug(
+        "Running %d CodeNarc processes for %d files", len(chunks), len(source_files)
+    )
+    with (
+        tempfile.TemporaryDirectory() as tempdir,
+        ThreadPoolExecutor(max_workers=min(args.jobs, len(chunks))) as executor,
+    ):
+        slow_files = {}
+        futures = [
+            executor.submit(
+                _run_codenarc_bisect,
+                args,
+                os.path.join(tempdir, f"shard-{index}-{DEFAULT_REPORT_FILE}"),
+                chunk,
+                rulesets,
+                slow_files,
             )
-            raise
+            for index, (rulesets, chunk) in enumerate(chunks)
+        ]
+        if args.fail_fast:
+            _stop_shards_on_failure(args, executor, futures)
+        report_files = [future.result() for future in futures]
+        with _timed(args.metrics, "merge_reports"):
+            _merge_xml_reports(report_files, report_file, source_files)
 
-        # Trim out empty lines which CodeNarc prints in its output.
-        codenarc_output = [x for x in output.stdout.decode().split("\n") if x]
-        # The last line of CodeNarc's output is (usually) a summary line, which is printed
-        # to stdout and not through SLF4J. We save it to a variable and log it with an
-        # assigned log level after printing out everything else. If CodeNarc fails due to
-        # some other problem, it will not print this line, however.
-        codenarc_summary = None
-        if codenarc_output[-1].startswith("CodeNarc completed:"):
-            codenarc_summary = codenarc_output.pop()
+    if slow_files:
+        args.metrics["slow_files"] = slow_files
+        for path, seconds in sorted(slow_files.items()):
+            log.warning("CodeNarc timed out on %s after %.1fs", path, seconds)
+        if not args.exclude_slow_files:
+            raise SlowFilesError(list(slow_files))
+        log.warning("Excluded %d slow file(s) from the report", len(slow_files))
 
-        _log_codenarc_output(codenarc_output)
+    return report_file
 
-        if codenarc_summary:
-            log.debug(codenarc_summary)
-        log.debug("CodeNarc returned with code %d", output.returncode)
 
-        # CodeNarc doesn't fail on compilation errors, it just logs a message for each
-        # file that could not be compiled and generates a report for everything else. It
-        # also does not return a non-zero code in such cases. For our purposes, we want to
-        # treat syntax errors (and similar problems) as a failure condition.
-        if "Compilation failed" in str(output.stdout):
-            raise CompilationError
+def run_codenarc_server(args: argparse.Namespace) -> int:
+    """Run a persistent CodeNarc server until it is terminated.
 
-        if output.returncode != 0:
-            raise CodeNarcError(output.returncode)
-        if not os.path.exists(report_file):
-            raise MissingReportFileError(report_file)
+    The server requires the classes from the WorkflowScriptStub JAR, which can be built
+    with `mvn package`.
 
-        log.debug("Reading report file %s", report_file)
-        with open(report_file, encoding="utf-8") as xml_file:
-            xml_text = xml_file.read()
+    :param args: Parsed command line arguments.
+    :return: Exit code of the server process.
+    """
+    stub_jar = os.path.join(args.resources, STUB_JAR)
+    if not os.path.exists(stub_jar):
+        raise MissingClasspathElementError(stub_jar)
 
-    return xml_text
+    server_call = [*_java_call(args), SERVER_CLASS, args.server_socket]
+    log.debug("Executing CodeNarc server command: %s", " ".join(server_call))
+    try:
+        return subprocess.run(server_call, check=False).returncode
+    except KeyboardInterrupt:
+        log.info("CodeNarc server stopped")
+        return 0
+    finally:
+        if args.cds:
+            _install_cds_archive(args)
 
 
 if __name__ == "__main__":
-    try:
+    start_time = time.perf_counter()
+    if sys.argv[1:2] == ["merge-reports"]:
+        parsed_args = parse_merge_args(sys.argv[2:])
+    elif sys.argv[1:2] == ["profile-rules"]:
+        parsed_args = parse_args(sys.argv[2:], parse_pom())
+        parsed_args.command = "profile-rules"
+    else:
         parsed_args = parse_args(sys.argv[1:], parse_pom())
-        _fetch_jars(parsed_args)
-        parse_xml_report(run_codenarc(parsed_args))
-        log.info("No violations found")
+    parsed_args.metrics["phases"]["parse_args"] = [time.perf_counter() - start_time]
+    try:
+        if parsed_args.command != "merge-reports":
+            _prepare_environment(parsed_args)
+        if parsed_args.command == "profile-rules":
+            profile_rules(parsed_args)
+            sys.exit(0)
+        if parsed_args.command == "run" and parsed_args.server:
+            sys.exit(run_codenarc_server(parsed_args))
+        if parsed_args.command == "run" and (
+            parsed_args.syntax_only or parsed_args.precheck
+        ):
+            check_syntax(parsed_args)
+            if parsed_args.syntax_only:
+                sys.exit(0)
+        with tempfile.TemporaryDirectory() as tempdir:
+            report_path = parsed_args.report_file or os.path.join(
+                tempdir, DEFAULT_REPORT_FILE
+            )
+            if parsed_args.command == "merge-reports":
+                with _timed(parsed_args.metrics, "merge_reports"):
+                    _merge_xml_reports(parsed_args.report_files, report_path)
+            elif parsed_args.cache_dir:
+                report_path = run_codenarc_cached(parsed_args, report_path)
+            elif (
+                parsed_args.changed_since
+                or parsed_args.files
+                or parsed_args.jobs > 1
+                or parsed_args.ruleset_map
+                or parsed_args.shard
+                or parsed_args.timeout
+                or parsed_args.progress_timeout
+            ):
+                report_path = run_codenarc_parallel(parsed_args, report_path)
+            else:
+                report_path = run_codenarc(parsed_args, report_path)
+            with _timed(parsed_args.metrics, "parse_report"):
+                parse_xml_report(report_path, parsed_args)
+        # The violations were written to the baseline instead of being reported.
+        if not parsed_args.update_baseline:
+            log.info("No violations found")
     except CodeNarcViolationsError as exception:
         log.error("Found %s violation(s)", exception.num_violations)
         sys.exit(1)
+    finally:
+        if parsed_args.metrics_file:
+            parsed_args.metrics["phases"]["total"] = [time.perf_counter() - start_time]
+            _write_metrics(parsed_args.metrics_file, parsed_args.metrics)
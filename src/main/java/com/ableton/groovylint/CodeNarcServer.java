@@ -0,0 +1,131 @@
+/*
+ * Copyright (c) 2026 Ableton AG, Berlin. All rights reserved.
+ *
+ * Use of this source code is governed by a MIT-style
+ * license that can be found in the LICENSE file.
+ */
+
+package com.ableton.groovylint;
+
+import static java.net.StandardProtocolFamily.UNIX;
+
+import java.io.BufferedReader;
+import java.io.IOException;
+import java.io.PrintStream;
+import java.net.UnixDomainSocketAddress;
+import java.nio.channels.Channels;
+import java.nio.channels.ServerSocketChannel;
+import java.nio.channels.SocketChannel;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.attribute.PosixFilePermissions;
+import java.nio.file.attribute.UserPrincipal;
+import java.util.ArrayList;
+import java.util.List;
+
+import jdk.net.ExtendedSocketOptions;
+
+import org.codenarc.CodeNarc;
+
+/**
+ * Persistent server which runs CodeNarc jobs inside of a single JVM.
+ *
+ * Starting a new JVM for each CodeNarc run means paying for JVM startup and loading the
+ * Groovy and CodeNarc classes every time, which often takes longer than the analysis
+ * itself. This server listens on a Unix domain socket and runs each job it receives in
+ * the same, already warmed-up JVM.
+ *
+ * The protocol is line-based: the client sends one CodeNarc argument per line, followed
+ * by an empty line. The server then runs CodeNarc, sends back everything CodeNarc writes
+ * to stdout and stderr, and finishes with a line containing {@link #EXIT_PREFIX} and the
+ * exit code of the job. Jobs are run one at a time, since the standard output streams of
+ * the JVM are redirected to the client while a job is running.
+ *
+ * Jobs read and write files as the user running the server, so only this user may send
+ * jobs: the socket is only accessible by its owner, and connections from other users are
+ * closed without running their job.
+ *
+ * This server is started by {@code run_codenarc.py --server}.
+ */
+public final class CodeNarcServer extends CodeNarc {
+    /** Prefix of the last line sent to the client, which contains the exit code. */
+    public static final String EXIT_PREFIX = "groovylint-server-exit: ";
+
+    private CodeNarcServer() {
+    }
+
+    /**
+     * Run the server until the JVM is terminated.
+     * @param args Command line arguments, which must contain the socket path.
+     * @throws IOException If the socket could not be created.
+     */
+    public static void main(String[] args) throws IOException {
+        if (args.length != 1) {
+            System.err.println("Usage: CodeNarcServer <socket path>");
+            System.exit(2);
+        }
+
+        Path socketPath = Path.of(args[0]);
+        Files.deleteIfExists(socketPath);
+        try (ServerSocketChannel server = ServerSocketChannel.open(UNIX)) {
+            server.bind(UnixDomainSocketAddress.of(socketPath));
+            socketPath.toFile().deleteOnExit();
+            Files.setPosixFilePermissions(
+                socketPath, PosixFilePermissions.fromString("rw-------")
+            );
+            UserPrincipal owner = Files.getOwner(socketPath);
+            System.out.println("CodeNarc server listening on " + socketPath);
+
+            while (true) {
+                try (SocketChannel client = server.accept()) {
+                    // Clients may have connected before the permissions were set.
+                    UserPrincipal user =
+                        client.getOption(ExtendedSocketOptions.SO_PEERCRED).user();
+                    if (!owner.equals(user)) {
+                        System.err.println("Rejected job from " + user.getName());
+                        continue;
+                    }
+                    serve(client);
+                } catch (IOException error) {
+                    System.err.println("Failed to serve CodeNarc job: " + error);
+                }
+            }
+        }
+    }
+
+    private static void serve(SocketChannel client) throws IOException {
+        BufferedReader reader = new BufferedReader(
+            Channels.newReader(client, StandardCharsets.UTF_8)
+        );
+        List<String> codeNarcArgs = new ArrayList<>();
+        String line = reader.readLine();
+        while (line != null && !line.isEmpty()) {
+            codeNarcArgs.add(line);
+            line = reader.readLine();
+        }
+
+        PrintStream output = new PrintStream(
+            Channels.newOutputStream(client), true, StandardCharsets.UTF_8
+        );
+        PrintStream stdout = System.out;
+        PrintStream stderr = System.err;
+        int exitCode = 0;
+        System.setOut(output);
+        System.setErr(output);
+        try {
+            new CodeNarcServer().execute(codeNarcArgs.toArray(new String[0]));
+        } catch (Throwable error) {
+            System.out.println("ERROR: " + error.getMessage());
+            error.printStackTrace();
+            exitCode = 1;
+        } finally {
+            System.setOut(stdout);
+            System.setErr(stderr);
+        }
+
+        output.println(EXIT_PREFIX + exitCode);
+        output.flush();
+        stdout.println("Finished CodeNarc job with exit code " + exitCode);
+    }
+}
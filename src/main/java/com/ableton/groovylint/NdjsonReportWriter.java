@@ -0,0 +1,137 @@
+/*
+ * Copyright (c) 2026 Ableton AG, Berlin. All rights reserved.
+ *
+ * Use of this source code is governed by a MIT-style
+ * license that can be found in the LICENSE file.
+ */
+
+package com.ableton.groovylint;
+
+import java.io.BufferedWriter;
+import java.io.IOException;
+import java.io.UncheckedIOException;
+import java.io.Writer;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+
+import org.codenarc.AnalysisContext;
+import org.codenarc.report.ReportWriter;
+import org.codenarc.results.Results;
+import org.codenarc.rule.Violation;
+
+/**
+ * CodeNarc report writer for a compact report with one JSON object per line.
+ *
+ * The first line holds the number of files and violations, in the same way as the
+ * {@code PackageSummary} element of CodeNarc's XML report. Every other line holds one
+ * violation, with the path of its file, its line, rule, priority, message and source
+ * line. Unlike the XML report, the report contains neither the descriptions of all rules
+ * nor any CDATA sections, and is written without building a DOM first.
+ *
+ * This writer is used by {@code run_codenarc.py --ndjson-report}, which passes
+ * {@code -report=com.ableton.groovylint.NdjsonReportWriter:<path>} to CodeNarc.
+ */
+public class NdjsonReportWriter implements ReportWriter {
+    private String outputFile = "codenarc-report.ndjson";
+
+    /**
+     * Set the path of the report file, which CodeNarc does for the part of the -report
+     * option after the colon.
+     * @param outputFile Path of the report file.
+     */
+    public void setOutputFile(String outputFile) {
+        this.outputFile = outputFile;
+    }
+
+    /**
+     * Get the path of the report file.
+     * @return Path of the report file.
+     */
+    public String getOutputFile() {
+        return outputFile;
+    }
+
+    @Override
+    public void writeReport(AnalysisContext analysisContext, Results results) {
+        try (BufferedWriter writer =
+                Files.newBufferedWriter(Path.of(outputFile), StandardCharsets.UTF_8)) {
+            writer.write("{\"files\":" + results.getTotalNumberOfFiles(true));
+            writer.write(
+                ",\"files_with_violations\":"
+                    + results.getNumberOfFilesWithViolations(3, true)
+            );
+            for (int priority = 1; priority <= 3; priority++) {
+                writer.write(
+                    ",\"priority" + priority + "\":"
+                        + results.getNumberOfViolationsWithPriority(priority, true)
+                );
+            }
+            writer.write("}\n");
+            writeViolations(writer, results);
+        } catch (IOException error) {
+            throw new UncheckedIOException(error);
+        }
+    }
+
+    private static void writeViolations(Writer writer, Results results)
+            throws IOException {
+        if (!results.isFile()) {
+            for (Object child : results.getChildren()) {
+                writeViolations(writer, (Results) child);
+            }
+            return;
+        }
+
+        for (Object object : results.getViolations()) {
+            Violation violation = (Violation) object;
+            writer.write("{\"path\":");
+            writeString(writer, results.getPath());
+            writer.write(",\"line\":" + violation.getLineNumber());
+            writer.write(",\"rule\":");
+            writeString(writer, violation.getRule().getName());
+            writer.write(",\"priority\":" + violation.getRule().getPriority());
+            writer.write(",\"message\":");
+            writeString(writer, violation.getMessage());
+            writer.write(",\"source_line\":");
+            writeString(writer, violation.getSourceLine());
+            writer.write("}\n");
+        }
+    }
+
+    private static void writeString(Writer writer, String value) throws IOException {
+        if (value == null) {
+            writer.write("null");
+            return;
+        }
+
+        writer.write('"');
+        for (int i = 0; i < value.length(); i++) {
+            char c = value.charAt(i);
+            switch (c) {
+                case '"':
+                    writer.write("\\\"");
+                    break;
+                case '\\':
+                    writer.write("\\\\");
+                    break;
+                case '\n':
+                    writer.write("\\n");
+                    break;
+                case '\r':
+                    writer.write("\\r");
+                    break;
+                case '\t':
+                    writer.write("\\t");
+                    break;
+                default:
+                    if (c < 0x20) {
+                        writer.write(String.format("\\u%04x", (int) c));
+                    } else {
+                        writer.write(c);
+                    }
+            }
+        }
+        writer.write('"');
+    }
+}
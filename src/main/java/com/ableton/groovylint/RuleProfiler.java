@@ -0,0 +1,144 @@
+/*
+ * Copyright (c) 2026 Ableton AG, Berlin. All rights reserved.
+ *
+ * Use of this source code is governed by a MIT-style
+ * license that can be found in the LICENSE file.
+ */
+
+package com.ableton.groovylint;
+
+import java.io.IOException;
+import java.io.PrintWriter;
+import java.lang.management.ManagementFactory;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.concurrent.atomic.LongAdder;
+
+import org.codehaus.groovy.runtime.InvokerHelper;
+import org.codenarc.analyzer.FilesystemSourceAnalyzer;
+import org.codenarc.rule.Rule;
+import org.codenarc.rule.Violation;
+import org.codenarc.ruleset.ListRuleSet;
+import org.codenarc.ruleset.RuleSet;
+import org.codenarc.ruleset.RuleSetUtil;
+import org.codenarc.source.SourceCode;
+
+/**
+ * Measures how much analysis time and memory each rule of a ruleset costs.
+ *
+ * CodeNarc parses each file once and then applies every rule to it. This profiler wraps
+ * each rule of the ruleset in a {@link TimedRule}, which adds up the wall time and the
+ * memory allocated by the analyzing thread while the rule is applied, and then analyzes
+ * the files with the wrapped ruleset. The totals are written to a tab-separated file with
+ * one line per rule: the rule name, its class, the number of files it was applied to,
+ * the time in nanoseconds, the allocated bytes and the number of violations.
+ *
+ * This profiler is run by {@code run_codenarc.py profile-rules}.
+ */
+public final class RuleProfiler {
+    private static final com.sun.management.ThreadMXBean THREADS =
+        (com.sun.management.ThreadMXBean) ManagementFactory.getThreadMXBean();
+
+    private RuleProfiler() {
+    }
+
+    /**
+     * Profile the rules of a ruleset.
+     * @param args Command line arguments, which must contain the comma-separated paths
+     *     of the rulesets (in the same format as CodeNarc's -rulesetfiles option), the
+     *     base directory, the Ant-style patterns of the files to include and to exclude
+     *     (which may be empty), and the path of the file to write the results to.
+     * @throws IOException If the results could not be written.
+     */
+    public static void main(String[] args) throws IOException {
+        if (args.length != 5) {
+            System.err.println(
+                "Usage: RuleProfiler <ruleset paths> <base directory> <includes>"
+                    + " <excludes> <output path>"
+            );
+            System.exit(2);
+        }
+
+        // Like CodeNarc, load each of a comma-separated list of rulesets.
+        List<TimedRule> timedRules = new ArrayList<>();
+        for (String ruleSetPath : args[0].split(",")) {
+            RuleSet loadedRuleSet = RuleSetUtil.loadRuleSetFile(ruleSetPath.trim());
+            for (Object rule : loadedRuleSet.getRules()) {
+                if (!Boolean.FALSE.equals(InvokerHelper.getProperty(rule, "enabled"))) {
+                    timedRules.add(new TimedRule((Rule) rule));
+                }
+            }
+        }
+        RuleSet ruleSet = new ListRuleSet(new ArrayList<>(timedRules));
+
+        FilesystemSourceAnalyzer analyzer = new FilesystemSourceAnalyzer();
+        analyzer.setBaseDirectory(args[1]);
+        analyzer.setIncludes(args[2]);
+        if (!args[3].isEmpty()) {
+            analyzer.setExcludes(args[3]);
+        }
+        analyzer.analyze(ruleSet);
+
+        try (PrintWriter writer = new PrintWriter(
+                Files.newBufferedWriter(Path.of(args[4]), StandardCharsets.UTF_8))) {
+            for (TimedRule rule : timedRules) {
+                writer.println(String.join(
+                    "\t",
+                    rule.getName(),
+                    rule.rule.getClass().getName(),
+                    rule.calls.toString(),
+                    rule.nanos.toString(),
+                    rule.allocatedBytes.toString(),
+                    rule.violations.toString()
+                ));
+            }
+        }
+    }
+
+    /** Rule which measures the cost of applying another rule. */
+    private static final class TimedRule implements Rule {
+        private final Rule rule;
+        private final LongAdder calls = new LongAdder();
+        private final LongAdder nanos = new LongAdder();
+        private final LongAdder allocatedBytes = new LongAdder();
+        private final LongAdder violations = new LongAdder();
+
+        TimedRule(Rule rule) {
+            this.rule = rule;
+        }
+
+        @Override
+        public List<Violation> applyTo(SourceCode sourceCode) {
+            long threadId = Thread.currentThread().getId();
+            long allocatedBefore = THREADS.getThreadAllocatedBytes(threadId);
+            long start = System.nanoTime();
+            List<Violation> ruleViolations = rule.applyTo(sourceCode);
+            long allocatedAfter = THREADS.getThreadAllocatedBytes(threadId);
+            nanos.add(System.nanoTime() - start);
+            allocatedBytes.add(allocatedAfter - allocatedBefore);
+            calls.increment();
+            if (ruleViolations != null) {
+                violations.add(ruleViolations.size());
+            }
+            return ruleViolations;
+        }
+
+        @Override
+        public int getCompilerPhase() {
+            return rule.getCompilerPhase();
+        }
+
+        @Override
+        public String getName() {
+            return rule.getName();
+        }
+
+        @Override
+        public int getPriority() {
+            return rule.getPriority();
+        }
+    }
+}
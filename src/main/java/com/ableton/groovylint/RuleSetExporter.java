@@ -0,0 +1,156 @@
+/*
+ * Copyright (c) 2026 Ableton AG, Berlin. All rights reserved.
+ *
+ * Use of this source code is governed by a MIT-style
+ * license that can be found in the LICENSE file.
+ */
+
+package com.ableton.groovylint;
+
+import groovy.lang.MetaBeanProperty;
+import groovy.lang.MetaClass;
+import groovy.lang.MetaProperty;
+
+import java.io.IOException;
+import java.io.Writer;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.util.Objects;
+import java.util.regex.Pattern;
+
+import javax.xml.stream.XMLOutputFactory;
+import javax.xml.stream.XMLStreamException;
+import javax.xml.stream.XMLStreamWriter;
+
+import org.codehaus.groovy.runtime.InvokerHelper;
+import org.codenarc.rule.Rule;
+import org.codenarc.ruleset.RuleSet;
+import org.codenarc.ruleset.RuleSetUtil;
+
+/**
+ * Exports a CodeNarc ruleset to a fully expanded XML ruleset.
+ *
+ * Loading a Groovy ruleset means compiling and running its DSL script, and loading the
+ * XML rulesets which it refers to. The exported ruleset instead lists every enabled rule
+ * by its class, together with the properties which differ from the rule's defaults, so
+ * that CodeNarc can load it without compiling anything. If a property which differs from
+ * its default can't be written to an XML ruleset, the export fails, so that the original
+ * ruleset is used instead.
+ *
+ * This exporter is run by {@code run_codenarc.py --compile-rulesets}, which caches the
+ * exported rulesets.
+ */
+public final class RuleSetExporter {
+    private static final String NAMESPACE = "http://codenarc.org/ruleset/1.0";
+    private static final String SCHEMA = "http://codenarc.org/ruleset-schema.xsd";
+    private static final String XSI_NAMESPACE =
+        "http://www.w3.org/2001/XMLSchema-instance";
+
+    private RuleSetExporter() {
+    }
+
+    /**
+     * Export a ruleset.
+     * @param args Command line arguments, which must contain the path of the ruleset to
+     *     export (in the same format as CodeNarc's -rulesetfiles option) and the path of
+     *     the XML file to write.
+     * @throws IOException If the XML file could not be written.
+     * @throws XMLStreamException If the XML file could not be written.
+     */
+    public static void main(String[] args) throws IOException, XMLStreamException {
+        if (args.length != 2) {
+            System.err.println("Usage: RuleSetExporter <ruleset path> <output path>");
+            System.exit(2);
+        }
+
+        RuleSet ruleSet = RuleSetUtil.loadRuleSetFile(args[0]);
+        Path output = Path.of(args[1]);
+        try (Writer writer = Files.newBufferedWriter(output, StandardCharsets.UTF_8)) {
+            export(ruleSet, writer);
+        }
+    }
+
+    private static void export(RuleSet ruleSet, Writer writer)
+            throws XMLStreamException {
+        XMLStreamWriter xml =
+            XMLOutputFactory.newInstance().createXMLStreamWriter(writer);
+        xml.writeStartDocument("UTF-8", "1.0");
+        xml.writeCharacters("\n");
+        xml.writeStartElement("ruleset");
+        xml.writeDefaultNamespace(NAMESPACE);
+        xml.writeNamespace("xsi", XSI_NAMESPACE);
+        xml.writeAttribute(XSI_NAMESPACE, "schemaLocation", NAMESPACE + " " + SCHEMA);
+        xml.writeAttribute(XSI_NAMESPACE, "noNamespaceSchemaLocation", SCHEMA);
+        xml.writeCharacters("\n");
+
+        for (Object rule : ruleSet.getRules()) {
+            if (Boolean.FALSE.equals(InvokerHelper.getProperty(rule, "enabled"))) {
+                continue;
+            }
+            writeRule(xml, (Rule) rule);
+        }
+
+        xml.writeEndElement();
+        xml.writeCharacters("\n");
+        xml.writeEndDocument();
+        xml.close();
+    }
+
+    private static boolean isDefaultValue(Object value, Object defaultValue) {
+        // Patterns don't implement equals(), so compare what they were compiled from.
+        if (value instanceof Pattern && defaultValue instanceof Pattern) {
+            Pattern pattern = (Pattern) value;
+            Pattern defaultPattern = (Pattern) defaultValue;
+            return pattern.pattern().equals(defaultPattern.pattern())
+                && pattern.flags() == defaultPattern.flags();
+        }
+        return Objects.deepEquals(value, defaultValue);
+    }
+
+    private static void writeRule(XMLStreamWriter xml, Rule rule)
+            throws XMLStreamException {
+        Object defaultRule;
+        try {
+            defaultRule = rule.getClass().getDeclaredConstructor().newInstance();
+        } catch (ReflectiveOperationException error) {
+            throw new IllegalStateException(
+                "Cannot create default instance of " + rule.getClass().getName(), error
+            );
+        }
+
+        xml.writeCharacters("  ");
+        xml.writeStartElement("rule");
+        xml.writeAttribute("class", rule.getClass().getName());
+        MetaClass metaClass = InvokerHelper.getMetaClass(rule);
+        for (MetaProperty property : metaClass.getProperties()) {
+            // Only properties which can be set from the ruleset are exported.
+            if (!(property instanceof MetaBeanProperty)
+                    || ((MetaBeanProperty) property).getSetter() == null
+                    || property.getName().equals("enabled")) {
+                continue;
+            }
+            Object value = property.getProperty(rule);
+            if (isDefaultValue(value, property.getProperty(defaultRule))) {
+                continue;
+            }
+            // An XML ruleset can only set properties from strings. Leaving out any other
+            // property would change the rule's behavior, so the ruleset is not exported.
+            if (!(value instanceof String
+                    || value instanceof Number
+                    || value instanceof Boolean)) {
+                throw new IllegalStateException(
+                    "Cannot export property " + property.getName() + " of rule "
+                        + rule.getName() + " with value " + value
+                );
+            }
+            xml.writeCharacters("\n    ");
+            xml.writeEmptyElement("property");
+            xml.writeAttribute("name", property.getName());
+            xml.writeAttribute("value", value.toString());
+        }
+        xml.writeCharacters("\n  ");
+        xml.writeEndElement();
+        xml.writeCharacters("\n");
+    }
+}
@@ -0,0 +1,129 @@
+/*
+ * Copyright (c) 2026 Ableton AG, Berlin. All rights reserved.
+ *
+ * Use of this source code is governed by a MIT-style
+ * license that can be found in the LICENSE file.
+ */
+
+package com.ableton.groovylint;
+
+import groovy.lang.GroovyClassLoader;
+
+import java.io.File;
+import java.io.IOException;
+import java.io.PrintWriter;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.stream.Collectors;
+
+import org.codehaus.groovy.control.CompilationUnit;
+import org.codehaus.groovy.control.CompilerConfiguration;
+import org.codehaus.groovy.control.MultipleCompilationErrorsException;
+import org.codehaus.groovy.control.Phases;
+import org.codehaus.groovy.control.messages.ExceptionMessage;
+import org.codehaus.groovy.control.messages.Message;
+import org.codehaus.groovy.control.messages.SimpleMessage;
+import org.codehaus.groovy.control.messages.SyntaxErrorMessage;
+import org.codehaus.groovy.syntax.SyntaxException;
+
+/**
+ * Compiles Groovy files just far enough to find the errors which CodeNarc reports.
+ *
+ * CodeNarc compiles each file to the conversion phase before applying its rules, and only
+ * logs a message for files which fail to compile. This checker compiles the files to the
+ * same phase, with the classpath of its JVM (which includes the {@code WorkflowScript}
+ * stub), but without applying any rules. The files are compiled in parallel, and the
+ * errors are written to a tab-separated file with one line per error: the file path,
+ * the line and column (or 0 if unknown) and the message.
+ *
+ * This checker is run by {@code run_codenarc.py --syntax-only} and
+ * {@code run_codenarc.py --precheck}.
+ */
+public final class SyntaxChecker {
+    private SyntaxChecker() {
+    }
+
+    /**
+     * Check files for syntax errors.
+     * @param args Command line arguments, which must contain the base directory, the path
+     *     of a file which lists the files to check (relative to the base directory) one
+     *     per line, and the path of the file to write the errors to.
+     * @throws IOException If the file list could not be read, or the errors could not be
+     *     written.
+     */
+    public static void main(String[] args) throws IOException {
+        if (args.length != 3) {
+            System.err.println(
+                "Usage: SyntaxChecker <base directory> <file list path> <output path>"
+            );
+            System.exit(2);
+        }
+
+        File baseDirectory = new File(args[0]);
+        List<String> paths = Files.readAllLines(Path.of(args[1]), StandardCharsets.UTF_8);
+        CompilerConfiguration config = new CompilerConfiguration();
+        GroovyClassLoader classLoader =
+            new GroovyClassLoader(SyntaxChecker.class.getClassLoader(), config);
+
+        // Keep the errors in the same order as the files, even though they are checked
+        // in parallel.
+        List<List<String>> errors = paths.parallelStream()
+            .filter(path -> !path.isEmpty())
+            .map(path -> check(new File(baseDirectory, path), path, config, classLoader))
+            .collect(Collectors.toList());
+
+        try (PrintWriter writer = new PrintWriter(
+                Files.newBufferedWriter(Path.of(args[2]), StandardCharsets.UTF_8))) {
+            for (List<String> fileErrors : errors) {
+                fileErrors.forEach(writer::println);
+            }
+        }
+    }
+
+    private static List<String> check(
+        File file,
+        String path,
+        CompilerConfiguration config,
+        GroovyClassLoader classLoader
+    ) {
+        List<String> errors = new ArrayList<>();
+        CompilationUnit unit = new CompilationUnit(config, null, classLoader);
+        unit.addSource(file);
+        try {
+            unit.compile(Phases.CONVERSION);
+        } catch (MultipleCompilationErrorsException exception) {
+            for (Object error : exception.getErrorCollector().getErrors()) {
+                errors.add(format(path, (Message) error));
+            }
+        } catch (RuntimeException exception) {
+            errors.add(format(path, 0, 0, String.valueOf(exception)));
+        }
+        return errors;
+    }
+
+    private static String format(String path, Message message) {
+        if (message instanceof SyntaxErrorMessage) {
+            SyntaxException cause = ((SyntaxErrorMessage) message).getCause();
+            return format(
+                path, cause.getLine(), cause.getStartColumn(), cause.getOriginalMessage()
+            );
+        }
+        if (message instanceof ExceptionMessage) {
+            Exception cause = ((ExceptionMessage) message).getCause();
+            return format(path, 0, 0, String.valueOf(cause));
+        }
+        if (message instanceof SimpleMessage) {
+            return format(path, 0, 0, ((SimpleMessage) message).getMessage());
+        }
+        return format(path, 0, 0, message.toString());
+    }
+
+    private static String format(String path, int line, int column, String message) {
+        // Messages may span several lines, which would break the output format.
+        String singleLineMessage = message.replaceAll("\\s+", " ").trim();
+        return path + "\t" + line + "\t" + column + "\t" + singleLineMessage;
+    }
+}
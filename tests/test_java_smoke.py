@@ -0,0 +1,145 @@
+# Copyright (c) 2026 Ableton AG, Berlin. All rights reserved.
+#
+# Use of this source code is governed by a MIT-style
+# license that can be found in the LICENSE file.
+
+"""Smoke tests which start each main class of the WorkflowScriptStub JAR.
+
+These tests need Java, the JAR built by `mvn package`, and a Groovy installation in
+GROOVY_HOME, and are skipped otherwise.
+"""
+
+import argparse
+import os
+import pathlib
+import shutil
+import stat
+import subprocess
+import time
+
+import pytest
+
+from run_codenarc import (
+    _compiled_ruleset,
+    _java_call,
+    _prepare_environment,
+    _read_report,
+    check_syntax,
+    CodeNarcViolationsError,
+    CompilationError,
+    GROOVYLINT_HOME,
+    parse_args,
+    parse_pom,
+    parse_xml_report,
+    profile_rules,
+    run_codenarc,
+    SERVER_CLASS,
+    STUB_JAR,
+)
+
+
+RESOURCES = os.path.join(GROOVYLINT_HOME, "resources")
+SERVER_START_TIMEOUT = 60
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("java") is None
+    or not os.path.exists(os.path.join(RESOURCES, STUB_JAR))
+    or not os.path.isdir(os.path.join(os.environ.get("GROOVY_HOME", ""), "lib")),
+    reason="requires Java, the stub JAR built by `mvn package` and GROOVY_HOME",
+)
+
+
+def _args(
+    source_dir: pathlib.Path, *options: str, rulesets: str = "ruleset.groovy"
+) -> argparse.Namespace:
+    args = parse_args(
+        [
+            "--resources",
+            RESOURCES,
+            "--server-socket",
+            str(source_dir / "no-server.sock"),
+            *options,
+            "--",
+            f"-basedir={source_dir}",
+            "-includes=**/*.groovy",
+            f"-rulesetfiles={rulesets}",
+        ],
+        parse_pom(),
+    )
+    _prepare_environment(args)
+    return args
+
+
+@pytest.fixture
+def source_dir(tmp_path: pathlib.Path) -> pathlib.Path:
+    """Return a directory with a Groovy file which has one violation."""
+    source_dir = tmp_path / "src"
+    source_dir.mkdir()
+    (source_dir / "Hello.groovy").write_text("def foo = 'hello'\nprintln(foo)\n")
+    return source_dir
+
+
+def test_code_narc_server(source_dir: pathlib.Path) -> None:
+    """Test that the CodeNarc server runs a job and reports its exit code."""
+    args = _args(source_dir)
+    args.server_socket = str(source_dir.parent / "server.sock")
+    with subprocess.Popen(
+        [*_java_call(args), SERVER_CLASS, args.server_socket]
+    ) as server:
+        try:
+            deadline = time.monotonic() + SERVER_START_TIMEOUT
+            while not os.path.exists(args.server_socket):
+                assert server.poll() is None
+                assert time.monotonic() < deadline
+                time.sleep(0.1)
+            # Only the user of the server may send it jobs.
+            socket_mode = os.stat(args.server_socket).st_mode
+            assert not socket_mode & (stat.S_IRWXG | stat.S_IRWXO)
+
+            report_file = run_codenarc(args, str(source_dir.parent / "report.xml"))
+        finally:
+            server.terminate()
+
+    with pytest.raises(CodeNarcViolationsError) as error:
+        parse_xml_report(report_file)
+    assert error.value.num_violations == 1
+
+
+def test_ndjson_report_writer(source_dir: pathlib.Path) -> None:
+    """Test that CodeNarc writes an NDJSON report with the NdjsonReportWriter."""
+    args = _args(source_dir, "--ndjson-report")
+    report_file = run_codenarc(args, str(source_dir.parent / "report.ndjson"))
+
+    with open(report_file, "rb") as report_fp:
+        summary, violations = _read_report(report_fp)
+        assert summary["files"] == 1
+        assert [violation.rule for violation in violations] == ["VariableTypeRequired"]
+
+
+def test_rule_profiler(source_dir: pathlib.Path) -> None:
+    """Test that the RuleProfiler profiles the rules of all given rulesets."""
+    args = _args(source_dir, rulesets="rulesets/basic.xml,rulesets/convention.xml")
+
+    rules = {rule["name"] for rule in profile_rules(args)}
+
+    assert {"AssertWithinFinallyBlock", "VariableTypeRequired"} <= rules
+
+
+def test_rule_set_exporter(source_dir: pathlib.Path) -> None:
+    """Test that the RuleSetExporter exports the default ruleset to XML."""
+    args = _args(source_dir)
+
+    ruleset = _compiled_ruleset(args, "ruleset.groovy")
+
+    assert ruleset.startswith("file:")
+    assert "<rule " in pathlib.Path(ruleset.removeprefix("file:")).read_text()
+
+
+def test_syntax_checker(source_dir: pathlib.Path) -> None:
+    """Test that the SyntaxChecker passes valid files and fails on syntax errors."""
+    args = _args(source_dir)
+    check_syntax(args)
+
+    (source_dir / "Broken.groovy").write_text("def foo(\n")
+    with pytest.raises(CompilationError):
+        check_syntax(args)
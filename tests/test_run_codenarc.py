@@ -5,31 +5,127 @@
 
 """Tests for run_codenarc script."""
 
+import argparse
+import hashlib
+import io
+import json
 import os
+import pathlib
+import re
+import shutil
+import socket
+import stat
 import subprocess
+import sys
+import threading
+import xml.etree.ElementTree as ET
+import zipfile
 
-from unittest.mock import patch
-from urllib.error import HTTPError
+from collections.abc import Iterator
+from unittest.mock import MagicMock, patch
+from urllib.error import HTTPError, URLError
 
 import pytest
 
 from run_codenarc import (
+    _absolute_codenarc_options,
+    _ant_pattern_regex,
+    _atomic_write,
+    _build_classpath_bundle,
+    _cds_options,
+    _cgroup_cpu_limit,
+    _cgroup_memory_limit,
+    _changed_files,
+    _chunk_source_files,
+    _compiled_ruleset,
     _download_file,
     _download_jar_with_retry,
+    _fetch_jar,
+    _fetch_jars,
+    _groovy_version,
+    _install_cds_archive,
+    _jar_path,
+    _jar_urls,
+    _jvm_options,
+    _merge_xml_reports,
+    _node_shard,
+    _parse_output_args,
+    _parse_shard,
+    _pinned_jar_digests,
+    _prepare_environment,
+    _read_file_list,
+    _read_ruleset_map,
+    _ruleset_for_file,
+    _shard_files,
+    _watchdog,
+    _write_metrics,
+    _write_xml_report,
+    check_syntax,
     CodeNarcError,
+    CodeNarcTimeoutError,
     CodeNarcViolationsError,
     CompilationError,
     DownloadFailedError,
+    GroovylintSession,
     MissingReportFileError,
     parse_args,
     parse_xml_report,
+    profile_rules,
     run_codenarc,
+    run_codenarc_cached,
+    run_codenarc_parallel,
+    SlowFilesError,
+    UnpinnedJARsError,
 )
 
 
 MOCK_CODENARC_SUMMARY = b"CodeNarc completed: (p1=0; p2=0; p3=0) 6664ms\n"
 
 
+def _make_jar(path: pathlib.Path, entries: dict[str, str]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as jar_file:
+        for name, contents in entries.items():
+            jar_file.writestr(name, contents)
+
+
+def _mock_process(stdout: bytes, returncode: int = 0) -> MagicMock:
+    process = MagicMock()
+    process.__enter__.return_value = process
+    process.stdout = io.StringIO(stdout.decode())
+    process.wait.return_value = returncode
+    return process
+
+
+def _mock_run_codenarc_shard(
+    _args: argparse.Namespace,
+    report_file: str,
+    source_files: list[str],
+    _rulesets: str | None = None,
+) -> str:
+    if "broken.groovy" in source_files:
+        raise CompilationError
+    if "slow.groovy" in source_files:
+        raise CodeNarcTimeoutError(5.0, "timeout of 5s")
+    _write_xml_report(
+        report_file,
+        len(source_files),
+        {
+            path: [
+                {
+                    "ruleName": "EmptyMethod",
+                    "priority": "2",
+                    "lineNumber": "1",
+                    "sourceLine": None,
+                    "message": None,
+                }
+            ]
+            for path in source_files
+        },
+    )
+    return report_file
+
+
 def _report_file_contents(name: str) -> str:
     with open(_report_file_path(name)) as report_file:
         return report_file.read()
@@ -39,6 +135,293 @@ def _report_file_path(name: str) -> str:
     return os.path.join(os.path.dirname(__file__), "xml-reports", name)
 
 
+def test_absolute_codenarc_options() -> None:
+    """Test that _absolute_codenarc_options resolves relative paths."""
+    assert _absolute_codenarc_options(
+        ["-includes=**/*.groovy", "-rulesetfiles=file:rules.groovy,rulesets/basic.xml"]
+    ) == [
+        "-includes=**/*.groovy",
+        f"-rulesetfiles=file:{os.getcwd()}/rules.groovy,rulesets/basic.xml",
+        f"-basedir={os.getcwd()}",
+    ]
+    assert _absolute_codenarc_options(["-basedir=src"]) == [f"-basedir={os.getcwd()}/src"]
+
+
+@pytest.mark.parametrize(
+    ("pattern", "path", "matches"),
+    [
+        ("**/*.groovy", "foo.groovy", True),
+        ("**/*.groovy", "vars/foo.groovy", True),
+        ("**/*.groovy", "vars/foo.gradle", False),
+        ("./Jenkinsfile", "Jenkinsfile", True),
+        ("./Jenkinsfile", "vars/Jenkinsfile", False),
+        ("vars/*.groovy", "vars/foo/bar.groovy", False),
+        ("vars/", "vars/foo/bar.groovy", True),
+        ("src/**", "src/foo/bar.groovy", True),
+        ("foo?.groovy", "foo1.groovy", True),
+    ],
+)
+def test_ant_pattern_regex(pattern: str, path: str, *, matches: bool) -> None:
+    """Test that _ant_pattern_regex matches paths like Ant-style patterns do."""
+    assert bool(_ant_pattern_regex(pattern).fullmatch(path)) == matches
+
+
+def test_atomic_write(tmp_path: pathlib.Path) -> None:
+    """Test that _atomic_write creates readable files, and removes failed writes."""
+    umask = os.umask(0o022)
+    os.umask(umask)
+    output_file = tmp_path / "output.json"
+
+    with _atomic_write(str(output_file)) as output_fp:
+        output_fp.write("{}")
+        assert not output_file.exists()
+
+    assert output_file.read_text() == "{}"
+    assert stat.S_IMODE(output_file.stat().st_mode) == 0o666 & ~umask
+
+    with pytest.raises(TypeError), _atomic_write(str(output_file)) as output_fp:
+        json.dump({"partial": object()}, output_fp)
+    assert os.listdir(tmp_path) == ["output.json"]
+    assert output_file.read_text() == "{}"
+
+
+def test_build_classpath_bundle(tmp_path: pathlib.Path) -> None:
+    """Test that a bundle JAR has the loaded classes and the resources of their JARs."""
+    extension_module = "META-INF/groovy/org.codehaus.groovy.runtime.ExtensionModule"
+    _make_jar(
+        tmp_path / "lib" / "a.jar",
+        {
+            "META-INF/MANIFEST.MF": "Manifest-Version: 1.0\n",
+            "META-INF/services/a.Service": "a.Impl\n",
+            extension_module: "moduleName=a\nextensionClasses=a.AExtension\n",
+            "a/A.class": "A",
+            "a/AExtension.class": "AExtension",
+            "a/Unused.class": "Unused",
+            "a/messages.properties": "messages",
+        },
+    )
+    _make_jar(
+        tmp_path / "lib" / "b.jar",
+        {
+            "META-INF/services/a.Service": "b.Impl",
+            "META-INF/services/org.codehaus.groovy.runtime.ExtensionModule": (
+                "moduleName=b\nstaticExtensionClasses=b.BExtension, b.Other\n"
+            ),
+            "a/A.class": "shadowed A",
+            "b/B.class": "B",
+        },
+    )
+    _make_jar(tmp_path / "c.jar", {"c/C.class": "C", "c/c.properties": "unused"})
+    class_load_log = tmp_path / "class-load.log"
+    class_load_log.write_text(
+        "a.A source: file:/lib/a.jar\n"
+        "a.AExtension source: file:/lib/a.jar\n"
+        "java.lang.Object source: shared objects file\n"
+        "b.B source: shared objects file (top)\n"
+    )
+    (tmp_path / "codenarc-bundle-0123456789abcdef.jar").write_bytes(b"stale")
+    bundle = str(tmp_path / "codenarc-bundle-fedcba9876543210.jar")
+
+    _build_classpath_bundle(
+        f"{tmp_path}/lib/*:{tmp_path}/c.jar:{tmp_path}", str(class_load_log), bundle
+    )
+
+    with zipfile.ZipFile(bundle) as bundle_file:
+        assert bundle_file.namelist() == [
+            "META-INF/MANIFEST.MF",
+            "a/A.class",
+            "a/AExtension.class",
+            "b/B.class",
+            "a/messages.properties",
+        ]
+        assert all(
+            info.compress_type == zipfile.ZIP_STORED for info in bundle_file.infolist()
+        )
+        assert bundle_file.read("a/A.class") == b"A"
+    assert not (tmp_path / "codenarc-bundle-0123456789abcdef.jar").exists()
+
+
+def test_cds_archive(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that a CDS archive is created by the first run and used by later runs."""
+    (tmp_path / "lib.jar").write_bytes(b"mock")
+    (tmp_path / "codenarc-cds-0123456789abcdef.jsa").write_bytes(b"stale")
+    with patch("subprocess.run"):
+        args = parse_args(["--cds", "--resources", str(tmp_path)], default_jar_versions)
+    args.classpath = f"{tmp_path}/lib.jar:{tmp_path}"
+
+    (create_option,) = _cds_options(args, args.classpath)
+    assert create_option.startswith("-XX:ArchiveClassesAtExit=")
+    # Simulate the JVM writing the archive when it exits.
+    pathlib.Path(create_option.partition("=")[2]).write_bytes(b"archive")
+    _install_cds_archive(args)
+
+    (use_option,) = _cds_options(args, args.classpath)
+    archive = use_option.removeprefix("-XX:SharedArchiveFile=")
+    # The stale archive for another classpath was removed.
+    assert sorted(os.listdir(tmp_path)) == sorted(["lib.jar", os.path.basename(archive)])
+
+    # A changed classpath element needs a new archive.
+    (tmp_path / "lib.jar").write_bytes(b"changed")
+    (create_option,) = _cds_options(args, args.classpath)
+    assert create_option.startswith("-XX:ArchiveClassesAtExit=")
+
+
+@pytest.mark.parametrize(
+    ("files", "cpu_limit", "memory_limit"),
+    [
+        ({}, None, None),
+        ({"cpu.max": "150000 100000\n", "memory.max": "2147483648\n"}, 1.5, 2**31),
+        ({"cpu.max": "max 100000\n", "memory.max": "max\n"}, None, None),
+        (
+            {
+                "cpu/cpu.cfs_quota_us": "200000\n",
+                "cpu/cpu.cfs_period_us": "100000\n",
+                "memory/memory.limit_in_bytes": "1073741824\n",
+            },
+            2,
+            2**30,
+        ),
+        (
+            {
+                "cpu/cpu.cfs_quota_us": "-1\n",
+                "cpu/cpu.cfs_period_us": "100000\n",
+                "memory/memory.limit_in_bytes": "9223372036854771712\n",
+            },
+            None,
+            None,
+        ),
+    ],
+)
+def test_cgroup_limits(
+    tmp_path: pathlib.Path,
+    files: dict[str, str],
+    cpu_limit: float | None,
+    memory_limit: int | None,
+) -> None:
+    """Test that cgroup v1 and v2 limits are read as expected."""
+    for name, contents in files.items():
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_text(contents)
+
+    assert _cgroup_cpu_limit(str(tmp_path)) == cpu_limit
+    assert _cgroup_memory_limit(str(tmp_path)) == memory_limit
+
+
+def test_changed_files(tmp_path: pathlib.Path) -> None:
+    """Test that _changed_files finds changed, renamed and untracked files."""
+
+    def git(*args: str) -> None:
+        subprocess.run(
+            ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],  # noqa: S607
+            check=True,
+            cwd=tmp_path,
+            stdout=subprocess.DEVNULL,
+        )
+
+    git("init", "--initial-branch=main")
+    (tmp_path / "vars").mkdir()
+    for name in (
+        "unchanged.groovy",
+        "modified.groovy",
+        "renamed.groovy",
+        "deleted.groovy",
+    ):
+        (tmp_path / "vars" / name).write_text(f"// {name}\n")
+    git("add", ".")
+    git("commit", "-m", "Initial commit")
+    git("checkout", "-b", "feature")
+
+    (tmp_path / "vars" / "modified.groovy").write_text("// modified\n")
+    git("mv", "vars/renamed.groovy", "vars/new-name.groovy")
+    git("rm", "vars/deleted.groovy")
+    git("commit", "-m", "Change files")
+    (tmp_path / "Jenkinsfile").write_text("node {}\n")
+
+    assert _changed_files("main", str(tmp_path)) == [
+        "Jenkinsfile",
+        "vars/modified.groovy",
+        "vars/new-name.groovy",
+    ]
+    assert _changed_files("main", str(tmp_path / "vars")) == [
+        "modified.groovy",
+        "new-name.groovy",
+    ]
+
+
+@pytest.mark.parametrize("errors", ["", "b.groovy\t3\t7\tunexpected token: }\n"])
+def test_check_syntax(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path, errors: str
+) -> None:
+    """Test that syntax errors are reported with their file and line."""
+    (tmp_path / "WorkflowScriptStub.jar").write_bytes(b"mock")
+    with patch("subprocess.run"):
+        args = parse_args(
+            [
+                "--cds",
+                "--resources",
+                str(tmp_path),
+                "--",
+                "-sourcefiles=a.groovy,b.groovy",
+            ],
+            default_jar_versions,
+        )
+    args.classpath = str(tmp_path)
+
+    def run_checker(call: list[str], **_kwargs: object) -> subprocess.CompletedProcess:
+        assert call[-4] == "com.ableton.groovylint.SyntaxChecker"
+        assert not any(option.startswith("-XX:ArchiveClassesAtExit=") for option in call)
+        assert pathlib.Path(call[-2]).read_text() == "a.groovy\nb.groovy\n"
+        pathlib.Path(call[-1]).write_text(errors)
+        return subprocess.CompletedProcess(args=call, returncode=0, stdout=b"")
+
+    with patch("subprocess.run", side_effect=run_checker):
+        if errors:
+            with pytest.raises(CompilationError):
+                check_syntax(args)
+        else:
+            check_syntax(args)
+
+
+def test_chunk_source_files() -> None:
+    """Test that _chunk_source_files keeps each chunk below the length limit."""
+    with patch("run_codenarc.MAX_SOURCEFILES_LENGTH", 20):
+        assert _chunk_source_files(
+            ["a.groovy", "b.groovy", "vars/c.groovy", "d.groovy"]
+        ) == [["a.groovy", "b.groovy"], ["vars/c.groovy"], ["d.groovy"]]
+    assert _chunk_source_files([]) == []
+
+
+def test_compiled_ruleset(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that Groovy rulesets are compiled once and then used from the cache."""
+    (tmp_path / "ruleset.groovy").write_text("ruleset {}\n")
+    (tmp_path / "WorkflowScriptStub.jar").write_bytes(b"mock")
+    with patch("subprocess.run"):
+        args = parse_args(["--resources", str(tmp_path)], default_jar_versions)
+    args.classpath = str(tmp_path)
+
+    def export_ruleset(call: list[str], **_kwargs: object) -> subprocess.CompletedProcess:
+        pathlib.Path(call[-1]).write_text("<ruleset/>\n")
+        return subprocess.CompletedProcess(args=call, returncode=0, stdout=b"")
+
+    with patch("subprocess.run", side_effect=export_ruleset) as subprocess_mock:
+        compiled_ruleset = _compiled_ruleset(args, "ruleset.groovy")
+        assert compiled_ruleset.startswith(f"file:{tmp_path}/rulesets/")
+        assert compiled_ruleset.endswith(".xml")
+        assert _compiled_ruleset(args, "ruleset.groovy") == compiled_ruleset
+        subprocess_mock.assert_called_once()
+
+        # XML rulesets are used as they are.
+        assert _compiled_ruleset(args, "rulesets/basic.xml") == "rulesets/basic.xml"
+
+        # A changed ruleset is compiled again.
+        (tmp_path / "ruleset.groovy").write_text("ruleset { ruleset('basic.xml') }\n")
+        assert _compiled_ruleset(args, "ruleset.groovy") != compiled_ruleset
+
+
 def test_download_file_4xx() -> None:
     """Test that _download_file handles HTTP 4xx errors as expected."""
     with patch("run_codenarc.urlopen") as urlopen_mock:
@@ -55,6 +438,31 @@ def test_download_file_5xx() -> None:
             _download_file("http://example.com/mock", "/tmp")
 
 
+def test_download_file_atomic(tmp_path: pathlib.Path) -> None:
+    """Test that _download_file only creates the output file once it is complete."""
+    with patch("run_codenarc.urlopen") as urlopen_mock:
+        urlopen_mock.return_value = io.BytesIO(b"contents")
+        output_file = _download_file("http://example.com/mock.jar", str(tmp_path))
+
+    assert output_file == str(tmp_path / "mock.jar")
+    assert os.listdir(tmp_path) == ["mock.jar"]
+    assert (tmp_path / "mock.jar").read_bytes() == b"contents"
+    # Other users, such as the user of the Docker image, must be able to read the JAR.
+    assert (tmp_path / "mock.jar").stat().st_mode & stat.S_IROTH
+
+    with patch("run_codenarc.urlopen") as urlopen_mock:
+        urlopen_mock.side_effect = HTTPError("url", 500, "Whoops", None, None)
+        with pytest.raises(DownloadFailedError):
+            _download_file("http://example.com/other.jar", str(tmp_path))
+    assert os.listdir(tmp_path) == ["mock.jar"]
+
+    with patch("run_codenarc.urlopen") as urlopen_mock:
+        urlopen_mock.side_effect = URLError(ConnectionResetError())
+        with pytest.raises(URLError):
+            _download_file("http://example.com/other.jar", str(tmp_path))
+    assert os.listdir(tmp_path) == ["mock.jar"]
+
+
 def test_download_jar_with_retry_always_fail() -> None:
     """Test that _download_jar_with_retry fails when the download also fails."""
     url = "http://example.com/mock"
@@ -64,6 +472,24 @@ def test_download_jar_with_retry_always_fail() -> None:
             _download_jar_with_retry("http://example.com/mock", "/tmp")
 
 
+def test_download_jar_with_retry_digest_mismatch(tmp_path: pathlib.Path) -> None:
+    """Test that _download_jar_with_retry rejects JARs which don't match their digest."""
+    jar_file = tmp_path / "mock.jar"
+
+    def mock_download_file(_url: str, _output_dir: str) -> str:
+        jar_file.write_bytes(b"tampered")
+        return str(jar_file)
+
+    with (
+        patch("time.sleep"),
+        patch("run_codenarc._download_file", side_effect=mock_download_file),
+        patch("run_codenarc._is_valid_jar", return_value=True),
+        pytest.raises(DownloadFailedError),
+    ):
+        _download_jar_with_retry("http://example.com/mock.jar", "/tmp", "0" * 64)
+    assert not jar_file.exists()
+
+
 def test_download_jar_with_retry_fail_verification() -> None:
     """Test that _download_jar_with_retry fails properly when a JAR fails to verify."""
     with patch("time.sleep"), patch("run_codenarc._download_file") as _download_file_mock:
@@ -87,9 +513,329 @@ def test_download_jar_with_retry_survival() -> None:
             assert _download_jar_with_retry(url, "/tmp") == "outfile"
 
 
+def test_fetch_jar_verified(tmp_path: pathlib.Path) -> None:
+    """Test that _fetch_jar trusts unchanged JARs which were verified before."""
+    jar_file = tmp_path / "mock.jar"
+    jar_file.write_bytes(b"mock")
+    jar_stat = jar_file.stat()
+    verified_jar = {
+        "sha256": "0" * 64,
+        "size": jar_stat.st_size,
+        "mtime_ns": jar_stat.st_mtime_ns,
+    }
+
+    with patch("run_codenarc._download_jar_with_retry") as download_mock:
+        assert (
+            _fetch_jar("http://example.com/mock.jar", str(jar_file), None, verified_jar)
+            == verified_jar
+        )
+        download_mock.assert_not_called()
+
+        # A JAR which was modified after it was verified must be verified again.
+        jar_file.write_bytes(b"modified")
+        download_mock.return_value = str(jar_file)
+        fetched_jar = _fetch_jar(
+            "http://example.com/mock.jar", str(jar_file), None, verified_jar
+        )
+        download_mock.assert_called_once()
+        assert fetched_jar["sha256"] != verified_jar["sha256"]
+
+
+@pytest.mark.parametrize("allow_unpinned_jars", [False, True])
+def test_fetch_jars_unpinned(
+    default_jar_versions: dict[str, str],
+    tmp_path: pathlib.Path,
+    *,
+    allow_unpinned_jars: bool,
+) -> None:
+    """Test that _fetch_jars fails for JARs which have no pinned digest."""
+    with patch("subprocess.run"):
+        args = parse_args(
+            [
+                "--resources",
+                str(tmp_path),
+                *(["--allow-unpinned-jars"] * allow_unpinned_jars),
+            ],
+            default_jar_versions,
+        )
+    jar_names = [os.path.basename(url) for url in _jar_urls(args)]
+    pinned_digests = dict.fromkeys(jar_names[1:], "0" * 64)
+    fetched_jar = {"sha256": "1" * 64, "size": 4, "mtime_ns": 0}
+
+    with (
+        patch("run_codenarc._pinned_jar_digests", return_value=pinned_digests),
+        patch("run_codenarc._fetch_jar", return_value=fetched_jar),
+    ):
+        if not allow_unpinned_jars:
+            with pytest.raises(UnpinnedJARsError) as raised_error:
+                _fetch_jars(args)
+            assert raised_error.value.jar_digests == {jar_names[0]: "1" * 64}
+            assert f"<sha256.{jar_names[0]}>{'1' * 64}<" in str(raised_error.value)
+            assert not (tmp_path / "jar-digests.json").exists()
+            return
+
+        _fetch_jars(args)
+
+    assert (tmp_path / "jar-digests.json").exists()
+
+
+def test_groovy_version(tmp_path: pathlib.Path) -> None:
+    """Test that _groovy_version reads the version from JAR names without Groovy."""
+    (tmp_path / "lib").mkdir()
+    for name in ["groovy-ant-4.0.15.jar", "groovy-4.0.15.jar", "ivy-2.5.2.jar"]:
+        (tmp_path / "lib" / name).write_bytes(b"")
+
+    with patch("subprocess.check_output") as check_output_mock:
+        assert _groovy_version(str(tmp_path)) == "4.0.15"
+        check_output_mock.assert_not_called()
+
+
+def test_groovy_version_fallback(tmp_path: pathlib.Path) -> None:
+    """Test that _groovy_version runs Groovy if there are no Groovy JARs."""
+    with patch("subprocess.check_output") as check_output_mock:
+        check_output_mock.return_value = b"Groovy Version: 2.5.23 JVM: 11.0.21\n"
+        assert _groovy_version(str(tmp_path)) == "2.5.23"
+
+
+def test_groovylint_session(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that a session lints files many times and returns their violations."""
+
+    def mock_run_codenarc_parallel(
+        args: argparse.Namespace, report_file: str, source_files: list[str]
+    ) -> str:
+        assert "-basedir=workspace" in args.codenarc_options
+        assert "-rulesetfiles=file:rules.xml" in args.codenarc_options
+        assert source_files == ["vars/test.groovy", "vars/groovylint.groovy"]
+        shutil.copy(
+            _report_file_path("multiple-violations-multiple-files-2.xml"), report_file
+        )
+        return report_file
+
+    with (
+        patch("run_codenarc._is_groovy4", return_value=True),
+        patch("run_codenarc._prepare_environment") as prepare_environment_mock,
+        patch(
+            "run_codenarc.run_codenarc_parallel", side_effect=mock_run_codenarc_parallel
+        ),
+    ):
+        session = GroovylintSession(
+            "workspace",
+            "file:rules.xml",
+            default_jar_versions=default_jar_versions,
+            groovy_home="test",
+            resources=str(tmp_path),
+        )
+        for _ in range(2):
+            result = session.lint(
+                ["./vars/test.groovy", "vars/groovylint.groovy", "vars/test.groovy"]
+            )
+            assert result.files == 4  # noqa: PLR2004
+            assert len(result.violations) == 5  # noqa: PLR2004
+            assert result.violations[0].path == "vars/test.groovy"
+            assert "codenarc" not in result.metrics["phases"]
+        prepare_environment_mock.assert_called_once()
+
+    with pytest.raises(TypeError):
+        GroovylintSession(
+            default_jar_versions=default_jar_versions,
+            groovy_home="test",
+            no_such_option=1,
+        )
+
+
+def test_jar_path() -> None:
+    """Test that _jar_path stores JARs in the shared cache by their digest."""
+    url = "https://example.com/mock-1.0.jar"
+    args = argparse.Namespace(jar_cache=None, resources="/resources")
+    assert _jar_path(args, url, {}) == "/resources/mock-1.0.jar"
+
+    args.jar_cache = "/cache"
+    assert _jar_path(args, url, {"mock-1.0.jar": "abcd"}) == "/cache/abcd/mock-1.0.jar"
+    assert _jar_path(args, url, {}).startswith("/cache/")
+    assert _jar_path(args, url, {}) != _jar_path(
+        args, "https://mirror.example.com/mock-1.0.jar", {}
+    )
+
+
+def test_jvm_options(default_jar_versions: dict[str, str]) -> None:
+    """Test that the JVM profile fits the memory limit and the number of files."""
+    with patch("subprocess.run"):
+        args = parse_args(["--jobs", "2", "--jvm-profile", "auto"], default_jar_versions)
+
+    with (
+        patch("run_codenarc._cgroup_memory_limit", return_value=4 * 2**30),
+        patch("run_codenarc._cgroup_cpu_limit", return_value=4),
+    ):
+        assert _jvm_options(args, 10) == [
+            "-Xmx258m",
+            "-XX:+UseSerialGC",
+            "-XX:TieredStopAtLevel=1",
+        ]
+        # Each of the two JVMs gets its share of the memory limit.
+        assert _jvm_options(args, 100_000) == ["-Xmx1536m", "-XX:+UseSerialGC"]
+        args.jobs = 1
+        assert _jvm_options(args, 100_000) == ["-Xmx3072m", "-XX:+UseParallelGC"]
+        # Without a number of files, the JVM's defaults are used.
+        assert _jvm_options(args) == []
+
+        args.jvm_opts = ["-Xmx1g", "-XX:+UseG1GC", "-Dfoo=bar"]
+        assert _jvm_options(args, 10) == [
+            "-XX:TieredStopAtLevel=1",
+            "-Xmx1g",
+            "-XX:+UseG1GC",
+            "-Dfoo=bar",
+        ]
+        args.jvm_profile = "none"
+        assert _jvm_options(args, 10) == ["-Xmx1g", "-XX:+UseG1GC", "-Dfoo=bar"]
+
+
+def test_merge_xml_reports(tmp_path: pathlib.Path) -> None:
+    """Test that merging the reports of several shards gives the correct totals."""
+    violation = {
+        "ruleName": "UnusedVariable",
+        "priority": "2",
+        "lineNumber": "1",
+        "sourceLine": "def foo = 1",
+        "message": "The variable [foo] is not used",
+    }
+    shard_reports = [str(tmp_path / f"shard-{shard}.xml") for shard in (1, 2)]
+    _write_xml_report(shard_reports[0], 3, {"a/A.groovy": [violation, violation]})
+    _write_xml_report(shard_reports[1], 2, {"b/B.groovy": [violation], "C.groovy": []})
+
+    report_file = str(tmp_path / "merged.xml")
+    _merge_xml_reports(shard_reports, report_file)
+
+    package_summary = ET.parse(report_file).find("PackageSummary").attrib
+    assert package_summary["totalFiles"] == "5"
+    assert package_summary["filesWithViolations"] == "2"
+    assert package_summary["priority2"] == "3"
+    with pytest.raises(CodeNarcViolationsError) as raised_error:
+        parse_xml_report(report_file)
+    assert raised_error.value.num_violations == 3  # noqa: PLR2004
+
+
+def test_merge_xml_reports_same_file(tmp_path: pathlib.Path) -> None:
+    """Test that the violations of a file in several reports are all kept."""
+    report_file = str(tmp_path / "merged.xml")
+    _merge_xml_reports(
+        [
+            _report_file_path("multiple-violations-multiple-files.xml"),
+            _report_file_path("single-violation-single-file.xml"),
+        ],
+        report_file,
+    )
+
+    with pytest.raises(CodeNarcViolationsError) as raised_error:
+        parse_xml_report(report_file)
+    assert raised_error.value.num_violations == 4  # noqa: PLR2004
+
+
+def test_node_shard(tmp_path: pathlib.Path) -> None:
+    """Test that every node selects the same shards, regardless of the file order."""
+    source_files = [f"file{index}.groovy" for index in range(20)]
+    for index, name in enumerate(source_files):
+        (tmp_path / name).write_text("x" * (index * 7 % 50))
+
+    shards = [_node_shard(str(tmp_path), source_files, shard, 3) for shard in (1, 2, 3)]
+    assert sorted(path for shard in shards for path in shard) == sorted(source_files)
+    for shard_number, shard in enumerate(shards, start=1):
+        assert shard == [path for path in source_files if path in shard]
+        assert set(
+            _node_shard(str(tmp_path), source_files[::-1], shard_number, 3)
+        ) == set(shard)
+
+    # Shards without any files are empty.
+    assert _node_shard(str(tmp_path), ["file1.groovy"], 2, 2) == []
+
+
+def test_parse_ndjson_report(tmp_path: pathlib.Path) -> None:
+    """Test that NDJSON reports are read like XML reports, and can be merged with them."""
+    violation = {
+        "rule": "UnusedVariable",
+        "priority": 2,
+        "message": "The variable [foo] is not used",
+        "source_line": "def foo = 1",
+    }
+    report_file = tmp_path / "report.ndjson"
+    report_file.write_text(
+        "\n".join(
+            json.dumps(record)
+            for record in [
+                {"files": 3, "files_with_violations": 2, "priority2": 3},
+                {"path": "vars/a.groovy", "line": 1, **violation},
+                {"path": "vars/a.groovy", "line": 2, **violation},
+                {"path": "B.groovy", "line": None, **violation},
+            ]
+        )
+        + "\n"
+    )
+    with pytest.raises(CodeNarcViolationsError) as raised_error:
+        parse_xml_report(str(report_file))
+    assert raised_error.value.num_violations == 3  # noqa: PLR2004
+
+    xml_report = str(tmp_path / "report.xml")
+    _write_xml_report(xml_report, 1, {"vars/c.groovy": []})
+    merged_report = str(tmp_path / "merged.xml")
+    _merge_xml_reports([str(report_file), xml_report], merged_report)
+
+    package_summary = ET.parse(merged_report).find("PackageSummary").attrib
+    assert package_summary["totalFiles"] == "4"
+    assert package_summary["filesWithViolations"] == "2"
+    files = {
+        f"{package.get('path') or '.'}/{file_element.get('name')}": [
+            element.get("lineNumber") for element in file_element.iter("Violation")
+        ]
+        for package in ET.parse(merged_report).iter("Package")
+        for file_element in package.iter("File")
+    }
+    assert files == {"vars/a.groovy": ["1", "2"], "./B.groovy": [""]}
+
+
+@pytest.mark.parametrize("value", ["0/2", "3/2", "1", "a/b", "1/0"])
+def test_parse_shard_invalid(value: str) -> None:
+    """Test that invalid shards are rejected."""
+    assert _parse_shard("2/3") == (2, 3)
+    with pytest.raises(argparse.ArgumentTypeError):
+        _parse_shard(value)
+
+
 def test_parse_xml_report() -> None:
     """Test that parse_xml_report handles a successful report file as expected."""
-    parse_xml_report(_report_file_contents("success.xml"))
+    parse_xml_report(_report_file_path("success.xml"))
+
+
+def test_parse_xml_report_baseline(tmp_path: pathlib.Path) -> None:
+    """Test that violations in the baseline are not reported, even if lines moved."""
+    baseline_file = str(tmp_path / "baseline.txt")
+    parse_xml_report(
+        _report_file_path("multiple-violations-single-file.xml"),
+        _parse_output_args(["--baseline", baseline_file, "--update-baseline"]),
+    )
+    parse_xml_report(
+        _report_file_path("multiple-violations-single-file.xml"),
+        _parse_output_args(["--baseline", baseline_file]),
+    )
+
+    # Lines were added above the violations, and one violation was duplicated.
+    report_text = _report_file_contents("multiple-violations-single-file.xml")
+    report_text = re.sub(
+        r"lineNumber='(\d+)'", lambda m: f"lineNumber='{int(m[1]) + 10}'", report_text
+    )
+    violation_start = report_text.index("<Violation ")
+    violation_end = report_text.index("</Violation>") + len("</Violation>")
+    report_file = tmp_path / "report.xml"
+    report_file.write_text(
+        report_text[:violation_end]
+        + report_text[violation_start:violation_end]
+        + report_text[violation_end:]
+    )
+    with pytest.raises(CodeNarcViolationsError) as raised_error:
+        parse_xml_report(
+            str(report_file), _parse_output_args(["--baseline", baseline_file])
+        )
+    assert raised_error.value.num_violations == 1
 
 
 @pytest.mark.parametrize(
@@ -108,76 +854,793 @@ def test_parse_xml_report_failed(report_file: str, num_violations: int) -> None:
     These report files were generated by CodeNarc itself.
     """
     with pytest.raises(CodeNarcViolationsError) as raised_error:
-        parse_xml_report(_report_file_contents(report_file))
+        parse_xml_report(_report_file_path(report_file))
     assert raised_error.value.num_violations == num_violations
 
 
+def test_parse_xml_report_max_violations(
+    caplog: pytest.LogCaptureFixture, tmp_path: pathlib.Path
+) -> None:
+    """Test that only the first violations are printed, followed by summary tables."""
+    violations_file = tmp_path / "violations.txt"
+    with pytest.raises(CodeNarcViolationsError) as raised_error:
+        parse_xml_report(
+            _report_file_path("multiple-violations-multiple-files-2.xml"),
+            _parse_output_args(
+                ["--max-violations", "2", "--violations-file", str(violations_file)]
+            ),
+        )
+
+    assert raised_error.value.num_violations == 5  # noqa: PLR2004
+    violations_text = violations_file.read_text()
+    assert len(re.findall(r"^vars/", violations_text, flags=re.MULTILINE)) == 5  # noqa: PLR2004
+    error_messages = [
+        record.getMessage() for record in caplog.records if record.levelname == "ERROR"
+    ]
+    assert len(error_messages) == 3  # noqa: PLR2004
+    assert error_messages[-1].startswith("Printed 2 of 5 violations")
+    assert "Violations per rule:" in error_messages[-1]
+    assert "Violations per file:" in error_messages[-1]
+
+
+@pytest.mark.parametrize("output_format", ["json", "junit", "ndjson", "sarif"])
+def test_parse_xml_report_output(tmp_path: pathlib.Path, output_format: str) -> None:
+    """Test that parse_xml_report writes violations in the given output format."""
+    output_file = tmp_path / "output"
+    with pytest.raises(CodeNarcViolationsError):
+        parse_xml_report(
+            _report_file_path("multiple-violations-multiple-files-2.xml"),
+            _parse_output_args(
+                ["--output-format", output_format, "--output-file", str(output_file)]
+            ),
+        )
+
+    output = output_file.read_text()
+    if output_format == "json":
+        violations = json.loads(output)
+    elif output_format == "ndjson":
+        violations = [json.loads(line) for line in output.splitlines()]
+    elif output_format == "junit":
+        violations = ET.fromstring(output).findall("testcase/failure")
+    else:
+        violations = json.loads(output)["runs"][0]["results"]
+    assert len(violations) == 5  # noqa: PLR2004
+
+
+def test_parse_xml_report_skips_rules(tmp_path: pathlib.Path) -> None:
+    """Test that parse_xml_report stops parsing the report at the Rules element."""
+    report_text = _report_file_contents("single-violation-single-file.xml")
+    # Truncate the report in the middle of the Rules element, which would be a parse
+    # error if the parser were to read the report until the end.
+    report_file = tmp_path / "report.xml"
+    report_file.write_text(report_text[: report_text.index("<Rules>") + 50])
+
+    with pytest.raises(CodeNarcViolationsError) as raised_error:
+        parse_xml_report(str(report_file))
+    assert raised_error.value.num_violations == 1
+
+
+def test_parse_xml_report_violation_fields(tmp_path: pathlib.Path) -> None:
+    """Test that all fields of a violation are written to the output file."""
+    output_file = tmp_path / "output.ndjson"
+    with pytest.raises(CodeNarcViolationsError):
+        parse_xml_report(
+            _report_file_path("single-violation-single-file.xml"),
+            _parse_output_args(
+                ["--output-format", "ndjson", "--output-file", str(output_file)]
+            ),
+        )
+
+    assert json.loads(output_file.read_text()) == {
+        "path": "vars/test.groovy",
+        "line": 1,
+        "rule": "MethodReturnTypeRequired",
+        "priority": 3,
+        "message": 'Method "foo" has a dynamic return type',
+        "source_line": "def foo(String bar) {",
+    }
+
+
+def test_pinned_jar_digests(tmp_path: pathlib.Path) -> None:
+    """Test that _pinned_jar_digests reads the digests from the pom.xml file."""
+    (tmp_path / "pom.xml").write_text(
+        '<project xmlns="http://maven.apache.org/POM/4.0.0"><properties>'
+        "<maven.compiler.release>17</maven.compiler.release>"
+        "<sha256.mock-1.0.jar> abcd </sha256.mock-1.0.jar>"
+        "</properties></project>"
+    )
+
+    with patch("run_codenarc.GROOVYLINT_HOME", str(tmp_path)):
+        assert _pinned_jar_digests() == {"mock-1.0.jar": "abcd"}
+
+
+def test_prepare_environment(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that _prepare_environment reuses the manifest until something changes."""
+    groovy_home = tmp_path / "groovy"
+    (groovy_home / "lib").mkdir(parents=True)
+    (groovy_home / "lib" / "groovy-4.0.15.jar").write_bytes(b"")
+    resources = tmp_path / "resources"
+    resources.mkdir()
+    args = parse_args(
+        ["--groovy-home", str(groovy_home), "--resources", str(resources)],
+        default_jar_versions,
+    )
+
+    def fetch_jars(args: argparse.Namespace) -> None:
+        for url in _jar_urls(args):
+            (resources / os.path.basename(url)).write_bytes(b"mock")
+
+    with patch("run_codenarc._fetch_jars", side_effect=fetch_jars) as fetch_jars_mock:
+        _prepare_environment(args)
+        classpath = args.classpath
+        args.classpath = None
+        _prepare_environment(args)
+        assert args.classpath == classpath
+        fetch_jars_mock.assert_called_once()
+
+        # A changed JAR file invalidates the manifest.
+        (resources / os.path.basename(_jar_urls(args)[0])).write_bytes(b"changed")
+        fetch_jars_mock.reset_mock()
+        _prepare_environment(args)
+        fetch_jars_mock.assert_called_once()
+
+        # So does a changed Groovy installation.
+        (groovy_home / "lib" / "groovy-ant-4.0.15.jar").write_bytes(b"")
+        fetch_jars_mock.reset_mock()
+        _prepare_environment(args)
+        fetch_jars_mock.assert_called_once()
+
+
+def test_prepare_environment_read_only(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that JARs in a read-only resources directory are verified in place."""
+    groovy_home = tmp_path / "groovy"
+    (groovy_home / "lib").mkdir(parents=True)
+    (groovy_home / "lib" / "groovy-4.0.15.jar").write_bytes(b"")
+    resources = tmp_path / "resources"
+    args = parse_args(
+        ["--groovy-home", str(groovy_home), "--resources", str(resources)],
+        default_jar_versions,
+    )
+    for url in _jar_urls(args):
+        _make_jar(resources / os.path.basename(url), {"META-INF/MANIFEST.MF": ""})
+    jar_names = sorted(os.listdir(resources))
+    pinned_digests = {
+        name: hashlib.sha256((resources / name).read_bytes()).hexdigest()
+        for name in jar_names
+    }
+
+    with (
+        patch("run_codenarc._pinned_jar_digests", return_value=pinned_digests),
+        # Tests may run as root, for whom every directory is writable.
+        patch(
+            "os.access",
+            side_effect=lambda path, _mode: not path.startswith(str(resources)),
+        ),
+        patch("run_codenarc.urlopen") as urlopen_mock,
+    ):
+        _prepare_environment(args)
+
+    urlopen_mock.assert_not_called()
+    assert sorted(os.listdir(resources)) == jar_names
+    assert all(jar in args.classpath for jar in jar_names)
+
+
+def test_prepare_environment_unreadable_manifest(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that a manifest which can't be read is treated as outdated."""
+    groovy_home = tmp_path / "groovy"
+    (groovy_home / "lib").mkdir(parents=True)
+    (groovy_home / "lib" / "groovy-4.0.15.jar").write_bytes(b"")
+    resources = tmp_path / "resources"
+    resources.mkdir()
+    args = parse_args(
+        ["--groovy-home", str(groovy_home), "--resources", str(resources)],
+        default_jar_versions,
+    )
+
+    def fetch_jars(args: argparse.Namespace) -> None:
+        for url in _jar_urls(args):
+            (resources / os.path.basename(url)).write_bytes(b"mock")
+
+    with patch("run_codenarc._fetch_jars", side_effect=fetch_jars) as fetch_jars_mock:
+        _prepare_environment(args)
+        # Other users, such as the user of the Docker image, must be able to read it.
+        assert (resources / "environment.json").stat().st_mode & stat.S_IROTH
+
+        real_open = open
+
+        def mock_open(path: str, *args: object, **kwargs: object) -> object:
+            if os.path.basename(path) == "environment.json":
+                raise PermissionError(path)
+            return real_open(path, *args, **kwargs)
+
+        fetch_jars_mock.reset_mock()
+        with patch("builtins.open", side_effect=mock_open):
+            _prepare_environment(args)
+        fetch_jars_mock.assert_called_once()
+
+
+def test_profile_rules(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that rules are ranked by the analysis time they cost."""
+    (tmp_path / "WorkflowScriptStub.jar").write_bytes(b"mock")
+    with patch("subprocess.run"):
+        args = parse_args(
+            ["--cds", "--resources", str(tmp_path), "--", "-includes=vars/*.groovy"],
+            default_jar_versions,
+        )
+    args.classpath = str(tmp_path)
+
+    def run_profiler(call: list[str], **_kwargs: object) -> subprocess.CompletedProcess:
+        # The profiler loads other classes than CodeNarc, so it must not create the CDS
+        # archive.
+        assert not any(option.startswith("-XX:ArchiveClassesAtExit=") for option in call)
+        assert call[-6:-1] == [
+            "com.ableton.groovylint.RuleProfiler",
+            "ruleset.groovy",
+            ".",
+            "vars/*.groovy",
+            "",
+        ]
+        pathlib.Path(call[-1]).write_text(
+            "EmptyMethod\torg.codenarc.rule.basic.EmptyMethodRule\t10\t2000000\t512\t1\n"
+            "UnusedVariable\torg.codenarc.rule.unused.UnusedVariableRule\t10\t9000000"
+            "\t4096\t0\n"
+        )
+        return subprocess.CompletedProcess(args=call, returncode=0, stdout=b"")
+
+    with patch("subprocess.run", side_effect=run_profiler):
+        rules = profile_rules(args)
+
+    assert [rule["name"] for rule in rules] == ["UnusedVariable", "EmptyMethod"]
+    assert rules[0]["seconds"] == 0.009  # noqa: PLR2004
+    assert rules[1]["allocated_bytes"] == 512  # noqa: PLR2004
+    assert rules[1]["violations"] == 1
+
+
+@pytest.mark.parametrize("separator", ["\n", "\0"])
+def test_read_file_list(tmp_path: pathlib.Path, separator: str) -> None:
+    """Test that _read_file_list reads NUL- and newline-separated file lists."""
+    file_list = tmp_path / "files.txt"
+    file_list.write_text(separator.join(["b.groovy", "dir with space/a.groovy", ""]))
+
+    assert _read_file_list(str(file_list)) == ["b.groovy", "dir with space/a.groovy"]
+
+
+def test_ruleset_map(tmp_path: pathlib.Path) -> None:
+    """Test that files use the rulesets of the closest directory in the ruleset map."""
+    ruleset_map_file = tmp_path / "rulesets.json"
+    ruleset_map_file.write_text(
+        json.dumps(
+            {
+                ".": "file:default.groovy",
+                "services/": "file:services.groovy,rulesets/basic.xml",
+                "services/legacy": "rulesets/basic.xml",
+            }
+        )
+    )
+    ruleset_map = _read_ruleset_map(str(ruleset_map_file))
+
+    assert (
+        _ruleset_for_file(ruleset_map, "Jenkinsfile") == f"file:{tmp_path}/default.groovy"
+    )
+    assert (
+        _ruleset_for_file(ruleset_map, "./services/api/Jenkinsfile")
+        == f"file:{tmp_path}/services.groovy,rulesets/basic.xml"
+    )
+    assert _ruleset_for_file(ruleset_map, "services/legacy/a.groovy") == (
+        "rulesets/basic.xml"
+    )
+    assert _ruleset_for_file({"vars": "rulesets/basic.xml"}, "src/a.groovy") is None
+
+
 def test_run_codenarc(default_jar_versions: dict[str, str]) -> None:
     """Test that run_codenarc exits without errors if CodeNarc ran successfully."""
-    with patch("os.remove"), patch("os.path.exists") as path_exists_mock:
-        path_exists_mock.return_value = True
-        with patch("subprocess.run") as subprocess_mock:
-            subprocess_mock.return_value = subprocess.CompletedProcess(
-                args="", returncode=0, stdout=MOCK_CODENARC_SUMMARY
-            )
+    with (
+        patch("os.remove"),
+        patch("os.path.exists", return_value=True),
+        patch("run_codenarc._is_groovy4", return_value=False),
+        patch("subprocess.Popen", return_value=_mock_process(MOCK_CODENARC_SUMMARY)),
+    ):
+        output = run_codenarc(
+            args=parse_args(args=[], default_jar_versions=default_jar_versions),
+            report_file=_report_file_path("success.xml"),
+        )
 
-            output = run_codenarc(
-                args=parse_args(args=[], default_jar_versions=default_jar_versions),
-                report_file=_report_file_path("success.xml"),
-            )
+    assert _report_file_path("success.xml") == output
 
-    assert _report_file_contents("success.xml") == output
 
+def test_run_codenarc_cached(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that run_codenarc_cached only analyzes files without cached results."""
+    basedir = tmp_path / "src"
+    (basedir / "vars").mkdir(parents=True)
+    (basedir / "Jenkinsfile").write_text("node {}\n")
+    (basedir / "vars" / "foo.groovy").write_text("def foo() {}\n")
+    (basedir / "vars" / "bar.txt").write_text("not groovy\n")
+    report_file = str(tmp_path / "report.xml")
 
-def test_run_codenarc_compilation_failure(default_jar_versions: dict[str, str]) -> None:
+    def mock_run_codenarc(
+        _args: argparse.Namespace,
+        report_file: str,
+        source_files: list[str],
+        _rulesets: str | None = None,
+    ) -> str:
+        _write_xml_report(
+            report_file,
+            len(source_files),
+            {
+                "vars/foo.groovy": [
+                    {
+                        "ruleName": "MethodReturnTypeRequired",
+                        "priority": "3",
+                        "lineNumber": "1",
+                        "sourceLine": "def foo() {}",
+                        "message": 'Method "foo" has a dynamic return type',
+                    }
+                ]
+            },
+        )
+        return report_file
+
+    with patch("run_codenarc._is_groovy4", return_value=True):
+        args = parse_args(
+            args=[
+                "--cache-dir",
+                str(tmp_path / "cache"),
+                "--",
+                f"-basedir={basedir}",
+                "-includes=./Jenkinsfile,**/*.groovy",
+            ],
+            default_jar_versions=default_jar_versions,
+        )
+
+    with patch("run_codenarc.run_codenarc", side_effect=mock_run_codenarc) as run_mock:
+        for _ in range(2):
+            with pytest.raises(CodeNarcViolationsError) as raised_error:
+                parse_xml_report(run_codenarc_cached(args, report_file))
+            assert raised_error.value.num_violations == 1
+        run_mock.assert_called_once()
+        assert run_mock.call_args.args[2] == ["Jenkinsfile", "vars/foo.groovy"]
+
+        # Changing a file should only cause that file to be analyzed again.
+        (basedir / "Jenkinsfile").write_text("node { }\n")
+        with pytest.raises(CodeNarcViolationsError):
+            parse_xml_report(run_codenarc_cached(args, report_file))
+        assert run_mock.call_args.args[2] == ["Jenkinsfile"]
+
+
+@pytest.mark.parametrize("fail_fast", [False, True])
+def test_run_codenarc_compilation_failure(
+    default_jar_versions: dict[str, str], *, fail_fast: bool
+) -> None:
     """Test that run_codenarc raises an error if CodeNarc found compilation errors."""
+    process = _mock_process(
+        b"INFO org.codenarc.source.AbstractSourceCode - Compilation"
+        b" failed because of"
+        b" [org.codehaus.groovy.control.CompilationErrorsException] with"
+        b" message: [startup failed:\n" + MOCK_CODENARC_SUMMARY
+    )
     with (
-        patch("subprocess.run") as subprocess_mock,
         patch("run_codenarc._build_classpath", return_value=""),
+        patch("run_codenarc._is_groovy4", return_value=False),
+        patch("subprocess.Popen", return_value=process),
     ):
-        subprocess_mock.return_value = subprocess.CompletedProcess(
-            args="",
-            returncode=0,
-            stdout=b"INFO org.codenarc.source.AbstractSourceCode - Compilation"
-            b" failed because of"
-            b" [org.codehaus.groovy.control.CompilationErrorsException] with"
-            b" message: [startup failed:\n" + MOCK_CODENARC_SUMMARY,
+        args = parse_args(
+            args=["--fail-fast"] if fail_fast else [],
+            default_jar_versions=default_jar_versions,
         )
-
         with pytest.raises(CompilationError):
-            run_codenarc(
-                args=parse_args(args=[], default_jar_versions=default_jar_versions)
-            )
+            run_codenarc(args=args, report_file="invalid")
+
+    # With --fail-fast, CodeNarc is stopped without reading the rest of its output.
+    assert process.kill.called == fail_fast
+    assert bool(process.stdout.read()) == fail_fast
 
 
 def test_run_codenarc_failure_code(default_jar_versions: dict[str, str]) -> None:
     """Test that run_codenarc raises an error if CodeNarc failed to run."""
     with (
-        patch("subprocess.run") as subprocess_mock,
         patch("run_codenarc._build_classpath", return_value=""),
+        patch("run_codenarc._is_groovy4", return_value=False),
+        patch("subprocess.Popen", return_value=_mock_process(b"", returncode=1)),
+        pytest.raises(CodeNarcError),
     ):
-        subprocess_mock.return_value = subprocess.CompletedProcess(
-            args="", returncode=1, stdout=MOCK_CODENARC_SUMMARY
+        run_codenarc(
+            args=parse_args(args=[], default_jar_versions=default_jar_versions),
+            report_file="invalid",
         )
 
-        with pytest.raises(CodeNarcError):
-            run_codenarc(
-                args=parse_args(args=[], default_jar_versions=default_jar_versions)
-            )
+
+def test_run_codenarc_metrics(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that the phases of a run and CodeNarc's summary are written as metrics."""
+    with (
+        patch("run_codenarc._build_classpath", return_value=""),
+        patch("run_codenarc._is_groovy4", return_value=False),
+        patch("subprocess.Popen", return_value=_mock_process(MOCK_CODENARC_SUMMARY)),
+    ):
+        args = parse_args(args=[], default_jar_versions=default_jar_versions)
+        run_codenarc(args=args, report_file=_report_file_path("success.xml"))
+    with pytest.raises(CodeNarcViolationsError):
+        parse_xml_report(
+            _report_file_path("multiple-violations-multiple-files-2.xml"), args
+        )
+
+    _write_metrics(str(tmp_path / "metrics.json"), args.metrics)
+    metrics = json.loads((tmp_path / "metrics.json").read_text())
+    assert set(metrics["phases"]) == {"codenarc", "groovy_version"}
+    assert metrics["codenarc_runs"] == 1
+    assert metrics["codenarc_analysis_seconds"] == 6.664  # noqa: PLR2004
+    assert metrics["reported_violations"] == 5  # noqa: PLR2004
+
+    _write_metrics(str(tmp_path / "metrics.prom"), args.metrics)
+    prometheus_lines = (tmp_path / "metrics.prom").read_text().splitlines()
+    assert "groovylint_codenarc_runs 1" in prometheus_lines
+    assert "groovylint_reported_violations 5" in prometheus_lines
 
 
 def test_run_codenarc_no_report_file(default_jar_versions: dict[str, str]) -> None:
     """Test that run_codenarc raises an error if CodeNarc did not produce a report."""
     with (
-        patch("subprocess.run") as subprocess_mock,
         patch("run_codenarc._build_classpath", return_value=""),
+        patch("run_codenarc._is_groovy4", return_value=False),
+        patch("subprocess.Popen", return_value=_mock_process(MOCK_CODENARC_SUMMARY)),
+        pytest.raises(MissingReportFileError),
+    ):
+        run_codenarc(
+            args=parse_args(args=[], default_jar_versions=default_jar_versions),
+            report_file="invalid",
+        )
+
+
+@pytest.mark.parametrize("jobs", [1, 2, 4])
+def test_run_codenarc_parallel(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path, jobs: int
+) -> None:
+    """Test that run_codenarc_parallel merges the reports of all shards."""
+    source_files = ["a.groovy", "b.groovy", "vars/c.groovy"]
+    with patch("subprocess.run"):
+        args = parse_args(
+            args=["--jobs", str(jobs)], default_jar_versions=default_jar_versions
+        )
+
+    with patch("run_codenarc.run_codenarc", side_effect=_mock_run_codenarc_shard):
+        report_file = run_codenarc_parallel(
+            args, str(tmp_path / "report.xml"), source_files
+        )
+
+    with pytest.raises(CodeNarcViolationsError) as raised_error:
+        parse_xml_report(report_file)
+    assert raised_error.value.num_violations == len(source_files)
+
+
+def test_run_codenarc_parallel_compilation_failure(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that run_codenarc_parallel raises errors from any of the shards."""
+    with patch("subprocess.run"):
+        args = parse_args(args=["--jobs", "2"], default_jar_versions=default_jar_versions)
+
+    with (
+        patch("run_codenarc.run_codenarc", side_effect=_mock_run_codenarc_shard),
+        pytest.raises(CompilationError),
+    ):
+        run_codenarc_parallel(
+            args, str(tmp_path / "report.xml"), ["a.groovy", "broken.groovy"]
+        )
+
+
+def test_run_codenarc_parallel_fail_fast(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that --fail-fast kills the CodeNarc processes of the other shards."""
+    killed = threading.Event()
+    slow_process = MagicMock()
+    slow_process.__enter__.return_value = slow_process
+    slow_process.kill.side_effect = killed.set
+
+    def slow_output() -> Iterator[str]:
+        # The process only finishes once it is killed, or after a long time otherwise.
+        killed.wait(10)
+        yield from ()
+
+    slow_process.stdout = slow_output()
+    slow_process.wait.return_value = -9
+
+    def mock_popen(codenarc_call: list[str], **_kwargs: object) -> MagicMock:
+        if "-sourcefiles=broken.groovy" not in codenarc_call:
+            return slow_process
+        return _mock_process(
+            b"INFO org.codenarc.source.AbstractSourceCode - Compilation failed\n"
+        )
+
+    # Files of the same size are put into different shards.
+    for path in ("a.groovy", "broken.groovy"):
+        (tmp_path / path).write_text("println 'hello'\n")
+    with patch("subprocess.run"):
+        args = parse_args(
+            args=["--jobs", "2", "--fail-fast", "--", f"-basedir={tmp_path}"],
+            default_jar_versions=default_jar_versions,
+        )
+    args.classpath = str(tmp_path)
+
+    with (
+        patch("run_codenarc._is_groovy4", return_value=False),
+        patch("subprocess.Popen", side_effect=mock_popen),
+        pytest.raises(CompilationError),
+    ):
+        run_codenarc_parallel(
+            args, str(tmp_path / "report.xml"), ["a.groovy", "broken.groovy"]
+        )
+
+    assert killed.is_set()
+
+
+def test_run_codenarc_parallel_file_order(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that violations are reported in the same order as the files were given."""
+    files = ["vars/b.groovy", "a.groovy", "vars/a.groovy", "Jenkinsfile"]
+    with patch("subprocess.run"):
+        args = parse_args(
+            args=["--jobs", "2", "--files", *files],
+            default_jar_versions=default_jar_versions,
+        )
+
+    with (
+        patch("run_codenarc.run_codenarc", side_effect=_mock_run_codenarc_shard),
+        patch("run_codenarc.log") as log_mock,
+        pytest.raises(CodeNarcViolationsError),
+    ):
+        parse_xml_report(run_codenarc_parallel(args, str(tmp_path / "report.xml")))
+
+    reported_files = [
+        log_call.args[1]
+        for log_call in log_mock.error.call_args_list
+        if log_call.args[0] == "%s:%s: %s: %s"
+    ]
+    assert reported_files == [
+        "vars/b.groovy",
+        "./a.groovy",
+        "vars/a.groovy",
+        "./Jenkinsfile",
+    ]
+
+
+@pytest.mark.parametrize("exclude_slow_files", [False, True])
+def test_run_codenarc_parallel_slow_files(
+    default_jar_versions: dict[str, str],
+    tmp_path: pathlib.Path,
+    *,
+    exclude_slow_files: bool,
+) -> None:
+    """Test that the files which make CodeNarc time out are found by bisection."""
+    source_files = ["a.groovy", "b.groovy", "slow.groovy", "c.groovy", "d.groovy"]
+    with patch("subprocess.run"):
+        args = parse_args(
+            args=["--timeout", "5", *(["--exclude-slow-files"] * exclude_slow_files)],
+            default_jar_versions=default_jar_versions,
+        )
+
+    with patch(
+        "run_codenarc.run_codenarc", side_effect=_mock_run_codenarc_shard
+    ) as run_codenarc_mock:
+        if not exclude_slow_files:
+            with pytest.raises(SlowFilesError) as raised_error:
+                run_codenarc_parallel(args, str(tmp_path / "report.xml"), source_files)
+            assert raised_error.value.paths == ["slow.groovy"]
+            return
+
+        report_file = run_codenarc_parallel(
+            args, str(tmp_path / "report.xml"), source_files
+        )
+
+    # All files, then each half, then the halves of the half with the slow file.
+    assert run_codenarc_mock.call_count == 5  # noqa: PLR2004
+    assert args.metrics["slow_files"] == {"slow.groovy": 5.0}
+    with pytest.raises(CodeNarcViolationsError) as raised_error:
+        parse_xml_report(report_file)
+    assert raised_error.value.num_violations == len(source_files) - 1
+    assert ET.parse(report_file).find("PackageSummary").get("totalFiles") == str(
+        len(source_files)
+    )
+
+
+def test_run_codenarc_parallel_slow_files_limit(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that bisection stops after a limited number of timeouts."""
+    source_files = [f"slow.groovy-{index}" for index in range(64)]
+    with patch("subprocess.run"):
+        args = parse_args(
+            args=["--timeout", "5", "--exclude-slow-files"],
+            default_jar_versions=default_jar_versions,
+        )
+
+    with (
+        patch("run_codenarc.MAX_BISECT_TIMEOUTS", 3),
+        patch(
+            "run_codenarc.run_codenarc",
+            side_effect=CodeNarcTimeoutError(5.0, "timeout of 5s"),
+        ) as run_codenarc_mock,
     ):
-        subprocess_mock.return_value = subprocess.CompletedProcess(
-            args="", returncode=0, stdout=MOCK_CODENARC_SUMMARY
+        report_file = run_codenarc_parallel(
+            args, str(tmp_path / "report.xml"), source_files
         )
 
-        with pytest.raises(MissingReportFileError):
-            run_codenarc(
-                args=parse_args(args=[], default_jar_versions=default_jar_versions),
-                report_file="invalid",
+    # All files and one half are split, then each remaining part is run once.
+    assert run_codenarc_mock.call_count == 5  # noqa: PLR2004
+    assert sorted(args.metrics["slow_files"]) == sorted(source_files)
+    assert ET.parse(report_file).find("PackageSummary").get("totalFiles") == "64"
+
+
+def test_run_codenarc_server(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that run_codenarc sends jobs to a running CodeNarc server."""
+    socket_path = str(tmp_path / "server.sock")
+    requests = []
+
+    def serve(server: socket.socket) -> None:
+        connection, _ = server.accept()
+        with connection, connection.makefile("rb") as request:
+            requests.append(list(iter(request.readline, b"\n")))
+            connection.sendall(MOCK_CODENARC_SUMMARY + b"groovylint-server-exit: 0\n")
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(socket_path)
+        server.listen()
+        server_thread = threading.Thread(target=serve, args=(server,))
+        server_thread.start()
+
+        with patch("subprocess.run"):
+            args = parse_args(
+                args=["--server-socket", socket_path],
+                default_jar_versions=default_jar_versions,
             )
+        with patch("subprocess.Popen") as popen_mock:
+            output = run_codenarc(args=args, report_file=_report_file_path("success.xml"))
+        server_thread.join()
+
+    popen_mock.assert_not_called()
+    assert output == _report_file_path("success.xml")
+    assert f"-basedir={os.getcwd()}\n".encode() in requests[0]
+
+
+def test_run_codenarc_slim_classpath(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that a bundle JAR is built by the first run, and replaced if it is broken."""
+    _make_jar(tmp_path / "lib" / "a.jar", {"a/A.class": "A", "b/B.class": "B"})
+    with patch("subprocess.run"):
+        args = parse_args(
+            ["--slim-classpath", "--resources", str(tmp_path)], default_jar_versions
+        )
+    args.classpath = f"{tmp_path}/lib/*:{tmp_path}"
+    classpaths = []
+
+    def mock_popen(call: list[str], **_kwargs: object) -> MagicMock:
+        classpaths.append(call[call.index("-classpath") + 1])
+        log_options = [option for option in call if option.startswith("-Xlog:")]
+        if log_options:
+            log_file = log_options[0].split(":")[2].removeprefix("file=")
+            pathlib.Path(log_file).write_text("a.A source: file:/lib/a.jar\n")
+            return _mock_process(MOCK_CODENARC_SUMMARY)
+        return _mock_process(
+            b"java.lang.NoClassDefFoundError: b/B\n" + MOCK_CODENARC_SUMMARY
+        )
+
+    with patch("subprocess.Popen", side_effect=mock_popen):
+        run_codenarc(args=args, report_file=_report_file_path("success.xml"))
+        (bundle,) = (path for path in tmp_path.iterdir() if path.suffix == ".jar")
+        # The bundle only has the class which was loaded, so the next run falls back to
+        # the full classpath.
+        run_codenarc(args=args, report_file=_report_file_path("success.xml"))
+
+    assert classpaths == [
+        args.classpath,
+        f"{bundle}:{args.classpath}",
+        args.classpath,
+    ]
+    with zipfile.ZipFile(bundle) as bundle_file:
+        assert "a/A.class" in bundle_file.namelist()
+    assert sorted(path.name for path in tmp_path.iterdir()) == [bundle.name, "lib"]
+
+
+def test_run_codenarc_slim_classpath_unloaded_class(
+    default_jar_versions: dict[str, str], tmp_path: pathlib.Path
+) -> None:
+    """Test that classes which the first run never loaded resolve with a bundle JAR."""
+    _make_jar(tmp_path / "lib" / "a.jar", {"a/A.class": "A"})
+    _make_jar(tmp_path / "lib" / "b.jar", {"b/B.class": "B"})
+    with patch("subprocess.run"):
+        args = parse_args(
+            ["--slim-classpath", "--resources", str(tmp_path)], default_jar_versions
+        )
+    args.classpath = f"{tmp_path}/lib/*:{tmp_path}"
+    classpaths = []
+    fail_with_bundle = False
+
+    def mock_popen(call: list[str], **_kwargs: object) -> MagicMock:
+        classpath = call[call.index("-classpath") + 1]
+        classpaths.append(classpath)
+        log_options = [option for option in call if option.startswith("-Xlog:")]
+        if log_options:
+            log_file = log_options[0].split(":")[2].removeprefix("file=")
+            pathlib.Path(log_file).write_text("a.A source: file:/lib/a.jar\n")
+        # Imports.groovy imports b.B, which is only in b.jar.
+        if "-sourcefiles=Imports.groovy" in call and (
+            f"{tmp_path}/lib/*" not in classpath.split(":")
+            or (fail_with_bundle and classpath != args.classpath)
+        ):
+            return _mock_process(
+                b"INFO org.codenarc.source.AbstractSourceCode - Compilation failed"
+                b" for Imports.groovy: unable to resolve class b.B\n"
+                + MOCK_CODENARC_SUMMARY
+            )
+        return _mock_process(MOCK_CODENARC_SUMMARY)
+
+    with patch("subprocess.Popen", side_effect=mock_popen):
+        run_codenarc(args, _report_file_path("success.xml"), source_files=["A.groovy"])
+        (bundle,) = (path for path in tmp_path.iterdir() if path.suffix == ".jar")
+        run_codenarc(
+            args, _report_file_path("success.xml"), source_files=["Imports.groovy"]
+        )
+        # If a file still fails to compile with the bundle, CodeNarc is run again with
+        # the full classpath.
+        fail_with_bundle = True
+        run_codenarc(
+            args, _report_file_path("success.xml"), source_files=["Imports.groovy"]
+        )
+
+    assert classpaths == [
+        args.classpath,
+        f"{bundle}:{args.classpath}",
+        f"{bundle}:{args.classpath}",
+        args.classpath,
+    ]
+    with zipfile.ZipFile(bundle) as bundle_file:
+        assert "b/B.class" not in bundle_file.namelist()
+    assert bundle.exists()
+
+
+def test_shard_files(tmp_path: pathlib.Path) -> None:
+    """Test that _shard_files splits files into shards of about the same size."""
+    sizes = {"a.groovy": 100, "b.groovy": 10, "c.groovy": 60, "d.groovy": 50}
+    for name, size in sizes.items():
+        (tmp_path / name).write_text("x" * size)
+
+    assert _shard_files(str(tmp_path), list(sizes), 2) == [
+        ["a.groovy", "b.groovy"],
+        ["c.groovy", "d.groovy"],
+    ]
+    assert _shard_files(str(tmp_path), ["a.groovy"], 4) == [["a.groovy"]]
+
+
+@pytest.mark.parametrize(
+    ("timeout", "progress_timeout"), [(0.2, None), (None, 0.2), (0.2, 0.2)]
+)
+def test_watchdog(timeout: float | None, progress_timeout: float | None) -> None:
+    """Test that the watchdog kills a process which runs for too long."""
+    with (
+        subprocess.Popen([sys.executable, "-c", "import time; time.sleep(9)"]) as process,
+        pytest.raises(CodeNarcTimeoutError) as raised_error,
+        _watchdog(process, timeout, progress_timeout),
+    ):
+        process.wait()
+    assert raised_error.value.seconds < 5  # noqa: PLR2004
+
+    with (
+        subprocess.Popen([sys.executable, "-c", "pass"]) as process,
+        _watchdog(process, 5, 5),
+    ):
+        assert process.wait() == 0
@@ -15,6 +15,12 @@
  *            to check. <strong>(required)</strong>.
  *          </li>
  *          <li>
+ *            {@code changedSince}: If specified, only check files matching
+ *            {@code includesPattern} which were changed since the merge base of this git
+ *            ref and {@code HEAD}, for example {@code 'origin/main'}. CodeNarc is not run
+ *            at all if no such files were changed.
+ *          </li>
+ *          <li>
  *            {@code codeNarcArgs}: Extra arguments to pass to CodeNarc. Callers will
  *            have to escape these arguments if necessary.
  *          </li>
@@ -35,6 +41,9 @@ void check(Map args = [:]) {
   String includesPattern = args.includesPattern
   String groovylintArgs = args.groovylintArgs ?: ''
   String codeNarcArgs = args.codeNarcArgs ?: ''
+  if (args.changedSince) {
+    groovylintArgs += " --changed-since ${args.changedSince}"
+  }
 
   Object image = args.groovylintImage
   if (!image) {
@@ -54,6 +63,118 @@ void check(Map args = [:]) {
 }
 
 
+/**
+ * Check a set of files with the {@code groovylint} Docker image, split into shards which
+ * are checked in parallel on separate agents.
+ *
+ * Each shard checks out the job's SCM on its own agent, and runs {@code run_codenarc.py}
+ * with {@code --shard}. Afterwards, the reports of all shards are merged and their
+ * violations are reported on the current node, which must be able to run Docker.
+ * @param args Map of arguments, which may include:
+ *        <ul>
+ *          <li>
+ *            {@code includesPattern}: A comma-separated list of Ant-style file patterns
+ *            to check. <strong>(required)</strong>.
+ *          </li>
+ *          <li>
+ *            {@code shards}: Number of shards to split the files into
+ *            <strong>(required)</strong>.
+ *          </li>
+ *          <li>
+ *            {@code agentLabel}: If specified, run the shards on agents with this label.
+ *          </li>
+ *          <li>
+ *            {@code codeNarcArgs}: Extra arguments to pass to CodeNarc. Callers will
+ *            have to escape these arguments if necessary.
+ *          </li>
+ *          <li>
+ *            {@code groovylintArgs}: Extra arguments to pass to {@code run_codenarc.py}
+ *            for each shard. Callers will have to escape these arguments if necessary.
+ *          </li>
+ *          <li>
+ *            {@code mergeArgs}: Extra arguments to pass to the {@code merge-reports}
+ *            subcommand of {@code run_codenarc.py}, for example {@code --baseline}.
+ *            Callers will have to escape these arguments if necessary.
+ *          </li>
+ *          <li>
+ *            {@code groovylintImage}: If specified, use this Docker image handle to run
+ *            {@code groovylint}. If {@code null}, then this function will try to fetch
+ *            {@code groovylint} from Docker hub using the same version number
+ *            corresponding to this library.
+ *          </li>
+ *        </ul>
+ */
+void checkParallel(Map args = [:]) {
+  assert args.includesPattern
+  assert args.shards
+  int shards = args.shards as int
+  String includesPattern = args.includesPattern
+  String groovylintArgs = args.groovylintArgs ?: ''
+  String codeNarcArgs = args.codeNarcArgs ?: ''
+  String mergeArgs = args.mergeArgs ?: ''
+
+  Object image = args.groovylintImage
+  boolean pullImage = !image
+  if (!image) {
+    String version = env['library.groovylint.version']
+    if (!version) {
+      error 'Could not find groovylint version in environment'
+    }
+    image = docker.image("abletonag/groovylint:${version}")
+  }
+  echo "Using groovylint Docker image: ${image.id}"
+
+  Map branches = [:]
+  List<String> reportFiles = []
+  for (int i = 1; i <= shards; i++) {
+    String shard = "${i}/${shards}"
+    String reportFile = "codenarc-shard-${i}.xml"
+    String stashName = "groovylint-shard-${i}"
+    reportFiles.add(reportFile)
+    branches["groovylint ${shard}"] = {
+      Closure checkShard = {
+        checkout scm
+        // The workspace may still have the report of an earlier build.
+        sh "rm -f ${reportFile}"
+        if (pullImage) {
+          image.pull()
+        }
+        image.inside {
+          // Violations are reported when merging, so only a missing report is an error.
+          // The report was deleted above, so a shard which failed has no report.
+          sh(
+            returnStatus: true,
+            script: "python3 /opt/run_codenarc.py ${groovylintArgs} --shard ${shard}" +
+              " --report-file ${reportFile} -- -includes=${includesPattern}" +
+              " ${codeNarcArgs}",
+          )
+        }
+        if (!fileExists(reportFile)) {
+          error "groovylint shard ${shard} failed before writing a report"
+        }
+        stash name: stashName, includes: reportFile
+      }
+      if (args.agentLabel) {
+        node(args.agentLabel, checkShard)
+      } else {
+        node(checkShard)
+      }
+    }
+  }
+  parallel branches
+
+  for (int i = 1; i <= shards; i++) {
+    unstash "groovylint-shard-${i}"
+  }
+  if (pullImage) {
+    image.pull()
+  }
+  image.inside {
+    sh "python3 /opt/run_codenarc.py merge-reports ${mergeArgs} ${reportFiles.join(' ')}"
+  }
+}
+
+
 /**
  * Check a single file with the {@code groovylint} Docker image.
  * @param args Map of arguments, which may include: